@@ -0,0 +1,194 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import prices
+
+# Bulk history backfill into a local store of numpy chunk files:
+#
+#     python backfill.py --from 2022-01-01 --to 2025-01-01 --kind M1 --kind ticks --workers 4
+#     python backfill.py --export XAUUSD ticks 2024-01-01 2024-02-01 ticks.npy
+#
+# The date range is split into chunks (--chunk-days) that worker processes
+# download in parallel, each attached to one of the --terminal paths in turn.
+# Every chunk is trimmed to [start, end) so neighbouring chunks never overlap,
+# encoded as integer-point deltas (see prices.py), written atomically as
+# history/<symbol>/<kind>/<start>.npz and recorded in that directory's
+# manifest.json, so an interrupted run resumes where it stopped. --export
+# decodes and stitches a range into one .npy array for backtest_ticks.py.
+
+STORE = "history"
+BAR_KINDS = {"M1": "TIMEFRAME_M1", "M5": "TIMEFRAME_M5", "M15": "TIMEFRAME_M15", "M30": "TIMEFRAME_M30", "H1": "TIMEFRAME_H1"}
+KINDS = list(BAR_KINDS) + ["ticks"]
+DEFAULT_CHUNK_DAYS = {"ticks": 1}
+
+_mt5 = None
+
+# Function to connect a worker process to its terminal
+def _init_worker(terminals, counter):
+    global _mt5
+    import MetaTrader5 as mt5
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    path = terminals[index % len(terminals)] if terminals else None
+    if not (mt5.initialize(path=path) if path else mt5.initialize()):
+        raise RuntimeError(f"Backfill worker failed to initialize MT5 ({path}): {mt5.last_error()}")
+    _mt5 = mt5
+
+def chunk_path(root, symbol, kind, start):
+    return os.path.join(root, symbol, kind, f"{start:%Y-%m-%d}.npz")
+
+# Function to download one chunk in a worker and write it to the store.
+# Returns the number of rows written.
+def fetch_chunk(root, symbol, kind, start_ts, end_ts, retries=3):
+    start = datetime.fromtimestamp(start_ts, tz=timezone.utc)
+    end = datetime.fromtimestamp(end_ts, tz=timezone.utc)
+    for attempt in range(1, retries + 1):
+        if kind == "ticks":
+            data = _mt5.copy_ticks_range(symbol, start, end, _mt5.COPY_TICKS_ALL)
+            times = data["time_msc"] / 1000 if data is not None else None
+        else:
+            data = _mt5.copy_rates_range(symbol, getattr(_mt5, BAR_KINDS[kind]), start, end)
+            times = data["time"] if data is not None else None
+        if data is not None:
+            break
+        error = _mt5.last_error()
+        if attempt == retries:
+            raise RuntimeError(f"{symbol} {kind} {start:%Y-%m-%d}: {error}")
+        time.sleep(attempt)
+    # Ranges are inclusive at the end: keep [start, end) only
+    data = data[(times >= start_ts) & (times < end_ts)]
+    symbol_info = _mt5.symbol_info(symbol)
+    if symbol_info is None:
+        raise RuntimeError(f"{symbol}: no symbol info to encode prices with")
+    prices.save(chunk_path(root, symbol, kind, start), prices.encode(data, symbol_info.point))
+    return len(data)
+
+def _manifest_path(root, symbol, kind):
+    return os.path.join(root, symbol, kind, "manifest.json")
+
+def load_manifest(root, symbol, kind):
+    try:
+        with open(_manifest_path(root, symbol, kind), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(root, symbol, kind, manifest):
+    path = _manifest_path(root, symbol, kind)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+# Function to split [start, end) into chunk boundaries
+def make_chunks(start, end, days):
+    chunks = []
+    current = start
+    while current < end:
+        chunk_end = min(current + timedelta(days=days), end)
+        chunks.append((current, chunk_end))
+        current = chunk_end
+    return chunks
+
+# Function to backfill every symbol and kind, skipping checkpointed chunks
+def backfill(symbols, kinds, start, end, root=STORE, workers=2, terminals=(), chunk_days=None, retries=3):
+    jobs = []
+    manifests = {}
+    for symbol in symbols:
+        for kind in kinds:
+            os.makedirs(os.path.join(root, symbol, kind), exist_ok=True)
+            manifest = manifests[(symbol, kind)] = load_manifest(root, symbol, kind)
+            days = chunk_days or DEFAULT_CHUNK_DAYS.get(kind, 30)
+            for chunk_start, chunk_end in make_chunks(start, end, days):
+                key = f"{chunk_start:%Y-%m-%d}"
+                done = manifest.get(key)
+                if done is not None and done["end"] == chunk_end.timestamp() and os.path.exists(chunk_path(root, symbol, kind, chunk_start)):
+                    continue
+                jobs.append((symbol, kind, key, chunk_start.timestamp(), chunk_end.timestamp()))
+    total = sum(len(make_chunks(start, end, chunk_days or DEFAULT_CHUNK_DAYS.get(k, 30))) for k in kinds) * len(symbols)
+    print(f"{total - len(jobs)} of {total} chunks already done, downloading {len(jobs)} with {workers} workers")
+    if not jobs:
+        return 0
+    failures = 0
+    started = time.perf_counter()
+    counter = multiprocessing.Value("i", 0)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(list(terminals), counter)) as pool:
+        futures = {pool.submit(fetch_chunk, root, symbol, kind, start_ts, end_ts, retries): (symbol, kind, key, end_ts)
+                   for symbol, kind, key, start_ts, end_ts in jobs}
+        for done_count, future in enumerate(as_completed(futures), 1):
+            symbol, kind, key, end_ts = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{symbol}] {kind} {key} failed: {e}")
+                continue
+            manifest = manifests[(symbol, kind)]
+            manifest[key] = {"end": end_ts, "rows": rows}
+            save_manifest(root, symbol, kind, manifest)
+            print(f"[{symbol}] {kind} {key}: {rows} rows ({done_count}/{len(jobs)}, {time.perf_counter() - started:.0f}s)")
+    if failures:
+        print(f"{failures} chunks failed; run the same command again to retry them")
+    return failures
+
+# Function to load [start, end) of a symbol's history from the store as one
+# array. With points=True prices come back as integer points.
+def load_range(symbol, kind, start, end, root=STORE, points=False):
+    manifest = load_manifest(root, symbol, kind)
+    parts = []
+    for key in sorted(manifest):
+        chunk_start = datetime.strptime(key, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        if manifest[key]["end"] <= start.timestamp() or chunk_start >= end or not manifest[key]["rows"]:
+            continue
+        data = prices.decode(prices.load(chunk_path(root, symbol, kind, chunk_start)), points)
+        times = data["time_msc"] / 1000 if kind == "ticks" else data["time"]
+        parts.append(data[(times >= start.timestamp()) & (times < end.timestamp())])
+    if not parts:
+        return None
+    return np.concatenate(parts)
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel, resumable MT5 history backfill")
+    parser.add_argument("--from", dest="start", type=_parse_date, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=_parse_date, help="day after the last one (YYYY-MM-DD)")
+    parser.add_argument("--kind", action="append", choices=KINDS, help="data to download (repeatable, default M1)")
+    parser.add_argument("--symbol", action="append", help="symbols (default: trading.symbols from --config)")
+    parser.add_argument("--config", default="m.json")
+    parser.add_argument("--store", default=STORE)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--terminal", action="append", default=[], help="terminal64.exe path, repeat to spread workers")
+    parser.add_argument("--chunk-days", type=int, help="days per chunk (default 1 for ticks, 30 for bars)")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--export", nargs=5, metavar=("SYMBOL", "KIND", "FROM", "TO", "OUT"),
+                        help="write a stored range to one .npy file instead of downloading")
+    args = parser.parse_args()
+
+    if args.export:
+        symbol, kind, start, end, out = args.export
+        data = load_range(symbol, kind, _parse_date(start), _parse_date(end), args.store)
+        if data is None:
+            print(f"No stored {kind} for {symbol} between {start} and {end}")
+        else:
+            np.save(out, data)
+            print(f"Wrote {len(data)} rows to {out}")
+    else:
+        if args.start is None or args.end is None:
+            parser.error("--from and --to are required to download")
+        symbols = args.symbol
+        if not symbols:
+            with open(args.config, 'r') as f:
+                symbols = json.load(f)["trading"]["symbols"]
+        failed = backfill(symbols, args.kind or ["M1"], args.start, args.end, args.store,
+                          args.workers, args.terminal, args.chunk_days, args.retries)
+        raise SystemExit(1 if failed else 0)
@@ -0,0 +1,313 @@
+import argparse
+import hashlib
+import inspect
+import json
+import time
+
+import numpy as np
+
+from result_cache import ResultCache, CACHE_DIR
+
+# Tick-resolution backtest of the candle strategy and its counter order.
+# Every exit is resolved by the first tick that touches its level, so the
+# order of TP, SL, counter stop entry and counter TP/SL inside a bar is exact.
+#
+#     python backtest_ticks.py ticks.npy bars.npy --symbol XAUUSD --timeframe M15
+#
+# ticks.npy is an MT5 ticks array (copy_ticks_range), bars.npy an MT5 rates
+# array (copy_rates_range). Large tick files can be opened with mmap_mode="r".
+#
+# With --cache, entry signals and outcomes are kept in a result cache keyed
+# by the data, BACKTEST_VERSION and the settings, so re-running a parameter
+# set is a lookup. Entry signals don't depend on the exit settings and are
+# cached on their own, so a --sweep over tp/sl/counter reuses them:
+#
+#     python backtest_ticks.py ticks.npy bars.npy --cache --sweep tp=3,4,5,6
+
+BLOCK = 1024
+CHUNK = 4096
+
+EXIT_OPEN = 0
+EXIT_TP = 1
+EXIT_SL = 2
+
+OUTCOME_DTYPE = np.dtype([
+    ("entry_idx", "<i8"), ("direction", "<i1"), ("entry_price", "<f8"),
+    ("main_exit_idx", "<i8"), ("main_exit_reason", "<i1"), ("main_pnl", "<f8"),
+    ("counter_fill_idx", "<i8"), ("counter_exit_idx", "<i8"), ("counter_exit_reason", "<i1"),
+    ("counter_pnl", "<f8"), ("pnl", "<f8")
+])
+
+# Function to build the block maximum and minimum summaries of a price series
+def build_blocks(prices, block=BLOCK):
+    starts = np.arange(0, len(prices), block)
+    return np.maximum.reduceat(prices, starts), np.minimum.reduceat(prices, starts)
+
+# Function to scan ticks [starts, limits) in windows of at most `width` for the
+# first touch of each level. Returns the index or -1, query by query.
+def _scan_ticks(prices, starts, limits, levels, up, width):
+    found = np.full(len(starts), -1, dtype=np.int64)
+    offsets = np.arange(width)
+    last = len(prices) - 1
+    for lo in range(0, len(starts), CHUNK):
+        hi = lo + CHUNK
+        idx = starts[lo:hi, None] + offsets
+        valid = idx < limits[lo:hi, None]
+        values = prices[np.minimum(idx, last)]
+        level = levels[lo:hi, None]
+        hit = (values >= level if up else values <= level) & valid
+        any_hit = hit.any(axis=1)
+        found[lo:hi][any_hit] = idx[any_hit, hit[any_hit].argmax(axis=1)]
+    return found
+
+# Function to find, for every query, the first index j in [starts, ends) with
+# prices[j] >= level (up) or prices[j] <= level (down); -1 if never touched.
+# Works block-wise: the start block is scanned tick by tick, later blocks are
+# skipped using their max/min summary until one can contain the touch.
+def first_touch(prices, starts, levels, up, ends=None, blocks=None, block=BLOCK):
+    n = len(prices)
+    starts = np.asarray(starts, dtype=np.int64)
+    levels = np.asarray(levels, dtype=prices.dtype if prices.dtype.kind == "f" else np.float64)
+    ends = np.full(len(starts), n, dtype=np.int64) if ends is None else np.minimum(np.asarray(ends, dtype=np.int64), n)
+    result = np.full(len(starts), -1, dtype=np.int64)
+    if len(starts) == 0 or n == 0:
+        return result
+    if blocks is None:
+        blocks = build_blocks(prices, block)
+    summary = blocks[0] if up else blocks[1]
+    n_blocks = len(summary)
+
+    # Phase 1: the rest of the block each query starts in
+    active = np.flatnonzero(starts < ends)
+    block_end = (starts[active] // block + 1) * block
+    result[active] = _scan_ticks(prices, starts[active], np.minimum(block_end, ends[active]),
+                                 levels[active], up, block)
+
+    # Phase 2: gallop over block summaries for the queries still open
+    pending = active[(result[active] < 0) & (block_end < ends[active])]
+    cursor = starts[pending] // block + 1
+    last_block = (ends[pending] - 1) // block
+    hit_block = np.full(len(pending), -1, dtype=np.int64)
+    width = 8
+    open_q = np.arange(len(pending))
+    while len(open_q):
+        offsets = np.arange(width)
+        idx = cursor[open_q, None] + offsets
+        valid = idx <= last_block[open_q, None]
+        values = summary[np.minimum(idx, n_blocks - 1)]
+        level = levels[pending[open_q], None]
+        hit = (values >= level if up else values <= level) & valid
+        any_hit = hit.any(axis=1)
+        hit_block[open_q[any_hit]] = idx[any_hit, hit[any_hit].argmax(axis=1)]
+        cursor[open_q] += width
+        still = ~any_hit & (cursor[open_q] <= last_block[open_q])
+        open_q = open_q[still]
+        width = min(width * 2, max(8, (1 << 22) // max(1, len(open_q))))
+
+    # Phase 3: locate the exact tick inside the block that must contain it
+    located = hit_block >= 0
+    if located.any():
+        queries = pending[located]
+        block_start = hit_block[located] * block
+        result[queries] = _scan_ticks(prices, block_start, np.minimum(block_start + block, ends[queries]),
+                                      levels[queries], up, block)
+    return result
+
+# Function to turn bars into candle-direction entries at each bar close
+def candle_signals(bars, duration_seconds, min_candle_size_points, point, trade_mode="both"):
+    body = bars["close"] - bars["open"]
+    direction = np.sign(body).astype(np.int8)
+    direction[np.abs(body) < min_candle_size_points * point] = 0
+    if trade_mode == "buy_only":
+        direction[direction < 0] = 0
+    elif trade_mode == "sell_only":
+        direction[direction > 0] = 0
+    keep = direction != 0
+    entry_msc = (bars["time"][keep].astype(np.int64) + duration_seconds) * 1000
+    return entry_msc, direction[keep]
+
+# Function to simulate main trades and their counter stop orders over ticks.
+# Distances are in price units like the settings in m.json; P&L is in price
+# units times lots (multiply by contract size for account currency).
+def simulate(time_msc, bid, ask, entry_msc, directions, tp, sl, counter, tp_counter, sl_counter,
+             volume=1.0, M=5.0, counter_enabled=True, cancel_delay_ms=10000, block=BLOCK):
+    n = len(time_msc)
+    entry_idx = np.searchsorted(time_msc, entry_msc, side="left")
+    keep = entry_idx < n - 1
+    entry_idx = entry_idx[keep]
+    directions = np.asarray(directions)[keep]
+    k = len(entry_idx)
+    out = np.zeros(k, dtype=OUTCOME_DTYPE)
+    out["entry_idx"] = entry_idx
+    out["direction"] = directions
+    out["counter_fill_idx"] = -1
+    out["counter_exit_idx"] = -1
+    if k == 0:
+        return out
+    bid_blocks = build_blocks(bid, block)
+    ask_blocks = build_blocks(ask, block)
+    buy = directions > 0
+    sell = ~buy
+    entry_bid = bid[entry_idx]
+    entry_ask = ask[entry_idx]
+    entry_price = np.where(buy, entry_ask, entry_bid)
+    out["entry_price"] = entry_price
+    start = entry_idx + 1
+
+    def touch(group, series, blocks, levels, up, begin, ends=None):
+        idx = np.full(k, -1, dtype=np.int64)
+        rows = np.flatnonzero(group)
+        idx[rows] = first_touch(series, begin[rows], levels[rows], up,
+                                None if ends is None else ends[rows], blocks, block)
+        return idx
+
+    def earliest(a, b):
+        a = np.where(a < 0, n, a)
+        b = np.where(b < 0, n, b)
+        return np.minimum(a, b), a <= b
+
+    # Main trade: BUY closes on bid, SELL closes on ask
+    tp_buy = touch(buy, bid, bid_blocks, entry_price + tp, True, start)
+    sl_buy = touch(buy, bid, bid_blocks, entry_price - sl, False, start)
+    tp_sell = touch(sell, ask, ask_blocks, entry_price - tp, False, start)
+    sl_sell = touch(sell, ask, ask_blocks, entry_price + sl, True, start)
+    main_exit, main_tp = earliest(np.where(buy, tp_buy, tp_sell), np.where(buy, sl_buy, sl_sell))
+    closed = main_exit < n
+    exit_at = np.minimum(main_exit, n - 1)
+    exit_price = np.where(buy, bid[exit_at], ask[exit_at])
+    out["main_exit_idx"] = np.where(closed, main_exit, -1)
+    out["main_exit_reason"] = np.where(closed, np.where(main_tp, EXIT_TP, EXIT_SL), EXIT_OPEN)
+    out["main_pnl"] = np.where(buy, exit_price - entry_price, entry_price - exit_price)
+    out["pnl"] = out["main_pnl"] * volume
+    if not counter_enabled:
+        return out
+
+    # Counter stop order: live until it fills or the orphan sweep cancels it
+    # cancel_delay_ms after the main position closed
+    stop_price = np.where(buy, entry_ask - counter, entry_bid + counter)
+    cancel_msc = time_msc[exit_at] + cancel_delay_ms
+    cancel_idx = np.where(closed, np.searchsorted(time_msc, cancel_msc, side="right"), n)
+    fill_sell = touch(buy, bid, bid_blocks, stop_price, False, start, cancel_idx)
+    fill_buy = touch(sell, ask, ask_blocks, stop_price, True, start, cancel_idx)
+    fill = np.where(buy, fill_sell, fill_buy)
+    filled = fill >= 0
+    out["counter_fill_idx"] = fill
+    fill_at = np.where(filled, fill, 0)
+    # The counter is the opposite side: SELL (after a BUY) fills at bid and
+    # closes on ask, BUY (after a SELL) fills at ask and closes on bid
+    counter_entry = np.where(buy, bid[fill_at], ask[fill_at])
+    counter_tp_level = np.where(buy, stop_price - tp_counter, stop_price + tp_counter)
+    counter_sl_level = np.where(buy, entry_ask + sl_counter, entry_bid - sl_counter)
+    begin = fill_at + 1
+    c_tp_sell = touch(buy & filled, ask, ask_blocks, counter_tp_level, False, begin)
+    c_sl_sell = touch(buy & filled, ask, ask_blocks, counter_sl_level, True, begin)
+    c_tp_buy = touch(sell & filled, bid, bid_blocks, counter_tp_level, True, begin)
+    c_sl_buy = touch(sell & filled, bid, bid_blocks, counter_sl_level, False, begin)
+    c_exit, c_tp = earliest(np.where(buy, c_tp_sell, c_tp_buy), np.where(buy, c_sl_sell, c_sl_buy))
+    c_closed = filled & (c_exit < n)
+    c_at = np.minimum(c_exit, n - 1)
+    c_exit_price = np.where(buy, ask[c_at], bid[c_at])
+    out["counter_exit_idx"] = np.where(c_closed, c_exit, -1)
+    out["counter_exit_reason"] = np.where(c_closed, np.where(c_tp, EXIT_TP, EXIT_SL), EXIT_OPEN)
+    out["counter_pnl"] = np.where(filled, np.where(buy, counter_entry - c_exit_price, c_exit_price - counter_entry), 0.0)
+    out["pnl"] = out["main_pnl"] * volume + out["counter_pnl"] * volume * M
+    return out
+
+# Cached results are keyed by the source of everything that computes them,
+# so editing any of these functions invalidates the cache by itself
+BACKTEST_VERSION = hashlib.blake2b("\n".join(
+    [inspect.getsource(fn) for fn in (build_blocks, _scan_ticks, first_touch, candle_signals, simulate)]
+    + [str(OUTCOME_DTYPE)]).encode(), digest_size=8).hexdigest()
+
+# Function to print a summary of simulated outcomes
+def summarize(out):
+    filled = out["counter_fill_idx"] >= 0
+    print(f"Trades: {len(out)}")
+    print(f"Main: TP={np.sum(out['main_exit_reason'] == EXIT_TP)}, SL={np.sum(out['main_exit_reason'] == EXIT_SL)}, open={np.sum(out['main_exit_reason'] == EXIT_OPEN)}")
+    print(f"Counter: filled={np.sum(filled)}, TP={np.sum(filled & (out['counter_exit_reason'] == EXIT_TP))}, SL={np.sum(filled & (out['counter_exit_reason'] == EXIT_SL))}")
+    print(f"Total P&L: {out['pnl'].sum():.2f} (main {out['main_pnl'].sum():.2f}, counter {out['counter_pnl'].sum():.2f} per lot)")
+
+EXIT_SETTINGS = ("tp", "sl", "counter", "tp_counter", "sl_counter", "volume")
+
+# Function to parse --sweep NAME=V1,V2,... into (name, [values])
+def parse_sweep(text):
+    name, _, values = text.partition("=")
+    if name not in EXIT_SETTINGS + ("M",) or not values:
+        raise argparse.ArgumentTypeError(f"Expected NAME=V1,V2,... with NAME one of {', '.join(EXIT_SETTINGS + ('M',))}")
+    return name, [float(v) for v in values.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tick-level backtest of the candle strategy with counter orders")
+    parser.add_argument("ticks", help="MT5 ticks array saved with numpy.save")
+    parser.add_argument("bars", help="MT5 rates array saved with numpy.save")
+    parser.add_argument("--config", default="m.json")
+    parser.add_argument("--symbol", default="XAUUSD")
+    parser.add_argument("--point", type=float, default=0.01)
+    parser.add_argument("--timeframe", default="M15", choices=["M1", "M5", "M15", "M30", "H1"])
+    parser.add_argument("--cancel-delay-ms", type=int, default=10000)
+    parser.add_argument("--sweep", type=parse_sweep, help="run once per value of an exit setting, e.g. tp=3,4,5")
+    parser.add_argument("--cache", nargs="?", const=CACHE_DIR, help=f"cache signals and results in this directory (default {CACHE_DIR})")
+    parser.add_argument("--cache-mb", type=int, default=1024, help="evict least recently used cache entries beyond this size")
+    parser.add_argument("--out", help="save outcomes to this .npy file (with --sweep, the value is added to the name)")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    trading = config["trading"]
+    settings = trading["settings"][args.symbol]
+    duration = {"M1": 60, "M5": 300, "M15": 900, "M30": 1800, "H1": 3600}[args.timeframe]
+    cache = ResultCache(args.cache, args.cache_mb << 20) if args.cache else None
+
+    ticks = np.load(args.ticks, mmap_mode="r")
+    bars = np.load(args.bars)
+    start = time.perf_counter()
+    time_msc = np.ascontiguousarray(ticks["time_msc"])
+    bid = np.ascontiguousarray(ticks["bid"])
+    ask = np.ascontiguousarray(ticks["ask"])
+    entry_settings = {
+        "duration": duration,
+        "min_candle_size_points": trading["min_candle_size_points"],
+        "point": args.point,
+        "trade_mode": trading["trade_mode"]
+    }
+
+    def compute_signals():
+        entry_msc, directions = candle_signals(bars, duration, trading["min_candle_size_points"], args.point, trading["trade_mode"])
+        return {"entry_msc": entry_msc, "directions": directions}
+
+    if cache is not None:
+        bars_hash = cache.file_hash(args.bars)
+        ticks_hash = cache.file_hash(args.ticks)
+        signals = cache.memoize("signals", cache.key(bars_hash, BACKTEST_VERSION, entry_settings), compute_signals)
+    else:
+        signals = compute_signals()
+
+    name, values = args.sweep or (None, [None])
+    for value in values:
+        exit_settings = {key: settings[key] for key in EXIT_SETTINGS}
+        exit_settings["M"] = trading["M"]
+        exit_settings["counter_enabled"] = trading["counter_trade_enabled"] and trading["trade_mode"] == "both"
+        exit_settings["cancel_delay_ms"] = args.cancel_delay_ms
+        if name is not None:
+            exit_settings[name] = value
+            print(f"{name}={value:g}")
+
+        def compute_outcomes():
+            return {"outcomes": simulate(time_msc, bid, ask, signals["entry_msc"], signals["directions"],
+                                         exit_settings["tp"], exit_settings["sl"], exit_settings["counter"],
+                                         exit_settings["tp_counter"], exit_settings["sl_counter"],
+                                         exit_settings["volume"], exit_settings["M"], exit_settings["counter_enabled"],
+                                         exit_settings["cancel_delay_ms"])}
+
+        run_start = time.perf_counter()
+        if cache is not None:
+            key = cache.key(ticks_hash, bars_hash, BACKTEST_VERSION, entry_settings, exit_settings)
+            out = cache.memoize("outcomes", key, compute_outcomes)["outcomes"]
+        else:
+            out = compute_outcomes()["outcomes"]
+        print(f"Simulated {len(out)} trades over {len(time_msc)} ticks in {time.perf_counter() - run_start:.2f}s")
+        summarize(out)
+        if args.out:
+            np.save(args.out if name is None else args.out.replace(".npy", "") + f"_{name}{value:g}.npy", out)
+    if cache is not None:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses in {time.perf_counter() - start:.2f}s")
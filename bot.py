@@ -2,15 +2,31 @@ import telebot
 import json
 from telebot import types
 import re
+import threading
 from datetime import datetime
 
+import symbol_catalog
+from session_store import SessionStore
+
 # Initialize bot
 with open('config.json', 'r') as f:
     config = json.load(f)
 bot = telebot.TeleBot(config["telegram"]["token"])
 
-# Session states
-user_states = {}
+# Session states: per-chat conversation state that expires when a flow is
+# abandoned, taking its pending step handler with it. Both survive restarts.
+# Every flow creates its entry before registering its first step handler,
+# and a timer expires entries nobody touches again.
+SESSIONS_PATH = "sessions.json"
+SESSION_SWEEP_SECONDS = 60
+user_states = SessionStore(
+    ttl=config["telegram"].get("session_ttl_seconds", 900),
+    max_size=config["telegram"].get("max_sessions", 1000),
+    path=SESSIONS_PATH,
+    on_expire=bot.clear_step_handler_by_chat_id
+)
+bot.enable_save_next_step_handlers(delay=2)
+bot.load_next_step_handlers()
 
 # Custom function to escape Markdown characters
 def escape_markdown(text):
@@ -31,6 +47,26 @@ def create_keyboard(items, columns=2):
         keyboard.row(*items[i:i+columns])
     return keyboard
 
+# Function to drop any abandoned flow before a new one registers its handler
+def reset_flow(chat_id):
+    bot.clear_step_handler_by_chat_id(chat_id)
+    user_states.pop(chat_id)
+
+# Function to expire abandoned sessions, then again every interval seconds
+def sweep_sessions(interval=SESSION_SWEEP_SECONDS):
+    user_states.expire()
+    timer = threading.Timer(interval, sweep_sessions, [interval])
+    timer.daemon = True
+    timer.start()
+
+# Function to get the chat's session for a flow, telling the user if it expired
+def get_session(message, action):
+    state = user_states.get(message.chat.id)
+    if state is None or state["action"] != action:
+        bot.send_message(message.chat.id, "⌛ Session expired, please start again", reply_markup=main_menu)
+        return None
+    return state
+
 # Helper function for file operations
 def update_config(new_config):
     with open('config.json', 'w') as f:
@@ -120,15 +156,47 @@ def symbols_menu(message):
 @bot.message_handler(func=lambda msg: msg.text == "➕ Add Symbol")
 @authorized
 def start_add_symbol(message):
-    msg = bot.send_message(message.chat.id, "📥 Enter symbol name (e.g., EURUSD):")
+    reset_flow(message.chat.id)
+    user_states[message.chat.id] = {"action": "add"}
+    msg = bot.send_message(message.chat.id, "📥 Enter symbol name or its beginning (e.g., EURUSD or XAU):")
     bot.register_next_step_handler(msg, process_symbol_name)
 
+# Function to check a new symbol against the broker's catalog (written by
+# the trader), offering completions and close matches when it isn't there
 def process_symbol_name(message):
-    if not re.match(r'^[A-Z0-9]+$', message.text.upper()):
-        bot.send_message(message.chat.id, "❌ Invalid symbol! Use uppercase letters and numbers (e.g., EURUSD)")
-        bot.register_next_step_handler(message, process_symbol_name)
+    if message.text == "🏠 Main Menu":
+        user_states.pop(message.chat.id)
+        send_welcome(message)
         return
-    user_states[message.chat.id] = {"action": "add", "symbol": message.text.upper()}
+    state = get_session(message, "add")
+    if state is None:
+        return
+    catalog = symbol_catalog.load()
+    if catalog is None:
+        # No catalog from the trader yet, only the format can be checked
+        if not re.match(r'^[A-Z0-9]+$', message.text.upper()):
+            bot.send_message(message.chat.id, "❌ Invalid symbol! Use uppercase letters and numbers (e.g., EURUSD)")
+            bot.register_next_step_handler(message, process_symbol_name)
+            return
+        symbol = message.text.upper()
+    else:
+        entry = catalog.get(message.text)
+        if entry is None:
+            suggestions = catalog.search(message.text, 8)
+            if suggestions:
+                keyboard = create_keyboard([s["name"] for s in suggestions] + ["🏠 Main Menu"])
+                bot.send_message(message.chat.id, f"🔎 {message.text} is not on the broker. Did you mean:", reply_markup=keyboard)
+            else:
+                bot.send_message(message.chat.id, f"❌ {message.text} is not on the broker and nothing similar is. Enter another symbol:")
+            bot.register_next_step_handler(message, process_symbol_name)
+            return
+        symbol = entry["name"]
+        details = symbol_catalog.describe(entry)
+        if entry.get("visible") is False:
+            details += "\n⚠ Not in Market Watch yet, show it in the terminal before trading"
+        bot.send_message(message.chat.id, f"ℹ {details}", reply_markup=types.ReplyKeyboardRemove())
+    state["symbol"] = symbol
+    user_states[message.chat.id] = state
     msg = bot.send_message(message.chat.id, "💹 Enter trade volume:")
     bot.register_next_step_handler(msg, process_symbol_volume)
 
@@ -137,7 +205,11 @@ def process_symbol_volume(message):
         volume = float(message.text)
         if volume <= 0:
             raise ValueError("Volume must be positive")
-        user_states[message.chat.id]["volume"] = volume
+        state = get_session(message, "add")
+        if state is None:
+            return
+        state["volume"] = volume
+        user_states[message.chat.id] = state
         msg = bot.send_message(message.chat.id, "🎯 Enter Take Profit:")
         bot.register_next_step_handler(msg, process_symbol_tp)
     except ValueError as e:
@@ -149,7 +221,11 @@ def process_symbol_tp(message):
         tp = float(message.text)
         if tp <= 0:
             raise ValueError("Take Profit must be positive")
-        user_states[message.chat.id]["tp"] = tp
+        state = get_session(message, "add")
+        if state is None:
+            return
+        state["tp"] = tp
+        user_states[message.chat.id] = state
         msg = bot.send_message(message.chat.id, "🛑 Enter Stop Loss:")
         bot.register_next_step_handler(msg, process_symbol_sl)
     except ValueError as e:
@@ -161,7 +237,10 @@ def process_symbol_sl(message):
         sl = float(message.text)
         if sl <= 0:
             raise ValueError("Stop Loss must be positive")
-        state = user_states[message.chat.id]
+        state = get_session(message, "add")
+        if state is None:
+            return
+        user_states.pop(message.chat.id)
         symbol = state["symbol"]
         config = json.load(open('config.json'))
         if symbol in config["trading"]["symbols"]:
@@ -185,6 +264,7 @@ def process_symbol_sl(message):
 @bot.message_handler(func=lambda msg: msg.text == "🗑 Remove Symbol")
 @authorized
 def start_remove_symbol(message):
+    reset_flow(message.chat.id)
     config = json.load(open('config.json'))
     if not config["trading"]["symbols"]:
         bot.send_message(message.chat.id, "ℹ No symbols to remove", reply_markup=main_menu)
@@ -193,10 +273,12 @@ def start_remove_symbol(message):
     for sym in config["trading"]["symbols"]:
         keyboard.add(sym)
     keyboard.add("🏠 Main Menu")
+    user_states[message.chat.id] = {"action": "remove"}
     msg = bot.send_message(message.chat.id, "🗑 Select symbol to remove:", reply_markup=keyboard)
     bot.register_next_step_handler(msg, process_remove_symbol)
 
 def process_remove_symbol(message):
+    user_states.pop(message.chat.id)
     config = json.load(open('config.json'))
     if message.text == "🏠 Main Menu":
         send_welcome(message)
@@ -235,6 +317,7 @@ def handle_remove_confirmation(call):
 @bot.message_handler(func=lambda msg: msg.text == "✏ Edit Symbol")
 @authorized
 def start_edit_symbol(message):
+    reset_flow(message.chat.id)
     config = json.load(open('config.json'))
     if not config["trading"]["symbols"]:
         bot.send_message(message.chat.id, "ℹ No symbols available to edit", reply_markup=main_menu)
@@ -243,15 +326,18 @@ def start_edit_symbol(message):
     for sym in config["trading"]["symbols"]:
         keyboard.add(sym)
     keyboard.add("🏠 Main Menu")
+    user_states[message.chat.id] = {"action": "edit"}
     msg = bot.send_message(message.chat.id, "📝 Select symbol to edit:", reply_markup=keyboard)
     bot.register_next_step_handler(msg, process_edit_symbol)
 
 def process_edit_symbol(message):
     config = json.load(open('config.json'))
     if message.text == "🏠 Main Menu":
+        user_states.pop(message.chat.id)
         send_welcome(message)
         return
     if message.text not in config["trading"]["symbols"]:
+        user_states.pop(message.chat.id)
         bot.send_message(message.chat.id, "❌ Symbol not found!", reply_markup=main_menu)
         return
     user_states[message.chat.id] = {"action": "edit", "symbol": message.text}
@@ -259,16 +345,24 @@ def process_edit_symbol(message):
     keyboard.add("Volume", "Take Profit", "Stop Loss")
     keyboard.add("Counter", "TP Counter", "SL Counter")
     keyboard.add("🏠 Main Menu")
-    msg = bot.send_message(message.chat.id, f"✏ Editing {message.text}\nSelect parameter:", reply_markup=keyboard)
+    catalog = symbol_catalog.load()
+    entry = catalog.get(message.text) if catalog is not None else None
+    if entry is not None:
+        details = f"\nℹ {symbol_catalog.describe(entry)}"
+    else:
+        details = "\n⚠ Not found on the broker" if catalog is not None else ""
+    msg = bot.send_message(message.chat.id, f"✏ Editing {message.text}{details}\nSelect parameter:", reply_markup=keyboard)
     bot.register_next_step_handler(msg, process_edit_parameter)
 
 def process_edit_parameter(message):
     valid_params = ["volume", "take profit", "stop loss", "counter", "tp counter", "sl counter"]
     param = message.text.lower()
     if message.text == "🏠 Main Menu":
+        user_states.pop(message.chat.id)
         send_welcome(message)
         return
     if param not in valid_params:
+        user_states.pop(message.chat.id)
         bot.send_message(message.chat.id, "❌ Invalid parameter!", reply_markup=main_menu)
         return
     param_map = {
@@ -279,7 +373,11 @@ def process_edit_parameter(message):
         "tp counter": "tp_counter",
         "sl counter": "sl_counter"
     }
-    user_states[message.chat.id]["param"] = param_map[param]
+    state = get_session(message, "edit")
+    if state is None:
+        return
+    state["param"] = param_map[param]
+    user_states[message.chat.id] = state
     msg = bot.send_message(message.chat.id, f"🆕 Enter new value for {message.text}:", reply_markup=types.ReplyKeyboardRemove())
     bot.register_next_step_handler(msg, save_parameter_change)
 
@@ -288,7 +386,10 @@ def save_parameter_change(message):
         value = float(message.text)
         if value <= 0:
             raise ValueError("Value must be positive")
-        state = user_states[message.chat.id]
+        state = get_session(message, "edit")
+        if state is None:
+            return
+        user_states.pop(message.chat.id)
         config = json.load(open('config.json'))
         if state["symbol"] not in config["trading"]:
             config["trading"][state["symbol"]] = {
@@ -347,13 +448,14 @@ def start_edit_trading_param(call):
         bot.send_message(call.message.chat.id, "Invalid parameter")
         return
     bot.answer_callback_query(call.id)
+    reset_flow(call.message.chat.id)
     msg = bot.send_message(call.message.chat.id, prompt[param])
     user_states[call.message.chat.id] = {"action": "edit_trading_param", "param": param}
     bot.register_next_step_handler(msg, process_new_trading_param)
 
 def process_new_trading_param(message):
-    state = user_states.get(message.chat.id)
-    if not state or state["action"] != "edit_trading_param":
+    state = get_session(message, "edit_trading_param")
+    if state is None:
         return
     param = state["param"]
     new_value = message.text
@@ -387,7 +489,7 @@ def process_new_trading_param(message):
         config["trading"][param] = new_value
         update_config(config)
         bot.send_message(message.chat.id, "✅ Updated successfully", reply_markup=main_menu)
-        del user_states[message.chat.id]
+        user_states.pop(message.chat.id)
     except ValueError as e:
         bot.send_message(message.chat.id, f"❌ {str(e)}")
         bot.register_next_step_handler(message, process_new_trading_param)
@@ -413,5 +515,6 @@ def handle_callbacks(call):
 def handle_unknown(message):
     bot.send_message(message.chat.id, "❓ Unrecognized command. Please use the menu:", reply_markup=main_menu)
 
+sweep_sessions()
 print("✅ Bot is running...")
 bot.polling(non_stop=True)
\ No newline at end of file
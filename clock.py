@@ -0,0 +1,183 @@
+import threading
+import time as _time
+from collections import deque
+from datetime import datetime, timezone
+
+import metrics
+
+# Single source of wall time, monotonic time and sleeping for the trading loop.
+# Normally this is the real clock; replay installs a virtual one so a recorded
+# session runs at real or accelerated speed without touching the loop. Once
+# server clock sync is enabled and has enough ticks, time() and now() follow
+# the broker's clock instead of the local one.
+_source = None
+_server = None
+
+# Function to swap in a different clock source (None restores the real clock)
+def install(source):
+    global _source
+    _source = source
+
+def _local_time():
+    return _source.time() if _source is not None else _time.time()
+
+def time():
+    if _server is not None and _server.synced:
+        current = monotonic()
+        if _server.fresh(current):
+            return _server.utc(current)
+    return _local_time()
+
+def monotonic():
+    return _source.monotonic() if _source is not None else _time.monotonic()
+
+def sleep(seconds):
+    if seconds <= 0:
+        return
+    if _source is not None:
+        _source.sleep(seconds)
+    else:
+        _time.sleep(seconds)
+
+# Function to get the current UTC time as an aware datetime
+def now():
+    return datetime.fromtimestamp(time(), tz=timezone.utc)
+
+# Virtual clock driven by a replay. With speed > 0 virtual time advances at
+# speed x real time; with speed == 0 it only moves when the replay or a sleep
+# moves it, so a whole day replays as fast as the code can run.
+class VirtualClock:
+    def __init__(self, start, speed=1.0):
+        self.speed = speed
+        self._virtual = start
+        self._real = _time.monotonic()
+
+    def time(self):
+        if self.speed > 0:
+            return self._virtual + (_time.monotonic() - self._real) * self.speed
+        return self._virtual
+
+    def monotonic(self):
+        # Virtual wall time never jumps backwards, so it doubles as monotonic
+        return self.time()
+
+    def sleep(self, seconds):
+        if self.speed > 0:
+            _time.sleep(seconds / self.speed)
+        else:
+            self._virtual += seconds
+
+    # Function to wait until virtual time reaches the given timestamp
+    def advance_to(self, timestamp):
+        remaining = timestamp - self.time()
+        if remaining > 0:
+            self.sleep(remaining)
+
+# Estimate of the broker's server clock from tick timestamps. A tick's
+# time_msc is server time at or shortly before we received it, so
+# time_msc - monotonic is a lower bound of the true offset, tight for the
+# freshest ticks. The largest offset seen in each bucket (default 30s) over a
+# sliding window is kept and a line fitted through them: its slope is the
+# local clock's drift against the server, and it is raised to touch the
+# highest point. The whole quarter hours of the offset are the broker's time
+# zone (bar times are in server time); the rest is our clock's error.
+# Drift is clamped to what a real oscillator does (50ppm), and once the newest
+# bucket is older than the window (a quiet weekend) the estimate is not
+# extrapolated: time() falls back to the local clock until new ticks arrive.
+class ServerClock:
+    def __init__(self, bucket_seconds=30, window=20, stale_tolerance=0.5, max_drift_ppm=50):
+        self.bucket_seconds = bucket_seconds
+        self.window = window
+        self.stale_tolerance = stale_tolerance
+        self.max_drift = max_drift_ppm / 1e6
+        self._lock = threading.Lock()
+        self._buckets = deque()
+        self._last_tick = {}
+        self.reference = None
+        self.offset = None
+        self.drift = 0.0
+        self.zone = 0
+        self.error = 0.0
+
+    # Synced once ticks from two buckets agree on a line
+    @property
+    def synced(self):
+        return len(self._buckets) >= 2
+
+    # Function to tell whether the newest bucket still falls inside the
+    # window at the given local monotonic time
+    def fresh(self, monotonic_time):
+        return monotonic_time - self.reference <= self.window * self.bucket_seconds
+
+    # Function to fold in one tick received at the given local times
+    def sample(self, symbol, time_msc, received_monotonic, received_wall):
+        offset = time_msc / 1000 - received_monotonic
+        bucket = int(received_monotonic // self.bucket_seconds)
+        with self._lock:
+            if self._last_tick.get(symbol) == time_msc:
+                # Same tick as last time: the market is quiet, it says nothing new
+                return
+            self._last_tick[symbol] = time_msc
+            if self._buckets and self._buckets[-1][0] == bucket:
+                if offset > self._buckets[-1][2]:
+                    self._buckets[-1] = (bucket, received_monotonic, offset)
+            else:
+                self._buckets.append((bucket, received_monotonic, offset))
+                while bucket - self._buckets[0][0] >= self.window:
+                    self._buckets.popleft()
+            self._fit()
+            server = received_monotonic + self.offset + self.drift * (received_monotonic - self.reference)
+            self.zone = round((server - received_wall) / 900) * 900
+            self.error = server - self.zone - received_wall
+        metrics.set_gauge("clock_error_ms", self.error * 1000)
+        metrics.set_gauge("clock_drift_ppm", self.drift * 1e6)
+
+    def _fit(self):
+        points = [(m, o) for _, m, o in self._buckets]
+        drift = 0.0
+        if len(points) >= 3:
+            drift = _slope(points)
+            # Buckets well under the line only saw late ticks: refit without them
+            top = max(o - drift * m for m, o in points)
+            fresh = [(m, o) for m, o in points if o - drift * m >= top - self.stale_tolerance]
+            drift = _slope(fresh) if len(fresh) >= 3 else 0.0
+            drift = max(-self.max_drift, min(self.max_drift, drift))
+        self.reference = points[-1][0]
+        self.offset = max(o + drift * (self.reference - m) for m, o in points)
+        self.drift = drift
+
+    # Function to get UTC as the server sees it at a local monotonic time
+    def utc(self, monotonic_time):
+        return monotonic_time + self.offset + self.drift * (monotonic_time - self.reference) - self.zone
+
+def _slope(points):
+    mean_m = sum(m for m, _ in points) / len(points)
+    mean_o = sum(o for _, o in points) / len(points)
+    spread = sum((m - mean_m) ** 2 for m, _ in points)
+    if not spread:
+        return 0.0
+    return sum((m - mean_m) * (o - mean_o) for m, o in points) / spread
+
+# Function to start estimating the server clock (settings as for ServerClock)
+def enable_sync(**settings):
+    global _server
+    _server = ServerClock(**settings)
+
+def sync_enabled():
+    return _server is not None
+
+# Function to get how often ticks should be sampled to keep the server clock
+# synced (once per bucket), or None when sync is off
+def sample_interval():
+    return _server.bucket_seconds if _server is not None else None
+
+# Function to feed a symbol_info_tick result to the server clock estimate
+def observe_tick(symbol, tick):
+    if _server is None or tick is None:
+        return
+    _server.sample(symbol, tick.time_msc, monotonic(), _local_time())
+
+# Function to get the broker's time zone offset in seconds (bar times are
+# UTC plus this); 0 until the server clock is synced
+def server_zone():
+    return _server.zone if _server is not None and _server.synced else 0
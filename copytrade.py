@@ -0,0 +1,338 @@
+import itertools
+import json
+import queue
+import threading
+
+import MetaTrader5 as mt5
+
+import clock
+import execution
+import metrics
+import prices
+import throttle
+import tracing
+from gateway import GatewayClient, DEFAULT_PORT, CALL_TIMEOUT
+
+# Copy trading: the leader process evaluates each bar once and fans the main
+# deal and counter order of every signal out to follower accounts. Each
+# follower is a terminal served by its own gateway.py daemon:
+#
+#   "copy_trading": {
+#       "followers": [
+#           {"name": "acc2", "gateway": "127.0.0.1:5556", "volume_multiplier": 0.5},
+#           {"name": "acc3", "gateway": "127.0.0.1:5557", "symbols": ["XAUUSD"]}
+#       ]
+#   }
+#
+# Every follower keeps a connected client and a worker thread parked on its
+# queue, so a signal costs one queue put per follower and all workers wake at
+# once, fetch their own tick and send. The spread between the first and the
+# last follower's send is the skew; it is logged per signal to
+# copytrade.jsonl and published as the copy_skew_ms gauge. Followers get the
+# leader's magic numbers, and the leader's orphan sweep also sweeps them.
+# A follower whose gateway can't be reached or whose connection dropped is
+# reconnected on its own thread; the others keep trading meanwhile. An
+# optional "timeout" (seconds) bounds each gateway call of a follower.
+# Signals go ahead of orphan sweeps in a follower's queue, a follower has at
+# most one sweep queued, and a sweep stops early when a signal comes in.
+# Follower cancels share the leader's housekeeping lane of the order throttle.
+
+COPY_LOG_PATH = "copytrade.jsonl"
+# Seconds a stopping follower gets to finish the job it is on
+STOP_TIMEOUT = 5
+# Job priorities in a follower's queue, most urgent first
+SIGNAL, STOP, SWEEP = 0, 1, 2
+
+# One follower account: a gateway client and the thread that trades on it
+class Follower(threading.Thread):
+    def __init__(self, settings):
+        super().__init__(name=f"copy-{settings['name']}", daemon=True)
+        self.account = settings["name"]
+        host, _, port = settings["gateway"].partition(":")
+        self.settings = settings
+        self.client = GatewayClient(host, int(port or DEFAULT_PORT), settings.get("timeout", CALL_TIMEOUT))
+        self.multiplier = settings.get("volume_multiplier", 1.0)
+        self.symbols = set(settings["symbols"]) if settings.get("symbols") else None
+        self.jobs = queue.PriorityQueue()
+        self._order = itertools.count()
+        self.broken = False
+        self.sweep_queued = False
+        self._symbol_info = {}
+
+    def trades(self, symbol):
+        return self.symbols is None or symbol in self.symbols
+
+    def run(self):
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                job(self)
+            except (ConnectionError, OSError) as e:
+                print(f"Copy follower {self.account}: gateway connection lost: {e}")
+                self.broken = True
+            except Exception as e:
+                print(f"Copy follower {self.account}: {e}")
+
+    # Function to stop the worker, closing the connection only once it is
+    # done with it (or stuck past the timeout)
+    def stop(self):
+        self.submit(STOP, None)
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(STOP_TIMEOUT)
+        self.client.close()
+
+    # Function to queue a job; jobs of the same priority run in order
+    def submit(self, priority, job):
+        self.jobs.put((priority, next(self._order), job))
+
+    def _signal_waiting(self):
+        waiting = self.jobs.queue
+        return bool(waiting) and waiting[0][0] == SIGNAL
+
+    def symbol_info(self, symbol):
+        info = self._symbol_info.get(symbol)
+        if info is None:
+            info = self._symbol_info[symbol] = self.client.symbol_info(symbol)
+        return info
+
+    # Function to scale the leader's volume to this account's size and lot step
+    def volume(self, info, volume):
+        step = info.volume_step or 0.01
+        scaled = round(round(volume * self.multiplier / step) * step, 8)
+        return min(max(scaled, info.volume_min), info.volume_max)
+
+    def _deal_repricer(self, request):
+        tick = self.client.symbol_info_tick(request["symbol"])
+        if tick is None:
+            return False
+        request["price"] = tick.ask if request["type"] == mt5.ORDER_TYPE_BUY else tick.bid
+        return True
+
+    # Function to trade one intent on this account. Returns (sent_at, result):
+    # the monotonic time of the first send and the main deal result.
+    def execute(self, symbol, intent, magic, deadline, send_main):
+        info = self.symbol_info(symbol)
+        if info is None:
+            print(f"[{symbol}] Copy follower {self.account}: symbol not available")
+            return None, None
+        scale = prices.scale_for(info)
+        tick = self.client.symbol_info_tick(symbol)
+        if tick is None:
+            print(f"[{symbol}] Copy follower {self.account}: no tick")
+            return None, None
+        if intent["side"] == "buy":
+            trade_type, counter_type, price, base, sign = mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL_STOP, tick.ask, "ask", -1
+        else:
+            trade_type, counter_type, price, base, sign = mt5.ORDER_TYPE_SELL, mt5.ORDER_TYPE_BUY_STOP, tick.bid, "bid", 1
+        sent_at = None
+        result = None
+        if send_main:
+            request = {
+                "action": mt5.TRADE_ACTION_DEAL,
+                "symbol": symbol,
+                "volume": self.volume(info, intent["volume"]),
+                "type": trade_type,
+                "price": price,
+                "deviation": 10,
+                "magic": magic,
+                "comment": "Copy main",
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_FOK,
+            }
+            sent_at = clock.monotonic()
+            result, _ = execution.send_order(request, deadline, reprice=self._deal_repricer, lane=None, terminal=self.client, account=self.account)
+            if result is not None:
+                modify_request = {
+                    "action": mt5.TRADE_ACTION_SLTP,
+                    "symbol": symbol,
+                    "position": result.order,
+                    "magic": magic,
+                    "tp": scale.add(result.price, -sign * intent["tp"]),
+                    "sl": scale.add(result.price, sign * intent["sl"]),
+                }
+                # The position is open at this point, so protecting it gets a fresh budget
+                execution.send_order(modify_request, execution.deadline_in(), lane=None, terminal=self.client, account=self.account)
+        counter = intent["counter"]
+        if counter is None or (result is None and send_main and counter["requires_main"]):
+            return sent_at, result
+        counter_price = scale.add(price, sign * counter["distance"])
+        pending = {
+            "action": mt5.TRADE_ACTION_PENDING,
+            "symbol": symbol,
+            "volume": self.volume(info, counter["volume"]),
+            "type": counter_type,
+            "price": counter_price,
+            "tp": scale.add(counter_price, sign * counter["tp"]),
+            "sl": scale.add(price, -sign * counter["sl"]),
+            "deviation": 10,
+            "magic": magic,
+            "comment": "Copy counter",
+            "type_time": mt5.ORDER_TIME_GTC,
+            "type_filling": mt5.ORDER_FILLING_RETURN,
+        }
+        if sent_at is None:
+            sent_at = clock.monotonic()
+        reprice = execution.offset_repricer(base, sign * counter["distance"], sign * counter["tp"], -sign * counter["sl"], scale, self.client)
+        execution.send_order(pending, deadline, reprice=reprice, lane=None, terminal=self.client, account=self.account)
+        return sent_at, result
+
+    # Function to cancel this account's pending orders whose main position is
+    # gone, except the leader's counter-only magics
+    def sweep(self, counter_only=()):
+        self.sweep_queued = False
+        positions = self.client.positions_get() or []
+        position_magics = set(pos.magic for pos in positions)
+        for order in self.client.orders_get() or []:
+            if order.magic in position_magics or str(order.magic) in counter_only:
+                continue
+            if self._signal_waiting():
+                # The rest waits for the next sweep
+                break
+            throttle.acquire(order.symbol, throttle.HOUSEKEEPING)
+            with tracing.span("cancel", order.symbol, order.magic, account=self.account) as span:
+                result = self.client.order_send({"action": mt5.TRADE_ACTION_REMOVE, "order": order.ticket})
+                span["retcode"] = result.retcode if result is not None else None
+                span["price"] = order.price_open
+            if result is not None and result.retcode == mt5.TRADE_RETCODE_DONE:
+                print(f"Copy follower {self.account}: canceled orphan order {order.ticket} (magic={order.magic})")
+
+# One signal fanned out to several followers; reports the skew once all sent
+class CopyBatch:
+    def __init__(self, symbol, intent, magic, deadline, send_main, count):
+        self.symbol = symbol
+        self.intent = intent
+        self.magic = magic
+        self.deadline = deadline
+        self.send_main = send_main
+        self.dispatched = clock.monotonic()
+        self.sends = {}
+        self.remaining = count
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, follower):
+        sent_at, result = None, None
+        try:
+            sent_at, result = follower.execute(self.symbol, self.intent, self.magic, self.deadline, self.send_main)
+        finally:
+            with self._lock:
+                self.sends[follower.account] = {
+                    "sent_at": sent_at,
+                    "filled": result is not None,
+                    "price": result.price if result is not None else None
+                }
+                self.remaining -= 1
+                last = self.remaining == 0
+            if last:
+                self._report()
+                self.done.set()
+
+    def _report(self):
+        sent = {name: s["sent_at"] for name, s in self.sends.items() if s["sent_at"] is not None}
+        if not sent:
+            print(f"[{self.symbol}] Copy fan-out (magic={self.magic}): no follower sent anything")
+            return
+        first = min(sent.values())
+        skew_ms = (max(sent.values()) - first) * 1000
+        followers = {}
+        for name, s in self.sends.items():
+            followers[name] = {
+                "offset_ms": round((s["sent_at"] - first) * 1000, 3) if s["sent_at"] is not None else None,
+                "lag_ms": round((s["sent_at"] - self.dispatched) * 1000, 3) if s["sent_at"] is not None else None,
+                "filled": s["filled"],
+                "price": s["price"]
+            }
+        metrics.set_gauge("copy_skew_ms", skew_ms)
+        metrics.set_gauge(f"copy_skew_ms.{self.symbol}", skew_ms)
+        offsets = ", ".join(f"{name}=+{f['offset_ms']}ms" for name, f in followers.items() if f["offset_ms"] is not None)
+        print(f"[{self.symbol}] Copy fan-out (magic={self.magic}) to {len(self.sends)} followers: skew {skew_ms:.1f}ms ({offsets})")
+        record = {
+            "time": clock.time(),
+            "symbol": self.symbol,
+            "magic": self.magic,
+            "strategy": self.intent["strategy"],
+            "side": self.intent["side"],
+            "skew_ms": round(skew_ms, 3),
+            "followers": followers
+        }
+        try:
+            with open(COPY_LOG_PATH, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Error writing copy trading log: {e}")
+
+class CopyTrader:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.followers = []
+        self._connecting = set()
+
+    # Function to apply the "copy_trading" config. Followers that are
+    # connected and unchanged are kept; new, changed and broken ones are
+    # (re)connected in the background, and removed ones are stopped.
+    def configure(self, settings):
+        wanted = {f["name"]: f for f in (settings or {}).get("followers", [])}
+        with self._lock:
+            current = {f.account: f for f in self.followers}
+            stale = [f for name, f in current.items() if f.broken or wanted.get(name) != f.settings]
+            self.followers = [f for f in self.followers if f not in stale]
+            missing = [f for name, f in wanted.items()
+                       if name not in self._connecting and (name not in current or current[name] in stale)]
+            self._connecting.update(f["name"] for f in missing)
+        for follower in stale:
+            follower.stop()
+        for follower_settings in missing:
+            threading.Thread(target=self._connect, args=(follower_settings,),
+                             name=f"copy-connect-{follower_settings['name']}", daemon=True).start()
+
+    def _connect(self, follower_settings):
+        name = follower_settings["name"]
+        try:
+            follower = Follower(follower_settings)
+        except OSError as e:
+            # Retried on the next configure
+            print(f"Copy follower {name}: cannot reach gateway {follower_settings.get('gateway')}: {e}")
+            with self._lock:
+                self._connecting.discard(name)
+            return
+        follower.start()
+        with self._lock:
+            self._connecting.discard(name)
+            self.followers = self.followers + [follower]
+            accounts = [f.account for f in self.followers]
+        print(f"Copy follower {name} connected, copy trading to {len(accounts)} followers: {', '.join(accounts)}")
+
+    def close(self):
+        with self._lock:
+            followers, self.followers = self.followers, []
+        for follower in followers:
+            follower.stop()
+
+    # Function to fan one intent out to every follower trading the symbol.
+    # Returns the batch (its done event is set once all have sent), or None.
+    def dispatch(self, symbol, intent, magic, deadline=None, send_main=True):
+        targets = [f for f in self.followers if f.trades(symbol) and not f.broken]
+        if not targets:
+            return None
+        batch = CopyBatch(symbol, intent, magic, deadline, send_main, len(targets))
+        for follower in targets:
+            follower.submit(SIGNAL, batch)
+        return batch
+
+    # Function to queue an orphan sweep on every follower; counter_only holds
+    # the magics of counters placed without a main trade
+    def sweep(self, counter_only=()):
+        counter_only = frozenset(counter_only)
+        for follower in self.followers:
+            if follower.broken or follower.sweep_queued:
+                continue
+            follower.sweep_queued = True
+            follower.submit(SWEEP, lambda f: f.sweep(counter_only))
+
+_copier = CopyTrader()
+configure = _copier.configure
+dispatch = _copier.dispatch
+sweep = _copier.sweep
+close = _copier.close
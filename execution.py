@@ -0,0 +1,265 @@
+import MetaTrader5 as mt5
+import json
+import threading
+from collections import namedtuple
+
+import clock
+import metrics
+import throttle
+import tracing
+
+EXECUTION_LOG_PATH = "executions.jsonl"
+DEFAULT_DEADLINE_MS = 2000
+
+# Retcode classes. Anything not listed is treated as a hard reject.
+DONE = "done"
+REPRICE = "reprice"
+BACKOFF = "backoff"
+UNKNOWN = "unknown"
+HARD = "hard"
+DEADLINE = "deadline"
+
+DONE_RETCODES = {
+    mt5.TRADE_RETCODE_DONE,
+    mt5.TRADE_RETCODE_PLACED,
+    mt5.TRADE_RETCODE_DONE_PARTIAL,
+}
+# The quote moved under us: fetch a fresh tick and send again immediately
+REPRICE_RETCODES = {
+    mt5.TRADE_RETCODE_REQUOTE,
+    mt5.TRADE_RETCODE_PRICE_CHANGED,
+    mt5.TRADE_RETCODE_PRICE_OFF,
+}
+# The server refused the request without executing it: wait a little and
+# send the same request again
+BACKOFF_RETCODES = {
+    mt5.TRADE_RETCODE_TOO_MANY_REQUESTS,
+    mt5.TRADE_RETCODE_LOCKED,
+}
+# The request may or may not have been executed. Deals and pending orders are
+# only sent again once the account shows no trace of them.
+UNKNOWN_RETCODES = {
+    mt5.TRADE_RETCODE_TIMEOUT,
+    mt5.TRADE_RETCODE_CONNECTION,
+    mt5.TRADE_RETCODE_ERROR,
+}
+# Actions that would open a second position or order if sent twice
+UNSAFE_TO_REPEAT = {mt5.TRADE_ACTION_DEAL, mt5.TRADE_ACTION_PENDING}
+# How far back the deal history is searched for a lost deal, generous
+# enough to cover the broker's time zone
+HISTORY_LOOKBACK = 2 * 86400
+
+# What send_order returns for a request found executed after its reply was lost
+FoundResult = namedtuple("FoundResult", ["retcode", "deal", "order", "volume", "price", "comment"])
+
+# Span names for order_send attempts in the trade traces
+SPAN_NAMES = {
+    mt5.TRADE_ACTION_DEAL: "deal",
+    mt5.TRADE_ACTION_SLTP: "sltp",
+    mt5.TRADE_ACTION_PENDING: "pending",
+    mt5.TRADE_ACTION_REMOVE: "cancel",
+}
+
+# Function to classify an order_send result
+def classify(result):
+    if result is None:
+        # order_send itself failed (terminal/IPC problem): the request may
+        # have reached the server before the link broke
+        return UNKNOWN
+    if result.retcode in DONE_RETCODES:
+        return DONE
+    if result.retcode in REPRICE_RETCODES:
+        return REPRICE
+    if result.retcode in BACKOFF_RETCODES:
+        return BACKOFF
+    if result.retcode in UNKNOWN_RETCODES:
+        return UNKNOWN
+    return HARD
+
+# Function to look for a deal or pending order that went through although
+# its reply was lost, by the request's magic. Returns (checked, found):
+# checked is False if the account could not be read, found the FoundResult.
+def find_executed(request, terminal=mt5):
+    symbol = request.get("symbol")
+    magic = request.get("magic")
+    if magic is None:
+        return False, None
+    if request["action"] == mt5.TRADE_ACTION_PENDING:
+        orders = terminal.orders_get(symbol=symbol)
+        if orders is None:
+            return False, None
+        for order in orders:
+            if order.magic == magic and order.type == request["type"]:
+                return True, FoundResult(mt5.TRADE_RETCODE_PLACED, 0, order.ticket, order.volume_current, order.price_open, "found in orders")
+        return True, None
+    positions = terminal.positions_get(symbol=symbol)
+    if positions is None:
+        return False, None
+    for position in positions:
+        if position.magic == magic:
+            return True, FoundResult(mt5.TRADE_RETCODE_DONE, 0, position.ticket, position.volume, position.price_open, "found in positions")
+    # The position may have been opened and closed already
+    now = int(clock.time())
+    deals = terminal.history_deals_get(now - HISTORY_LOOKBACK, now + HISTORY_LOOKBACK, group=f"*{symbol}*")
+    if deals is None:
+        return False, None
+    for deal in deals:
+        if deal.magic == magic and deal.entry == mt5.DEAL_ENTRY_IN:
+            return True, FoundResult(mt5.TRADE_RETCODE_DONE, deal.ticket, deal.position_id, deal.volume, deal.price, "found in history")
+    return True, None
+
+# Function to get a deadline (monotonic seconds) a given number of ms from now
+def deadline_in(ms=DEFAULT_DEADLINE_MS):
+    return clock.monotonic() + ms / 1000.0
+
+# Function to re-price a market deal from a fresh tick
+def reprice_from_tick(request):
+    tick = mt5.symbol_info_tick(request["symbol"])
+    if tick is None:
+        return False
+    request["price"] = tick.ask if request["type"] == mt5.ORDER_TYPE_BUY else tick.bid
+    return True
+
+# Function to build a re-pricer for orders placed at fixed offsets from the
+# quote; with a prices.PriceScale the offsets are applied in whole points
+def offset_repricer(base, price_offset, tp_offset, sl_offset, scale=None, terminal=None):
+    if terminal is None:
+        terminal = mt5
+
+    def reprice(request):
+        tick = terminal.symbol_info_tick(request["symbol"])
+        if tick is None:
+            return False
+        quote = tick.ask if base == "ask" else tick.bid
+        if scale is not None:
+            request["price"] = scale.add(quote, price_offset)
+            request["tp"] = scale.add(request["price"], tp_offset)
+            request["sl"] = scale.add(quote, sl_offset)
+            return True
+        request["price"] = quote + price_offset
+        request["tp"] = request["price"] + tp_offset
+        request["sl"] = quote + sl_offset
+        return True
+    return reprice
+
+_log_lock = threading.Lock()
+_log_file = None
+
+# Function to append attempt records to the execution log. The file stays
+# open between sends and is reopened when EXECUTION_LOG_PATH changes.
+def record_attempts(attempts):
+    global _log_file
+    lines = "".join(json.dumps(attempt) + "\n" for attempt in attempts)
+    with _log_lock:
+        try:
+            if _log_file is None or _log_file.name != EXECUTION_LOG_PATH:
+                if _log_file is not None:
+                    _log_file.close()
+                _log_file = open(EXECUTION_LOG_PATH, 'a')
+            _log_file.write(lines)
+            _log_file.flush()
+        except OSError as e:
+            print(f"Error writing execution log: {e}")
+            _log_file = None
+
+# Function to send an order, retrying transient failures until the deadline.
+# Every attempt waits for a token in the given throttle lane first (None
+# skips the throttle). terminal is the MetaTrader5 module by default, or a
+# gateway client for another account, named by account in the trace spans.
+# Returns (result, attempts); result is None unless the order went through.
+def send_order(request, deadline=None, reprice=None, max_attempts=5, backoff=0.05, lane=throttle.ENTRY, terminal=None, account=None):
+    if terminal is None:
+        terminal = mt5
+    if deadline is None:
+        deadline = deadline_in()
+    symbol = request.get("symbol", "")
+    magic = request.get("magic")
+    span_name = SPAN_NAMES.get(request.get("action"), "order")
+    attempts = []
+    result = None
+    for attempt in range(1, max_attempts + 1):
+        queued = clock.monotonic()
+        if lane is not None and not throttle.acquire(symbol, lane, deadline):
+            print(f"[{symbol}] No order slot before the deadline, not sending")
+            attempts.append({
+                "time": clock.time(),
+                "symbol": symbol,
+                "action": request.get("action"),
+                "magic": request.get("magic"),
+                "attempt": attempt,
+                "price": request.get("price"),
+                "retcode": None,
+                "comment": "throttled",
+                "outcome": DEADLINE,
+                "latency_ms": 0
+            })
+            metrics.inc("order_send_deadline")
+            break
+        start = clock.monotonic()
+        # Requests without a magic belong to no trade and are not traced
+        with tracing.span(span_name, symbol, magic) if magic is not None else tracing.NULL_SPAN as span:
+            result = terminal.order_send(request)
+            latency_ms = (clock.monotonic() - start) * 1000
+            outcome = classify(result)
+            span.update({
+                "attempt": attempt,
+                "retcode": result.retcode if result is not None else None,
+                "price": result.price if result is not None and result.price else request.get("price"),
+                "outcome": outcome,
+                "queued_ms": round((start - queued) * 1000, 3)
+            })
+            if request.get("action") == mt5.TRADE_ACTION_SLTP:
+                span["tp"], span["sl"] = request.get("tp"), request.get("sl")
+            if account is not None:
+                span["account"] = account
+        if lane is not None:
+            throttle.feedback(result)
+        attempts.append({
+            "time": clock.time(),
+            "symbol": symbol,
+            "action": request.get("action"),
+            "magic": request.get("magic"),
+            "attempt": attempt,
+            "price": request.get("price"),
+            "retcode": result.retcode if result is not None else None,
+            "comment": result.comment if result is not None else str(terminal.last_error()),
+            "outcome": outcome,
+            "latency_ms": round(latency_ms, 3)
+        })
+        metrics.inc(f"order_send_{outcome}")
+        if outcome == DONE:
+            break
+        if outcome == HARD:
+            print(f"[{symbol}] Order rejected: retcode={attempts[-1]['retcode']}, comment={attempts[-1]['comment']}")
+            break
+        if outcome == UNKNOWN and request.get("action") in UNSAFE_TO_REPEAT:
+            checked, found = find_executed(request, terminal)
+            if found is not None:
+                print(f"[{symbol}] Order went through despite retcode={attempts[-1]['retcode']}: {found.comment}, ticket {found.order}")
+                result = found
+                attempts[-1]["outcome"] = DONE
+                metrics.inc("order_send_found_executed")
+                break
+            if not checked:
+                print(f"[{symbol}] Order outcome unknown and the account can't be read, not resending")
+                break
+        if attempt == max_attempts:
+            print(f"[{symbol}] Giving up after {attempt} attempts: retcode={attempts[-1]['retcode']}")
+            break
+        delay = 0 if outcome == REPRICE else backoff * 2 ** (attempt - 1)
+        # Leave the remaining budget to the other symbols rather than retry late
+        if clock.monotonic() + delay >= deadline:
+            print(f"[{symbol}] Deadline reached after {attempt} attempts, not retrying")
+            attempts[-1]["outcome"] = DEADLINE
+            metrics.inc("order_send_deadline")
+            break
+        if delay:
+            clock.sleep(delay)
+        if outcome == REPRICE and reprice is not None and not reprice(request):
+            print(f"[{symbol}] Could not re-price from a fresh tick, not retrying")
+            break
+        print(f"[{symbol}] Retrying order ({outcome}), attempt {attempt + 1}/{max_attempts}")
+    record_attempts(attempts)
+    if attempts[-1]["outcome"] != DONE:
+        return None, attempts
+    return result, attempts
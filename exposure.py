@@ -0,0 +1,156 @@
+import threading
+
+import MetaTrader5 as mt5
+
+import market_cache
+import metrics
+
+# Running exposure per symbol and for the whole account: net lots, gross
+# lots, notional and worst-case loss if every stop loss is hit. Pending
+# orders count as if filled. Each position or order contributes one entry
+# keyed by ticket, so adding, removing and the pre-trade check are O(1)
+# however many are open. Our own fills and cancels update the book directly;
+# the orphan sweep reconciles it with positions_get/orders_get it fetches
+# anyway, which picks up broker-side fills, TP/SL closes and manual trades.
+# Contract sizes are cached per cycle, and the exposure gauges are published
+# once per cycle and per sweep rather than on every change.
+#
+# Limits, under "trading" (account) or per symbol in "settings":
+#   "exposure_limits": {"max_net_lots": 1.0, "max_gross_lots": 2.0,
+#                       "max_notional": 500000, "max_loss_at_sl": 1000}
+
+BUY_TYPES = {mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_BUY_LIMIT, mt5.ORDER_TYPE_BUY_STOP, mt5.ORDER_TYPE_BUY_STOP_LIMIT}
+LIMIT_KEYS = {
+    "max_net_lots": "net_lots",
+    "max_gross_lots": "gross_lots",
+    "max_notional": "notional",
+    "max_loss_at_sl": "loss_at_sl"
+}
+
+def _empty_totals():
+    return {"net_lots": 0.0, "gross_lots": 0.0, "notional": 0.0, "loss_at_sl": 0.0}
+
+class ExposureBook:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = {}
+        self.symbols = {}
+        self.account = _empty_totals()
+        self.account_limits = {}
+        self.symbol_limits = {}
+        self.contract_sizes = {}
+        self._published = set()
+        self._changed = False
+
+    # Function to take account and per-symbol limits from the trading config
+    def set_limits(self, trading):
+        self.account_limits = trading.get("exposure_limits", {})
+        self.symbol_limits = {symbol: settings["exposure_limits"]
+                              for symbol, settings in trading.get("settings", {}).items()
+                              if "exposure_limits" in settings}
+        # Re-read contract sizes once per cycle
+        self.contract_sizes = {}
+
+    # Function to compute what one position or order adds to the totals
+    def _contribution(self, symbol, order_type, volume, price, sl):
+        contract_size = self.contract_sizes.get(symbol)
+        if contract_size is None:
+            symbol_info = market_cache.get_symbol_info(symbol)
+            if symbol_info is None:
+                contract_size = 1.0
+            else:
+                contract_size = self.contract_sizes[symbol] = symbol_info.trade_contract_size
+        return {
+            "net_lots": volume if order_type in BUY_TYPES else -volume,
+            "gross_lots": volume,
+            "notional": volume * contract_size * price,
+            "loss_at_sl": abs(price - sl) * volume * contract_size if sl else 0.0
+        }
+
+    def _apply(self, symbol, contribution, sign):
+        totals = self.symbols.setdefault(symbol, _empty_totals())
+        for key, value in contribution.items():
+            totals[key] += sign * value
+            self.account[key] += sign * value
+        self._changed = True
+
+    def add(self, ticket, symbol, order_type, volume, price, sl):
+        contribution = self._contribution(symbol, order_type, volume, price, sl)
+        with self._lock:
+            if ticket in self.entries:
+                self._apply(*self.entries.pop(ticket), -1)
+            self.entries[ticket] = (symbol, contribution)
+            self._apply(symbol, contribution, 1)
+
+    def remove(self, ticket):
+        with self._lock:
+            entry = self.entries.pop(ticket, None)
+            if entry is None:
+                return
+            self._apply(*entry, -1)
+            if not self.entries:
+                # Nothing open: drop accumulated float error
+                self.symbols = {}
+                self.account = _empty_totals()
+
+    def totals(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                return dict(self.account)
+            return dict(self.symbols.get(symbol, _empty_totals()))
+
+    # Function to publish the totals as gauges; symbols with nothing open
+    # any more are set to zero once. Does nothing if the book didn't change.
+    def publish(self):
+        with self._lock:
+            if not self._changed:
+                return
+            self._changed = False
+            gross = {symbol: totals["gross_lots"] for symbol, totals in self.symbols.items()}
+            loss_at_sl = self.account["loss_at_sl"]
+        for symbol in self._published - set(gross):
+            metrics.set_gauge(f"exposure_gross_lots.{symbol}", 0.0)
+        for symbol, value in gross.items():
+            metrics.set_gauge(f"exposure_gross_lots.{symbol}", value)
+        metrics.set_gauge("exposure_loss_at_sl", loss_at_sl)
+        self._published = set(gross)
+
+    # Function to check a new order against the limits. Returns the reason it
+    # would breach one, or None if it fits.
+    def check(self, symbol, order_type, volume, price, sl):
+        # Nothing to check against when no limit is configured
+        if not self.account_limits and symbol not in self.symbol_limits:
+            return None
+        contribution = self._contribution(symbol, order_type, volume, price, sl)
+        with self._lock:
+            scopes = [("account", self.account, self.account_limits),
+                      (symbol, self.symbols.get(symbol, _empty_totals()), self.symbol_limits.get(symbol, {}))]
+            for scope, totals, limits in scopes:
+                for limit_key, total_key in LIMIT_KEYS.items():
+                    if limit_key not in limits:
+                        continue
+                    projected = totals[total_key] + contribution[total_key]
+                    if total_key == "net_lots":
+                        projected = abs(projected)
+                    if projected > limits[limit_key]:
+                        metrics.inc("exposure_rejects")
+                        return f"{scope} {total_key} would be {projected:.2f}, limit {limits[limit_key]}"
+        return None
+
+    # Function to bring the book in line with the terminal's positions and
+    # orders, touching only the tickets that appeared or disappeared
+    def reconcile(self, positions, orders):
+        live = {}
+        for pos in positions:
+            live[pos.ticket] = (pos.symbol, pos.type, pos.volume, pos.price_open, pos.sl)
+        for order in orders:
+            live[order.ticket] = (order.symbol, order.type, order.volume_current, order.price_open, order.sl)
+        with self._lock:
+            gone = [ticket for ticket in self.entries if ticket not in live]
+        for ticket in gone:
+            self.remove(ticket)
+        for ticket, fields in live.items():
+            if ticket not in self.entries:
+                self.add(ticket, *fields)
+
+book = ExposureBook()
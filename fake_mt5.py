@@ -0,0 +1,324 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+import clock
+
+# Offline stand-in for the MetaTrader5 module. It implements the subset of the
+# API the scripts use with deterministic market data, so the trading code can
+# be benchmarked and exercised without a terminal:
+#
+#     import sys, fake_mt5
+#     sys.modules["MetaTrader5"] = fake_mt5
+
+TIMEFRAME_M1 = 1
+TIMEFRAME_M5 = 5
+TIMEFRAME_M15 = 15
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+
+ORDER_TYPE_BUY = 0
+ORDER_TYPE_SELL = 1
+ORDER_TYPE_BUY_LIMIT = 2
+ORDER_TYPE_SELL_LIMIT = 3
+ORDER_TYPE_BUY_STOP = 4
+ORDER_TYPE_SELL_STOP = 5
+ORDER_TYPE_BUY_STOP_LIMIT = 6
+ORDER_TYPE_SELL_STOP_LIMIT = 7
+
+TRADE_ACTION_DEAL = 1
+TRADE_ACTION_PENDING = 5
+TRADE_ACTION_SLTP = 6
+TRADE_ACTION_MODIFY = 7
+TRADE_ACTION_REMOVE = 8
+
+ORDER_TIME_GTC = 0
+ORDER_FILLING_FOK = 0
+ORDER_FILLING_IOC = 1
+ORDER_FILLING_RETURN = 2
+
+COPY_TICKS_ALL = -1
+COPY_TICKS_INFO = 1
+COPY_TICKS_TRADE = 2
+
+DEAL_ENTRY_IN = 0
+DEAL_ENTRY_OUT = 1
+
+TRADE_RETCODE_REQUOTE = 10004
+TRADE_RETCODE_REJECT = 10006
+TRADE_RETCODE_CANCEL = 10007
+TRADE_RETCODE_PLACED = 10008
+TRADE_RETCODE_DONE = 10009
+TRADE_RETCODE_DONE_PARTIAL = 10010
+TRADE_RETCODE_ERROR = 10011
+TRADE_RETCODE_TIMEOUT = 10012
+TRADE_RETCODE_INVALID = 10013
+TRADE_RETCODE_INVALID_VOLUME = 10014
+TRADE_RETCODE_INVALID_PRICE = 10015
+TRADE_RETCODE_INVALID_STOPS = 10016
+TRADE_RETCODE_TRADE_DISABLED = 10017
+TRADE_RETCODE_MARKET_CLOSED = 10018
+TRADE_RETCODE_NO_MONEY = 10019
+TRADE_RETCODE_PRICE_CHANGED = 10020
+TRADE_RETCODE_PRICE_OFF = 10021
+TRADE_RETCODE_TOO_MANY_REQUESTS = 10024
+TRADE_RETCODE_NO_CHANGES = 10025
+TRADE_RETCODE_LOCKED = 10028
+TRADE_RETCODE_INVALID_FILL = 10030
+TRADE_RETCODE_CONNECTION = 10031
+
+TIMEFRAME_SECONDS = {
+    TIMEFRAME_M1: 60,
+    TIMEFRAME_M5: 300,
+    TIMEFRAME_M15: 900,
+    TIMEFRAME_M30: 1800,
+    TIMEFRAME_H1: 3600
+}
+
+RATES_DTYPE = np.dtype([("time", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"),
+                        ("close", "<f8"), ("tick_volume", "<u8"), ("spread", "<i4"), ("real_volume", "<u8")])
+TICKS_DTYPE = np.dtype([("time", "<i8"), ("bid", "<f8"), ("ask", "<f8"), ("last", "<f8"),
+                        ("volume", "<u8"), ("time_msc", "<i8"), ("flags", "<u4"), ("volume_real", "<f8")])
+
+TerminalInfo = namedtuple("TerminalInfo", ["connected", "trade_allowed", "ping_last", "name"])
+AccountInfo = namedtuple("AccountInfo", ["login", "server", "currency", "balance", "equity", "margin_free", "leverage"])
+SymbolInfo = namedtuple("SymbolInfo", ["name", "visible", "digits", "point", "bid", "ask",
+                                       "trade_tick_size", "trade_tick_value", "trade_contract_size",
+                                       "volume_min", "volume_max", "volume_step",
+                                       "trade_stops_level", "trade_freeze_level", "description", "path"])
+Tick = namedtuple("Tick", ["time", "bid", "ask", "last", "volume", "time_msc", "flags", "volume_real"])
+TradePosition = namedtuple("TradePosition", ["ticket", "time", "type", "magic", "symbol", "volume",
+                                             "price_open", "sl", "tp", "price_current", "profit"])
+TradeOrder = namedtuple("TradeOrder", ["ticket", "time_setup", "type", "magic", "symbol", "volume_current",
+                                       "price_open", "sl", "tp"])
+OrderSendResult = namedtuple("OrderSendResult", ["retcode", "deal", "order", "volume", "price", "bid", "ask",
+                                                 "comment", "request_id", "retcode_external", "request"])
+
+state = {}
+
+# Function to reset the fake terminal to a known state
+def reset(symbols=("XAUUSD",), price=2000.0, digits=2, point=0.01):
+    state.clear()
+    state.update({
+        "initialized": False,
+        "connected": True,
+        "symbols": {},
+        "positions": {},
+        "orders": {},
+        "next_ticket": 1,
+        "retcodes": [],
+        "last_error": (1, "Success"),
+        "clock": None,
+        "bar_delay": 0.0
+    })
+    for symbol in symbols:
+        add_symbol(symbol, price, digits, point)
+
+# Function to add a tradable symbol
+def add_symbol(name, price=2000.0, digits=2, point=0.01):
+    state["symbols"][name] = {"price": price, "digits": digits, "point": point}
+
+# Function to freeze the fake server clock (None follows the real clock)
+def set_clock(timestamp):
+    state["clock"] = timestamp
+
+# Function to make a new bar show up only `seconds` after its open time,
+# like a terminal that receives the first tick of the bar late
+def set_bar_delay(seconds):
+    state["bar_delay"] = seconds
+
+# Function to make the next order_send calls return the given retcodes
+def queue_retcodes(*retcodes):
+    state["retcodes"].extend(retcodes)
+
+# Function to fill the book with pending orders that have no position
+def add_orphan_orders(count, symbol="XAUUSD"):
+    for _ in range(count):
+        ticket = _ticket()
+        state["orders"][ticket] = TradeOrder(ticket, int(_now()), ORDER_TYPE_SELL_STOP, 900000 + ticket,
+                                             symbol, 0.25, 1990.0, 0.0, 1989.0)
+
+def _now():
+    return state["clock"] if state.get("clock") is not None else clock.time()
+
+def _ticket():
+    ticket = state["next_ticket"]
+    state["next_ticket"] += 1
+    return ticket
+
+def _bar(symbol, open_time, seconds):
+    base = state["symbols"][symbol]["price"]
+    index = open_time // seconds
+    # Alternate bullish and bearish bars with a clear body
+    body = 1.0 if index % 2 == 0 else -1.0
+    open_price = base + (index % 7) * 0.1
+    close_price = open_price + body
+    return (open_time, open_price, max(open_price, close_price) + 0.2, min(open_price, close_price) - 0.2,
+            close_price, 100, 20, 0)
+
+def initialize(path=None, **kwargs):
+    state["initialized"] = True
+    return True
+
+def login(login, password=None, server=None, **kwargs):
+    return state["initialized"]
+
+def shutdown():
+    state["initialized"] = False
+    return True
+
+def last_error():
+    return state["last_error"]
+
+def terminal_info():
+    if not state["initialized"]:
+        return None
+    return TerminalInfo(state["connected"], True, 1000, "fake_mt5")
+
+def account_info():
+    return AccountInfo(1, "Fake-Server", "USD", 10000.0, 10000.0, 10000.0, 500)
+
+def symbol_select(symbol, enable=True):
+    return symbol in state["symbols"]
+
+def symbols_total():
+    return len(state["symbols"])
+
+def symbols_get(group=None):
+    return tuple(symbol_info(name) for name in state["symbols"])
+
+def symbol_info(symbol):
+    spec = state["symbols"].get(symbol)
+    if spec is None:
+        return None
+    return SymbolInfo(symbol, True, spec["digits"], spec["point"], spec["price"], spec["price"] + 0.2,
+                      spec["point"], 1.0, 100.0, 0.01, 100.0, 0.01, 0, 0, symbol, "Fake\\" + symbol)
+
+def symbol_info_tick(symbol):
+    spec = state["symbols"].get(symbol)
+    if spec is None:
+        return None
+    now = _now()
+    return Tick(int(now), spec["price"], spec["price"] + 0.2, 0.0, 0, int(now * 1000), 6, 0.0)
+
+def copy_rates_from_pos(symbol, timeframe, start_pos, count):
+    if symbol not in state["symbols"]:
+        state["last_error"] = (-4, "Terminal: Not found")
+        return None
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    current_open = int(_now() - state["bar_delay"]) // seconds * seconds
+    first_open = current_open - (start_pos + count - 1) * seconds
+    return np.array([_bar(symbol, first_open + i * seconds, seconds) for i in range(count)], dtype=RATES_DTYPE)
+
+def copy_rates_from(symbol, timeframe, date_from, count):
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    last_open = int(_timestamp(date_from)) // seconds * seconds
+    first_open = last_open - (count - 1) * seconds
+    return np.array([_bar(symbol, first_open + i * seconds, seconds) for i in range(count)], dtype=RATES_DTYPE)
+
+def copy_rates_range(symbol, timeframe, date_from, date_to):
+    if symbol not in state["symbols"]:
+        state["last_error"] = (-4, "Terminal: Not found")
+        return None
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    first_open = -(-int(_timestamp(date_from)) // seconds) * seconds
+    last_open = int(_timestamp(date_to))
+    return np.array([_bar(symbol, t, seconds) for t in range(first_open, last_open + 1, seconds)], dtype=RATES_DTYPE)
+
+def copy_ticks_range(symbol, date_from, date_to, flags=COPY_TICKS_ALL):
+    if symbol not in state["symbols"]:
+        state["last_error"] = (-4, "Terminal: Not found")
+        return None
+    start_msc = int(_timestamp(date_from) * 1000)
+    end_msc = int(_timestamp(date_to) * 1000)
+    # One tick every 250ms on a seeded random walk
+    time_msc = np.arange(start_msc, end_msc, 250, dtype=np.int64)
+    rng = np.random.default_rng(start_msc)
+    steps = rng.integers(-3, 4, size=len(time_msc)) * state["symbols"][symbol]["point"]
+    ticks = np.zeros(len(time_msc), dtype=TICKS_DTYPE)
+    ticks["time_msc"] = time_msc
+    ticks["time"] = time_msc // 1000
+    ticks["bid"] = state["symbols"][symbol]["price"] + np.cumsum(steps)
+    ticks["ask"] = ticks["bid"] + 0.2
+    ticks["flags"] = 6
+    return ticks
+
+def copy_ticks_from(symbol, date_from, count, flags=COPY_TICKS_ALL):
+    start = _timestamp(date_from)
+    return copy_ticks_range(symbol, start, start + count * 0.25, flags)
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+def positions_total():
+    return len(state["positions"])
+
+def positions_get(symbol=None, ticket=None, group=None):
+    positions = state["positions"].values()
+    if symbol is not None:
+        positions = [p for p in positions if p.symbol == symbol]
+    if ticket is not None:
+        positions = [p for p in positions if p.ticket == ticket]
+    return tuple(positions)
+
+def orders_total():
+    return len(state["orders"])
+
+def orders_get(symbol=None, ticket=None, group=None):
+    orders = state["orders"].values()
+    if symbol is not None:
+        orders = [o for o in orders if o.symbol == symbol]
+    if ticket is not None:
+        orders = [o for o in orders if o.ticket == ticket]
+    return tuple(orders)
+
+def history_deals_get(date_from=None, date_to=None, group=None, ticket=None, position=None):
+    # No deal history is kept: closed positions simply disappear
+    return ()
+
+def order_check(request):
+    return _result(TRADE_RETCODE_DONE, request, 0, 0)
+
+def order_send(request):
+    if not state["initialized"]:
+        state["last_error"] = (-10004, "No IPC connection")
+        return None
+    if state["retcodes"]:
+        return _result(state["retcodes"].pop(0), request, 0, 0)
+    action = request["action"]
+    if action == TRADE_ACTION_DEAL:
+        ticket = _ticket()
+        state["positions"][ticket] = TradePosition(ticket, int(_now()), request["type"], request.get("magic", 0),
+                                                   request["symbol"], request["volume"], request["price"],
+                                                   request.get("sl", 0.0), request.get("tp", 0.0), request["price"], 0.0)
+        return _result(TRADE_RETCODE_DONE, request, ticket, ticket)
+    if action == TRADE_ACTION_PENDING:
+        ticket = _ticket()
+        state["orders"][ticket] = TradeOrder(ticket, int(_now()), request["type"], request.get("magic", 0),
+                                             request["symbol"], request["volume"], request["price"],
+                                             request.get("sl", 0.0), request.get("tp", 0.0))
+        return _result(TRADE_RETCODE_DONE, request, 0, ticket)
+    if action == TRADE_ACTION_SLTP:
+        position = state["positions"].get(request["position"])
+        if position is None:
+            return _result(TRADE_RETCODE_INVALID, request, 0, 0)
+        state["positions"][position.ticket] = position._replace(sl=request["sl"], tp=request["tp"])
+        return _result(TRADE_RETCODE_DONE, request, 0, position.ticket)
+    if action == TRADE_ACTION_REMOVE:
+        if state["orders"].pop(request["order"], None) is None:
+            return _result(TRADE_RETCODE_INVALID, request, 0, 0)
+        return _result(TRADE_RETCODE_DONE, request, 0, request["order"])
+    return _result(TRADE_RETCODE_INVALID, request, 0, 0)
+
+def _result(retcode, request, deal, order):
+    price = request.get("price", 0.0)
+    return OrderSendResult(retcode, deal, order, request.get("volume", 0.0), price, price, price,
+                           "Request executed" if retcode == TRADE_RETCODE_DONE else "Fake rejection",
+                           0, 0, request)
+
+reset()
@@ -0,0 +1,288 @@
+import argparse
+import itertools
+import marshal
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import metrics
+from recorder import RECORDED_CALLS, CALL_IDS, install_serialized
+
+# Out-of-process MT5 gateway. One daemon owns the terminal connection and
+# serves market data, account state and order submission to any number of
+# local clients, so extra experiments or symbol sets don't each need their own
+# terminal, initialize and login:
+#
+#     python gateway.py --login 123 --password ... --server Exness-MT5Real6
+#     MT5_GATEWAY=127.0.0.1:5555 python test.py
+#
+# Frames are a fixed header (kind, request id, call id, payload length) and a
+# marshal payload. marshal has no types for MT5 results, so namedtuples,
+# numpy arrays and datetimes are encoded by hand as tagged tuples. Identical
+# data requests that are already queued are answered together from one
+# terminal call, and all clients' orders go through the same queue ahead of
+# data requests, one at a time.
+
+HEADER = struct.Struct("<BIHI")
+REQUEST, RESPONSE, ERROR = 1, 2, 3
+CONSTANTS_CALL = 0xFFFF
+DEFAULT_PORT = 5555
+# Client timeouts in seconds: reaching the gateway, and waiting for one reply
+# (orders queue behind other clients' orders, so this is generous)
+CONNECT_TIMEOUT = 5
+CALL_TIMEOUT = 30
+
+# Calls clients may not make: the gateway owns the connection
+GATEWAY_ONLY = {"initialize", "login", "shutdown"}
+ORDER_CALLS = {"order_send", "order_check"}
+
+NT_TAG = "\x00nt"
+ND_TAG = "\x00nd"
+DT_TAG = "\x00dt"
+
+# Function to turn MT5 values into something marshal can write
+def encode(value):
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return (NT_TAG, type(value).__name__, tuple(value._fields), tuple(encode(v) for v in value))
+    if isinstance(value, (tuple, list)):
+        return type(value)(encode(v) for v in value)
+    if isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    if isinstance(value, datetime):
+        return (DT_TAG, value.timestamp())
+    if getattr(value, "shape", None) == ():
+        # numpy scalar, e.g. a field read from a rates row
+        return value.item()
+    if hasattr(value, "dtype") and hasattr(value, "tobytes"):
+        return (ND_TAG, value.dtype.descr, value.shape, value.tobytes())
+    return value
+
+_types = {}
+
+# Function to rebuild namedtuples, arrays and datetimes from their encoded form
+def decode(value):
+    if isinstance(value, tuple) and value and isinstance(value[0], str):
+        tag = value[0]
+        if tag == NT_TAG:
+            _, typename, fields, values = value
+            key = (typename, fields)
+            if key not in _types:
+                _types[key] = namedtuple(typename, fields)
+            return _types[key](*(decode(v) for v in values))
+        if tag == ND_TAG:
+            import numpy as np
+            _, descr, shape, data = value
+            return np.frombuffer(data, dtype=np.dtype([tuple(field) for field in descr])).reshape(shape)
+        if tag == DT_TAG:
+            return datetime.fromtimestamp(value[1], tz=timezone.utc)
+    if isinstance(value, (tuple, list)):
+        return type(value)(decode(v) for v in value)
+    if isinstance(value, dict):
+        return {k: decode(v) for k, v in value.items()}
+    return value
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("gateway connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+# Function to read one frame: returns (kind, request_id, call_id, payload)
+def read_frame(sock):
+    kind, request_id, call_id, length = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return kind, request_id, call_id, _recv_exact(sock, length)
+
+def write_frame(sock, kind, request_id, call_id, payload):
+    sock.sendall(HEADER.pack(kind, request_id, call_id, len(payload)) + payload)
+
+# Owns the terminal: queues client calls, coalesces identical data requests
+# and executes everything on one worker thread, orders first
+class Gateway:
+    def __init__(self, mt5):
+        self.mt5 = mt5
+        self.constants = {name: getattr(mt5, name) for name in dir(mt5)
+                          if name.isupper() and isinstance(getattr(mt5, name), (int, float, str))}
+        self._queue = queue.PriorityQueue()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self.worker = threading.Thread(target=self._work, name="mt5-gateway", daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    # Function to queue one client call; the reply goes to `reply(kind, payload)`
+    def submit(self, call_id, payload, reply):
+        name = RECORDED_CALLS[call_id]
+        if name in ORDER_CALLS:
+            metrics.inc("gateway_orders")
+            self._queue.put((0, next(self._sequence), None, name, payload, [reply]))
+            return
+        key = (call_id, payload)
+        with self._pending_lock:
+            waiters = self._pending.get(key)
+            if waiters is not None:
+                # Same request already queued: answer both from one call
+                waiters.append(reply)
+                metrics.inc("gateway_coalesced")
+                return
+            waiters = self._pending[key] = [reply]
+        self._queue.put((1, next(self._sequence), key, name, payload, waiters))
+
+    def _work(self):
+        while True:
+            _, _, key, name, payload, waiters = self._queue.get()
+            if key is not None:
+                with self._pending_lock:
+                    self._pending.pop(key, None)
+            try:
+                args, kwargs = decode(marshal.loads(payload))
+                result = getattr(self.mt5, name)(*args, **kwargs)
+                kind, body = RESPONSE, marshal.dumps((encode(result), tuple(self.mt5.last_error())))
+            except Exception as e:
+                kind, body = ERROR, marshal.dumps(f"{type(e).__name__}: {e}")
+            metrics.inc(f"gateway_calls.{name}")
+            for reply in waiters:
+                reply(kind, body)
+
+# One client connection: reads pipelined requests, replies as results arrive
+class ClientHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        gateway = self.server.gateway
+        send_lock = threading.Lock()
+        peer = self.client_address
+        print(f"Gateway client connected: {peer}")
+        metrics.inc("gateway_clients")
+        try:
+            while True:
+                kind, request_id, call_id, payload = read_frame(self.request)
+                if kind != REQUEST:
+                    continue
+
+                def reply(kind, body, request_id=request_id, call_id=call_id):
+                    with send_lock:
+                        try:
+                            write_frame(self.request, kind, request_id, call_id, body)
+                        except OSError:
+                            pass
+                if call_id == CONSTANTS_CALL:
+                    reply(RESPONSE, marshal.dumps(gateway.constants))
+                elif call_id >= len(RECORDED_CALLS) or RECORDED_CALLS[call_id] in GATEWAY_ONLY:
+                    reply(ERROR, marshal.dumps(f"call {call_id} is not served by the gateway"))
+                else:
+                    gateway.submit(call_id, payload, reply)
+        except (ConnectionError, OSError):
+            pass
+        print(f"Gateway client disconnected: {peer}")
+
+class GatewayServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, gateway):
+        super().__init__(address, ClientHandler)
+        self.gateway = gateway
+
+# Drop-in replacement for the MetaTrader5 module that forwards to a gateway.
+# initialize/login/shutdown are local no-ops since the gateway owns them.
+# A call that times out or fails closes the connection: a reply may still be
+# on its way, so the stream can't be trusted any more.
+class GatewayClient:
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=CALL_TIMEOUT):
+        self._sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+        self._sock.settimeout(timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._last_error = (1, "Success")
+        self.__dict__.update(self._call(CONSTANTS_CALL, b"", raw=True))
+        print(f"Connected to MT5 gateway at {host}:{port}")
+
+    def _call(self, call_id, payload, raw=False):
+        with self._lock:
+            request_id = next(self._request_ids) & 0xFFFFFFFF
+            try:
+                write_frame(self._sock, REQUEST, request_id, call_id, payload)
+                kind, _, _, body = read_frame(self._sock)
+            except OSError:
+                self._sock.close()
+                raise
+        value = marshal.loads(body)
+        if kind == ERROR:
+            raise RuntimeError(f"MT5 gateway error: {value}")
+        if raw:
+            return value
+        result, self._last_error = value
+        return decode(result)
+
+    def initialize(self, *args, **kwargs):
+        return True
+
+    def login(self, *args, **kwargs):
+        return True
+
+    def shutdown(self):
+        return None
+
+    def close(self):
+        self._sock.close()
+
+    def last_error(self):
+        return self._last_error
+
+    def __getattr__(self, name):
+        if name not in CALL_IDS:
+            raise AttributeError(f"MT5 gateway has no attribute {name}")
+        call_id = CALL_IDS[name]
+
+        def forwarded(*args, **kwargs):
+            return self._call(call_id, marshal.dumps(encode((args, kwargs))))
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, forwarded)
+        return forwarded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one MT5 terminal to local clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--path", help="terminal64.exe path")
+    parser.add_argument("--login", type=int, required=True)
+    parser.add_argument("--password", default=os.environ.get("MT5_PASSWORD"))
+    parser.add_argument("--server", required=True)
+    args = parser.parse_args()
+
+    # The worker and the supervisor thread share the terminal through one lock
+    install_serialized()
+    import MetaTrader5 as mt5
+    from supervisor import ConnectionSupervisor
+
+    initialized = mt5.initialize(path=args.path) if args.path else mt5.initialize()
+    if not initialized or not mt5.login(args.login, args.password, args.server):
+        print(f"Failed to connect to MT5: {mt5.last_error()}")
+        mt5.shutdown()
+        sys.exit(1)
+    supervisor = ConnectionSupervisor(args.login, args.password, args.server, path=args.path,
+                                      metrics_path="gateway_metrics.json")
+    supervisor.start()
+    gateway = Gateway(mt5)
+    gateway.start()
+    server = GatewayServer((args.host, args.port), gateway)
+    print(f"MT5 gateway listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Gateway stopped by user (KeyboardInterrupt)")
+    finally:
+        server.server_close()
+        supervisor.stop()
+        mt5.shutdown()
@@ -0,0 +1,158 @@
+import bisect
+import json
+import os
+from collections import deque
+
+# Incremental indicators over the closed-bar stream of one symbol/timeframe.
+# Each new bar updates ATR (Wilder) and an EMA of the bar range in O(1), and a
+# rolling percentile of the body size in O(window) (a sorted window of fixed
+# size, kept with bisect), and the whole state round-trips through JSON so a
+# restart doesn't recompute history. Values are in price units.
+#
+# Config, under "trading" or per symbol in "settings":
+#   "indicator_settings": {"atr_period": 14, "range_period": 14, "body_window": 100, "body_percentile": 50}
+#   "volatility_filter": {"indicator": "atr", "multiple": 0.3}
+# where indicator is "atr", "range_ema" or "body_percentile".
+
+INDICATORS_PATH = "indicators.json"
+DEFAULTS = {"atr_period": 14, "range_period": 14, "body_window": 100, "body_percentile": 50}
+INDICATOR_NAMES = ("atr", "range_ema", "body_percentile")
+
+class IndicatorEngine:
+    def __init__(self, atr_period=14, range_period=14, body_window=100, body_percentile=50):
+        self.params = {"atr_period": atr_period, "range_period": range_period,
+                       "body_window": body_window, "body_percentile": body_percentile}
+        self.last_time = 0
+        self.prev_close = None
+        self.atr = None
+        self.atr_seed = []
+        self.range_ema = None
+        self.bodies = deque()
+        self.sorted_bodies = []
+
+    # Function to fold one closed bar in; bars at or before the last one are ignored
+    def update(self, bar):
+        bar_time = int(bar["time"])
+        if bar_time <= self.last_time:
+            return False
+        self.last_time = bar_time
+        high, low, close = bar["high"], bar["low"], bar["close"]
+
+        # ATR: simple mean of the first atr_period true ranges, then Wilder smoothing
+        if self.prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        period = self.params["atr_period"]
+        if self.atr is None:
+            self.atr_seed.append(true_range)
+            if len(self.atr_seed) == period:
+                self.atr = sum(self.atr_seed) / period
+                self.atr_seed = []
+        else:
+            self.atr = (self.atr * (period - 1) + true_range) / period
+
+        # EMA of the high-low range
+        alpha = 2 / (self.params["range_period"] + 1)
+        bar_range = high - low
+        self.range_ema = bar_range if self.range_ema is None else self.range_ema + alpha * (bar_range - self.range_ema)
+
+        # Rolling window of body sizes, kept sorted for the percentile
+        body = abs(close - bar["open"])
+        self.bodies.append(body)
+        bisect.insort(self.sorted_bodies, body)
+        if len(self.bodies) > self.params["body_window"]:
+            old = self.bodies.popleft()
+            del self.sorted_bodies[bisect.bisect_left(self.sorted_bodies, old)]
+        return True
+
+    # Function to get current values; an indicator still warming up is None
+    def values(self):
+        body_percentile = None
+        if len(self.sorted_bodies) >= self.params["body_window"]:
+            rank = int(self.params["body_percentile"] / 100 * (len(self.sorted_bodies) - 1))
+            body_percentile = self.sorted_bodies[rank]
+        return {"atr": self.atr, "range_ema": self.range_ema, "body_percentile": body_percentile}
+
+    def to_state(self):
+        return {
+            "params": self.params,
+            "last_time": self.last_time,
+            "prev_close": self.prev_close,
+            "atr": self.atr,
+            "atr_seed": self.atr_seed,
+            "range_ema": self.range_ema,
+            "bodies": list(self.bodies)
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        engine = cls(**state["params"])
+        engine.last_time = state["last_time"]
+        engine.prev_close = state["prev_close"]
+        engine.atr = state["atr"]
+        engine.atr_seed = state["atr_seed"]
+        engine.range_ema = state["range_ema"]
+        engine.bodies = deque(state["bodies"])
+        engine.sorted_bodies = sorted(engine.bodies)
+        return engine
+
+# Function to resolve indicator parameters for a symbol
+def engine_params(trading, settings):
+    params = dict(DEFAULTS)
+    params.update(trading.get("indicator_settings", {}))
+    params.update(settings.get("indicator_settings", {}))
+    return params
+
+# Function to check whether a symbol (or any of its strategy variants) filters on volatility
+def filter_enabled(trading, settings):
+    if trading.get("volatility_filter") or settings.get("volatility_filter"):
+        return True
+    return any(variant.get("volatility_filter") for variant in settings.get("strategies") or [])
+
+# Function to get the engine for a symbol/timeframe, replacing it when the
+# parameters changed. Returns (engine, is_new).
+def get_engine(engines, symbol, timeframe, params):
+    key = f"{symbol}:{timeframe}"
+    engine = engines.get(key)
+    if engine is None or engine.params != params:
+        engine = IndicatorEngine(**params)
+        engines[key] = engine
+        return engine, True
+    return engine, False
+
+# Function to get the minimum candle body a volatility filter asks for, or None
+def filter_threshold(volatility_filter, values):
+    if not volatility_filter:
+        return None
+    indicator = volatility_filter.get("indicator", "atr")
+    if indicator not in INDICATOR_NAMES:
+        print(f"Unknown volatility filter indicator: {indicator}. Supported: {list(INDICATOR_NAMES)}")
+        return None
+    value = values.get(indicator)
+    if value is None:
+        return None
+    return value * volatility_filter.get("multiple", 1.0)
+
+# Function to save all engines atomically
+def save_state(engines, path=INDICATORS_PATH):
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({key: engine.to_state() for key, engine in engines.items()}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Failed to save indicators to {path}: {e}")
+
+# Function to load saved engines, starting empty if there are none
+def load_state(path=INDICATORS_PATH):
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError, TypeError) as e:
+        print(f"Ignoring unreadable indicator state {path}: {e}")
+        return {}
+    return {key: IndicatorEngine.from_state(state) for key, state in data.items()}
@@ -1,10 +1,16 @@
+import recorder
+recorder.install_from_env()
+
 import MetaTrader5 as mt5
 import time
 import json
-import os
 from datetime import datetime, timedelta, timezone
 from filelock import FileLock
 
+import market_cache
+import strategies
+from supervisor import ConnectionSupervisor
+
 # Function to read configuration with file locking
 def read_config():
     lock = FileLock("config.json.lock")
@@ -16,6 +22,25 @@ def read_config():
         print(f"Error reading config: {e}")
         return None
 
+# Function to lay the flat config.json out the way strategies.py reads it
+def trading_config(config):
+    return {
+        "symbols": config["symbols"],
+        "trade_mode": "both",
+        "volume": config["volume"],
+        "tp": config["D_tp"],
+        "sl": config["D_sl"],
+        "counter": config["D_counter"],
+        "M": config["M"],
+        "tp_counter": config["D_tp_counter"],
+        "sl_counter": None,
+        "counter_trade_enabled": config["counter_trade_enabled"],
+        "min_candle_size_points": config.get("min_candle_size_points", 0),
+        # This script only counters a trade that opened
+        "counter_requires_main": True,
+        "settings": {symbol: {} for symbol in config["symbols"]}
+    }
+
 # Function to get the most recent completed candle
 def get_previous_candle(symbol):
     rates = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_M1, 0, 1)
@@ -69,6 +94,31 @@ def place_pending_order(symbol, order_type, volume, price, tp, magic):
     result = mt5.order_send(request)
     return result
 
+# Function to send one strategy intent: the main market order with its TP/SL,
+# then its counter stop order on the opposite side of the signal tick
+def execute_intent(symbol, intent, tick, magic):
+    if intent["side"] == "buy":
+        trade_type, counter_type, price, sign = mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL_STOP, tick.ask, -1
+    else:
+        trade_type, counter_type, price, sign = mt5.ORDER_TYPE_SELL, mt5.ORDER_TYPE_BUY_STOP, tick.bid, 1
+    side = intent["side"].upper()
+    tp = price - sign * intent["tp"]
+    sl = price + sign * intent["sl"]
+    result = open_trade(symbol, trade_type, intent["volume"], price, tp, sl, magic)
+    opened = result is not None and result.retcode == mt5.TRADE_RETCODE_DONE
+    if not opened:
+        print(f"[{symbol}] Failed to open {side} trade: {result.comment if result is not None else mt5.last_error()}")
+    else:
+        print(f"[{symbol}] Opened {side} trade at {price} with magic {magic}")
+    counter = intent["counter"]
+    if counter is None or (not opened and counter["requires_main"]):
+        return result
+    counter_price = price + sign * counter["distance"]
+    counter_tp = counter_price + sign * counter["tp"]
+    place_pending_order(symbol, counter_type, counter["volume"], counter_price, counter_tp, magic)
+    print(f"[{symbol}] Placed {'SELL' if sign < 0 else 'BUY'} STOP counter trade at {counter_price} with magic {magic}")
+    return result
+
 # Main trading loop
 if __name__ == "__main__":
     # Initialize MT5
@@ -87,6 +137,10 @@ if __name__ == "__main__":
 
     print("MT5 Trading Bot Started")
 
+    # Reconnects are handled by the supervisor thread
+    supervisor = ConnectionSupervisor(account, password, server)
+    supervisor.start()
+
     # Initialize magic counter
     positions = mt5.positions_get() or []
     orders = mt5.orders_get() or []
@@ -94,6 +148,10 @@ if __name__ == "__main__":
     magic_counter = max(all_magic) + 1 if all_magic else 100000
 
     while True:
+        if not supervisor.wait_connected(60):
+            print("MT5 is still reconnecting, waiting for the supervisor")
+            continue
+
         # Cancel pending orders if main trade is closed
         positions = mt5.positions_get() or []
         position_magics = set(pos.magic for pos in positions)
@@ -117,14 +175,8 @@ if __name__ == "__main__":
             continue
 
         symbols = config["symbols"]
-        volume = config["volume"]
-        D_tp = config["D_tp"]
-        D_sl = config["D_sl"]
-        D_counter = config["D_counter"]
-        M = config["M"]
-        D_tp_counter = config["D_tp_counter"]
-        counter_trade_enabled = config["counter_trade_enabled"]
-        min_candle_size_points = config.get("min_candle_size_points", 0)
+        trading = trading_config(config)
+        supervisor.watch(symbols, mt5.TIMEFRAME_M1)
 
         # Wait for the next minute to process the just-closed candle
         current_time = time.time()
@@ -137,7 +189,7 @@ if __name__ == "__main__":
                 continue
 
             # Fetch symbol info for price formatting
-            symbol_info = mt5.symbol_info(symbol)
+            symbol_info = market_cache.get_symbol_info(symbol)
             if symbol_info is None:
                 print(f"[{symbol}] Failed to get symbol info")
                 continue
@@ -150,49 +202,17 @@ if __name__ == "__main__":
             # Log candle times and prices
             print(f"[{symbol}] Previous candle: Open time={candle_data['open_time']}, Close time={candle_data['close_time']}, Open={open_price}, Close={close_price}")
 
-            # Check if candle is neutral
-            point = symbol_info.point
-            min_candle_size = min_candle_size_points * point
-            if abs(candle_data['close'] - candle_data['open']) < min_candle_size:
-                print(f"[{symbol}] Neutral candle, skipping")
+            # The candle rule lives in strategies.py
+            strategies_for_symbol = strategies.build_strategies(symbol, trading, symbol_info.point)
+            intents = strategies.evaluate(strategies_for_symbol, [candle_data])
+            if not intents:
                 continue
 
             tick = mt5.symbol_info_tick(symbol)
             if tick is None:
                 print(f"[{symbol}] Failed to get tick price")
                 continue
-            magic = magic_counter
-            magic_counter += 1
-
-            if candle_data['close'] > candle_data['open']:
-                # Bullish candle, open BUY trade
-                trade_type = mt5.ORDER_TYPE_BUY
-                price = tick.ask
-                tp = price + D_tp
-                sl = price - D_sl
-                result = open_trade(symbol, trade_type, volume, price, tp, sl, magic)
-                if result.retcode != mt5.TRADE_RETCODE_DONE:
-                    print(f"[{symbol}] Failed to open BUY trade: {result.comment}")
-                    continue
-                print(f"[{symbol}] Opened BUY trade at {price} with magic {magic}")
-                if counter_trade_enabled:
-                    counter_price = price - D_counter
-                    counter_tp = counter_price - D_tp_counter
-                    place_pending_order(symbol, mt5.ORDER_TYPE_SELL_STOP, volume * M, counter_price, counter_tp, magic)
-                    print(f"[{symbol}] Placed SELL STOP counter trade at {counter_price} with magic {magic}")
-            elif candle_data['close'] < candle_data['open']:
-                # Bearish candle, open SELL trade
-                trade_type = mt5.ORDER_TYPE_SELL
-                price = tick.bid
-                tp = price - D_tp
-                sl = price + D_sl
-                result = open_trade(symbol, trade_type, volume, price, tp, sl, magic)
-                if result.retcode != mt5.TRADE_RETCODE_DONE:
-                    print(f"[{symbol}] Failed to open SELL trade: {result.comment}")
-                    continue
-                print(f"[{symbol}] Opened SELL trade at {price} with magic {magic}")
-                if counter_trade_enabled:
-                    counter_price = price + D_counter
-                    counter_tp = counter_price + D_tp_counter
-                    place_pending_order(symbol, mt5.ORDER_TYPE_BUY_STOP, volume * M, counter_price, counter_tp, magic)
-                    print(f"[{symbol}] Placed BUY STOP counter trade at {counter_price} with magic {magic}")
\ No newline at end of file
+            for intent in intents:
+                magic = magic_counter
+                magic_counter += 1
+                execute_intent(symbol, intent, tick, magic)
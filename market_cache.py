@@ -0,0 +1,73 @@
+import MetaTrader5 as mt5
+import threading
+
+import clock
+
+# Cached symbol metadata, refilled after (re)connecting so the first bar of a
+# cycle doesn't pay for cold symbol_info lookups. Entries are refetched after
+# SYMBOL_INFO_TTL seconds, and dropped when the symbol can't be selected, so a
+# symbol hidden or changed in the terminal doesn't stay cached for good.
+# Warm-up also primes the terminal itself: the first history request per
+# symbol is the slow one, so it is made before the bar instead of on it.
+SYMBOL_INFO_TTL = 300
+
+_lock = threading.Lock()
+_symbol_info = {}
+
+# Function to get symbol info, served from the cache when possible
+def get_symbol_info(symbol):
+    now = clock.monotonic()
+    with _lock:
+        entry = _symbol_info.get(symbol)
+    if entry is not None and now - entry[1] < SYMBOL_INFO_TTL:
+        return entry[0]
+    info = mt5.symbol_info(symbol)
+    if info is not None:
+        store_symbol_info(symbol, info)
+    return info
+
+# Function to get symbol info only if it is cached (fresh or not)
+def cached_symbol_info(symbol):
+    with _lock:
+        entry = _symbol_info.get(symbol)
+    return entry[0] if entry is not None else None
+
+# Function to get a snapshot of all cached symbol info as symbol -> info
+def cached_symbols():
+    with _lock:
+        return {symbol: entry[0] for symbol, entry in _symbol_info.items()}
+
+def store_symbol_info(symbol, info):
+    with _lock:
+        _symbol_info[symbol] = (info, clock.monotonic())
+
+def drop_symbol_info(symbol):
+    with _lock:
+        _symbol_info.pop(symbol, None)
+
+# Function to drop everything cached (e.g. after the terminal went away)
+def clear():
+    with _lock:
+        _symbol_info.clear()
+
+# Function to select symbols, refill their metadata and prime the terminal's
+# history and tick data for them
+def warm_symbols(symbols, timeframe=None, bars=2):
+    warmed = 0
+    for symbol in symbols:
+        if not mt5.symbol_select(symbol, True):
+            print(f"[{symbol}] Warm-up: failed to select symbol, MT5 error: {mt5.last_error()}")
+            drop_symbol_info(symbol)
+            continue
+        info = mt5.symbol_info(symbol)
+        if info is None:
+            print(f"[{symbol}] Warm-up: failed to get symbol info")
+            drop_symbol_info(symbol)
+            continue
+        store_symbol_info(symbol, info)
+        if timeframe is not None:
+            mt5.copy_rates_from_pos(symbol, timeframe, 0, bars)
+        mt5.symbol_info_tick(symbol)
+        warmed += 1
+    print(f"Warm-up complete: {warmed}/{len(symbols)} symbols ready")
+    return warmed
@@ -0,0 +1,40 @@
+import json
+import os
+import threading
+import time
+
+# Process-wide counters and gauges shared by the trading loop and its helpers
+_lock = threading.Lock()
+counters = {}
+gauges = {}
+
+# Function to increment a counter
+def inc(name, value=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+# Function to set a gauge to its latest value
+def set_gauge(name, value):
+    with _lock:
+        gauges[name] = value
+
+# Function to get a consistent copy of all metrics
+def snapshot():
+    with _lock:
+        return {
+            "time": time.time(),
+            "counters": dict(counters),
+            "gauges": dict(gauges)
+        }
+
+# Function to write the current metrics to a JSON file
+def write_metrics(path="metrics.json"):
+    data = snapshot()
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        # Replace atomically so readers never see a half-written file
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing metrics: {e}")
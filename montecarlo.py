@@ -0,0 +1,133 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+# Monte Carlo robustness check of a backtest's trade sequence. A single
+# backtest is one ordering of its trades; resampling them shows how much of
+# the drawdown and the final equity was luck of the order:
+#
+#     python montecarlo.py outcomes.npy --paths 100000 --equity 10000 --contract-size 100 --M 1 3 5
+#
+# outcomes.npy is saved by `backtest_ticks.py --out`, or is any 1-D array of
+# per-trade P&L. "bootstrap" draws trades with replacement, "permutation"
+# shuffles the same trades. Paths are evaluated as matrices, a chunk of paths
+# at a time so memory stays bounded. With backtest outcomes, --M re-weights
+# the counter legs, so every counter multiplier is a parameter set of its own
+# without re-running the backtest.
+
+METHODS = ("bootstrap", "permutation")
+CHUNK_ELEMENTS = 1 << 22
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+# Function to get per-trade P&L in account currency from an outcomes array
+def trade_pnl(outcomes, volume=1.0, M=None, contract_size=1.0):
+    if outcomes.dtype.names is None:
+        return np.asarray(outcomes, dtype=np.float64) * contract_size
+    if M is None:
+        return outcomes["pnl"] * contract_size
+    return (outcomes["main_pnl"] + outcomes["counter_pnl"] * M) * volume * contract_size
+
+# Function to compute max drawdown, terminal equity and ruin for one matrix
+# of paths (rows are paths, columns trades)
+def path_stats(pnl_paths, equity, ruin_level):
+    curve = np.cumsum(pnl_paths, axis=1)
+    curve += equity
+    terminal = curve[:, -1].copy()
+    ruined = curve.min(axis=1) <= ruin_level
+    peak = np.maximum.accumulate(curve, axis=1)
+    np.maximum(peak, equity, out=peak)
+    # Reuse the buffers: curve becomes the drawdown, then the drawdown fraction
+    np.subtract(peak, curve, out=curve)
+    drawdown = curve.max(axis=1)
+    np.divide(curve, peak, out=curve)
+    drawdown_pct = curve.max(axis=1)
+    return drawdown, drawdown_pct, terminal, ruined
+
+# Function to run `paths` resamples of a trade P&L sequence. Returns a dict
+# of distributions (max drawdown, max drawdown %, terminal equity) and the
+# probability of equity touching equity * ruin_fraction.
+def simulate(pnl, paths=10000, method="bootstrap", equity=10000.0, ruin_fraction=0.0, seed=None):
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, expected one of {METHODS}")
+    pnl = np.asarray(pnl, dtype=np.float64)
+    n = len(pnl)
+    if n == 0:
+        raise ValueError("No trades to resample")
+    rng = np.random.default_rng(seed)
+    ruin_level = equity * ruin_fraction
+    chunk = max(1, CHUNK_ELEMENTS // n)
+    drawdown = np.empty(paths)
+    drawdown_pct = np.empty(paths)
+    terminal = np.empty(paths)
+    ruined = np.empty(paths, dtype=bool)
+    for lo in range(0, paths, chunk):
+        hi = min(paths, lo + chunk)
+        if method == "bootstrap":
+            sample = pnl[rng.integers(0, n, size=(hi - lo, n), dtype=np.int32)]
+        else:
+            sample = rng.permuted(np.tile(pnl, (hi - lo, 1)), axis=1)
+        drawdown[lo:hi], drawdown_pct[lo:hi], terminal[lo:hi], ruined[lo:hi] = path_stats(sample, equity, ruin_level)
+    historical = path_stats(pnl[None, :], equity, ruin_level)
+    return {
+        "trades": n,
+        "paths": paths,
+        "method": method,
+        "max_drawdown": drawdown,
+        "max_drawdown_pct": drawdown_pct,
+        "terminal_equity": terminal,
+        "ruin_probability": float(ruined.mean()),
+        "historical": {
+            "max_drawdown": float(historical[0][0]),
+            "max_drawdown_pct": float(historical[1][0]),
+            "terminal_equity": float(historical[2][0]),
+            "ruined": bool(historical[3][0])
+        }
+    }
+
+# Function to reduce a simulate() result to percentiles for printing or JSON
+def summarize(result, percentiles=PERCENTILES):
+    summary = {key: result[key] for key in ("trades", "paths", "method", "ruin_probability", "historical")}
+    for key in ("max_drawdown", "max_drawdown_pct", "terminal_equity"):
+        values = np.percentile(result[key], percentiles)
+        summary[key] = {f"p{p}": float(v) for p, v in zip(percentiles, values)}
+    return summary
+
+def print_summary(name, summary):
+    historical = summary["historical"]
+    print(f"{name}: {summary['trades']} trades, {summary['paths']} {summary['method']} paths")
+    print(f"  Ruin probability: {summary['ruin_probability']:.2%}")
+    for key, label in (("max_drawdown", "Max drawdown"), ("max_drawdown_pct", "Max drawdown %"), ("terminal_equity", "Terminal equity")):
+        scale = 100 if key == "max_drawdown_pct" else 1
+        row = "  ".join(f"{p}={v * scale:.2f}" for p, v in summary[key].items())
+        print(f"  {label}: {row} (historical {historical[key] * scale:.2f})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo resampling of backtest trade sequences")
+    parser.add_argument("outcomes", nargs="+", help="outcome arrays from backtest_ticks.py --out (one parameter set each)")
+    parser.add_argument("--paths", type=int, default=100000)
+    parser.add_argument("--method", choices=METHODS, default="bootstrap")
+    parser.add_argument("--equity", type=float, default=10000.0, help="starting equity")
+    parser.add_argument("--ruin", type=float, default=0.0, help="ruin when equity touches this fraction of the start")
+    parser.add_argument("--contract-size", type=float, default=1.0, help="account currency per price unit and lot")
+    parser.add_argument("--volume", type=float, default=1.0, help="main volume when re-weighting with --M")
+    parser.add_argument("--M", type=float, nargs="*", help="counter volume multipliers to evaluate")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", help="write the summaries to this file")
+    args = parser.parse_args()
+
+    summaries = {}
+    for path in args.outcomes:
+        outcomes = np.load(path)
+        for M in args.M or [None]:
+            name = path if M is None else f"{path} M={M:g}"
+            pnl = trade_pnl(outcomes, args.volume, M, args.contract_size)
+            start = time.perf_counter()
+            result = simulate(pnl, args.paths, args.method, args.equity, args.ruin, args.seed)
+            summaries[name] = summarize(result)
+            print_summary(name, summaries[name])
+            print(f"  ({time.perf_counter() - start:.2f}s)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
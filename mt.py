@@ -5,6 +5,14 @@ import os
 from datetime import datetime, timedelta, timezone
 from filelock import FileLock
 
+import clock
+import execution
+import prices
+import sessions
+import strategies
+import throttle
+import tracing
+
 # Function to read configuration with file locking
 def read_config():
     print("Attempting to read config.json")
@@ -19,21 +27,10 @@ def read_config():
         print(f"Error reading config: {e}")
         return None
 
-# Function to get the next run time (start of the next 15-minute interval)
-def get_next_run_time():
-    now = datetime.now(timezone.utc)
-    print(f"Calculating next run time. Current time: {now}")
-    # Find the current 15-minute interval start
-    current_interval = now.replace(minute=(now.minute // 15) * 15, second=0, microsecond=0)
-    # Next interval is 15 minutes later
-    next_interval = current_interval + timedelta(minutes=15)
-    print(f"Next run time calculated: {next_interval}")
-    return next_interval
-
 def get_previous_candle(symbol, run_time=None):
     print(f"[{symbol}] Fetching previous candle")
     if run_time is None:
-        run_time = datetime.now(timezone.utc)
+        run_time = clock.now()
         print(f"[{symbol}] No run_time provided, using current time: {run_time}")
     # Align to the start of the current 15-minute interval
     minutes = (run_time.minute // 15) * 15
@@ -43,7 +40,9 @@ def get_previous_candle(symbol, run_time=None):
     # Set start_time to 15 minutes before end_time
     start_time = end_time - timedelta(minutes=15)
     print(f"[{symbol}] Requesting rates from {start_time} to {end_time}")
-    rates = mt5.copy_rates_range(symbol, mt5.TIMEFRAME_M15, start_time, end_time)
+    # Bar times are in server time, which is UTC plus the broker's zone
+    zone = timedelta(seconds=clock.server_zone())
+    rates = mt5.copy_rates_range(symbol, mt5.TIMEFRAME_M15, start_time + zone, end_time + zone)
     print(f"[{symbol}] Got {len(rates) if rates is not None else 'None'} bars")
     if rates is None or len(rates) < 1:
         error = mt5.last_error()
@@ -51,7 +50,7 @@ def get_previous_candle(symbol, run_time=None):
         return None
     # Select the last candle, which should be the previous completed one
     candle = rates[-1]
-    open_time = datetime.fromtimestamp(candle['time'], tz=timezone.utc)
+    open_time = datetime.fromtimestamp(candle['time'], tz=timezone.utc) - zone
     close_time = open_time + timedelta(minutes=15)
     print(f"[{symbol}] Candle details: Open time={open_time}, Close time={close_time}, Open={candle['open']}, Close={candle['close']}")
     return {
@@ -62,10 +61,17 @@ def get_previous_candle(symbol, run_time=None):
     }
 
 # Function to open main trade
-def open_trade(symbol, trade_type, volume, D_tp, D_sl, magic):
+def open_trade(symbol, trade_type, volume, D_tp, D_sl, magic, deadline=None, scale=None):
+    if deadline is None:
+        deadline = execution.deadline_in()
+    if scale is None:
+        scale = prices.scale_for(mt5.symbol_info(symbol))
     tp_distance = D_tp 
     sl_distance = D_sl
     tick = mt5.symbol_info_tick(symbol)
+    if tick is None:
+        print(f"[{symbol}] Failed to get tick for main trade")
+        return None
     price = tick.ask if trade_type == mt5.ORDER_TYPE_BUY else tick.bid
     request = {
         "action": mt5.TRADE_ACTION_DEAL,
@@ -79,31 +85,34 @@ def open_trade(symbol, trade_type, volume, D_tp, D_sl, magic):
         "type_time": mt5.ORDER_TIME_GTC,
         "type_filling": mt5.ORDER_FILLING_FOK,
     }
-    result = mt5.order_send(request)
-    if result.retcode != mt5.TRADE_RETCODE_DONE:
-        print(f"[{symbol}] Failed to open trade: retcode={result.retcode}, comment={result.comment}")
+    result, attempts = execution.send_order(request, deadline, reprice=execution.reprice_from_tick)
+    if result is None:
+        print(f"[{symbol}] Failed to open trade after {len(attempts)} attempt(s): retcode={attempts[-1]['retcode']}, comment={attempts[-1]['comment']}")
         return None
     
     opening_price = result.price
     position_id = result.order
-    tp = opening_price + tp_distance if trade_type == mt5.ORDER_TYPE_BUY else opening_price - tp_distance
-    sl = opening_price - sl_distance if trade_type == mt5.ORDER_TYPE_BUY else opening_price + sl_distance
+    # Offsets in whole points, converted back to a price only for the request
+    tp = scale.add(opening_price, tp_distance) if trade_type == mt5.ORDER_TYPE_BUY else scale.add(opening_price, -tp_distance)
+    sl = scale.add(opening_price, -sl_distance) if trade_type == mt5.ORDER_TYPE_BUY else scale.add(opening_price, sl_distance)
     modify_request = {
         "action": mt5.TRADE_ACTION_SLTP,
         "symbol": symbol,
         "position": position_id,
+        "magic": magic,
         "tp": tp,
         "sl": sl,
     }
-    modify_result = mt5.order_send(modify_request)
-    if modify_result.retcode != mt5.TRADE_RETCODE_DONE:
-        print(f"[{symbol}] Failed to set TP/SL: retcode={modify_result.retcode}")
+    # The position is open at this point, so protecting it gets a fresh budget
+    modify_result, modify_attempts = execution.send_order(modify_request, execution.deadline_in())
+    if modify_result is None:
+        print(f"[{symbol}] Failed to set TP/SL: retcode={modify_attempts[-1]['retcode']}")
     else:
         print(f"[{symbol}] Trade opened: price={opening_price}, tp={tp}, sl={sl}, magic={magic}")
     return result
 
 # Function to place pending counter order
-def place_pending_order(symbol, order_type, volume, price, tp,sl_counter, magic):
+def place_pending_order(symbol, order_type, volume, price, tp, sl_counter, magic, deadline=None, reprice=None):
     print(f"[{symbol}] Placing pending order: type={order_type}, volume={volume}, price={price}, tp={tp}, magic={magic}")
     request = {
         "action": mt5.TRADE_ACTION_PENDING,
@@ -112,18 +121,40 @@ def place_pending_order(symbol, order_type, volume, price, tp,sl_counter, magic)
         "type": order_type,
         "price": price,
         "tp": tp,
-        "sl" : sl_counter,
+        "sl": sl_counter,
         "deviation": 10,
         "magic": magic,
         "comment": "Counter trade",
         "type_time": mt5.ORDER_TIME_GTC,
         "type_filling": mt5.ORDER_FILLING_RETURN,
     }
-    result = mt5.order_send(request)
-    if result.retcode != mt5.TRADE_RETCODE_DONE:
-        print(f"[{symbol}] Failed to place pending order: retcode={result.retcode}, comment={result.comment}")
+    result, attempts = execution.send_order(request, deadline, reprice=reprice)
+    if result is None:
+        print(f"[{symbol}] Failed to place pending order after {len(attempts)} attempt(s): retcode={attempts[-1]['retcode']}, comment={attempts[-1]['comment']}")
     else:
-        print(f"[{symbol}] Pending order placed successfully: price={price}, magic={magic}")
+        print(f"[{symbol}] Pending order placed successfully: price={request['price']}, magic={magic}")
+    return result
+
+# Function to send one strategy intent: the main market order, then its
+# counter stop order on the opposite side of the signal tick
+def execute_intent(symbol, intent, tick, magic, scale):
+    if intent["side"] == "buy":
+        trade_type, counter_type, price, sign = mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL_STOP, tick.ask, -1
+    else:
+        trade_type, counter_type, price, sign = mt5.ORDER_TYPE_SELL, mt5.ORDER_TYPE_BUY_STOP, tick.bid, 1
+    print(f"[{symbol}] {intent['strategy']}: {intent['side']} signal, magic={magic}")
+    result = open_trade(symbol, trade_type, intent["volume"], intent["tp"], intent["sl"], magic, scale=scale)
+    counter = intent["counter"]
+    if counter is None:
+        return result
+    if result is None:
+        if counter["requires_main"]:
+            return result
+        print(f"[{symbol}] Main trade failed, proceeding to counter trade")
+    counter_price = scale.add(price, sign * counter["distance"])
+    counter_tp = scale.add(counter_price, sign * counter["tp"])
+    sl_counter = scale.add(price, -sign * counter["sl"])
+    place_pending_order(symbol, counter_type, counter["volume"], counter_price, counter_tp, sl_counter, magic)
     return result
 
 # Function to check and reconnect MT5 if necessary
@@ -173,18 +204,13 @@ if __name__ == "__main__":
     all_magic = [pos.magic for pos in positions] + [order.magic for order in orders]
     magic_counter = max(all_magic) + 1 if all_magic else 100000
     print(f"Magic counter set to: {magic_counter}")
-    start_str = config["trading"]["start_time"]
-    end_str = config["trading"]["end_time"]
-    TRADING_START_TIME = datetime.strptime(start_str, "%H:%M").time()
-    TRADING_END_TIME = datetime.strptime(end_str, "%H:%M").time()
+    calendar = None
+    # Follow the broker's clock for bar boundaries once enough ticks were seen
+    clock_sync = (config or {}).get("trading", {}).get("clock_sync", {})
+    if clock_sync is not False:
+        clock.enable_sync(**(clock_sync if isinstance(clock_sync, dict) else {}))
 
     while True:
-        current_utc_time = datetime.now().time()
-        print(current_utc_time)
-        if not (TRADING_START_TIME <= current_utc_time <= TRADING_END_TIME):
-            print(f"Outside of trading hours: {current_utc_time}. Waiting 60 seconds.")
-            time.sleep(60)
-            continue
         # Check MT5 connection
         print("Starting new iteration of main loop")
         if not check_mt5_connection():
@@ -193,26 +219,62 @@ if __name__ == "__main__":
             continue
         
 
-        # Wait for the next 15-minute interval, checking pending orders periodically
-        next_run_time = get_next_run_time()
-        print(f"Current time: {datetime.now(timezone.utc)}, Waiting for next run time: {next_run_time}")
-        while datetime.now(timezone.utc) < next_run_time:
+        if config is None:
+            print("Configuration file is missing or invalid. Please check configdemo.json.")
+            time.sleep(60)
+            config = read_config()
+            continue
+
+        # Sleep straight to the next tradable 15-minute boundary. Trading hours
+        # here are in the machine's local time unless "timezone" is set.
+        trading = dict(config["trading"])
+        trading.setdefault("timezone", "local")
+        calendar = sessions.get_calendar(calendar, trading, clock.now())
+        next_run_time = calendar.next_boundary(clock.now(), 15)
+        if next_run_time is None:
+            print("No tradable session in the coming week, check start_time, end_time and trading_days")
+            time.sleep(3600)
+            continue
+        throttle.configure(trading.get("order_throttle"))
+        print(f"Current time: {clock.now()}, Waiting for next run time: {next_run_time}")
+        while clock.now() < next_run_time:
+            # Keep the server clock estimate fresh while waiting
+            for symbol in trading["symbols"][:3]:
+                clock.observe_tick(symbol, mt5.symbol_info_tick(symbol))
             positions = mt5.positions_get() or []
             position_magics = set(pos.magic for pos in positions)
             orders = mt5.orders_get() or []
             for order in orders:
                 if order.magic not in position_magics:
+                    throttle.acquire(order.symbol, throttle.HOUSEKEEPING)
                     print(f"Pending order {order.ticket} (magic={order.magic}) has no matching position, canceling")
                     request = {
                         "action": mt5.TRADE_ACTION_REMOVE,
                         "order": order.ticket
                     }
-                    result = mt5.order_send(request)
+                    with tracing.span("cancel", order.symbol, order.magic) as span:
+                        result = mt5.order_send(request)
+                        span["retcode"] = result.retcode if result is not None else None
+                        span["price"] = order.price_open
+                    throttle.feedback(result)
+                    if result is None:
+                        # Terminal unreachable: the rest would fail too, the next pass retries them
+                        print(f"Failed to cancel pending order {order.ticket}: {mt5.last_error()}")
+                        break
                     if result.retcode == mt5.TRADE_RETCODE_DONE:
                         print(f"Canceled pending order {order.ticket} for magic {order.magic}")
                     else:
                         print(f"Failed to cancel pending order {order.ticket}: {result.comment}")
-            time.sleep(10)
+            tracing.flush()
+            remaining = (next_run_time - clock.now()).total_seconds()
+            interval = clock.sample_interval()
+            if not orders and interval is None:
+                # No pending counters left to orphan, nothing to do until the boundary
+                time.sleep(max(0, remaining))
+                break
+            # Without orders, still wake once per clock bucket: a single sample
+            # every 15 minutes never gives the server clock the two it needs
+            time.sleep(max(0, min(10 if orders else interval, remaining)))
 
         # Load and display configuration
         config = read_config()
@@ -227,10 +289,6 @@ if __name__ == "__main__":
         # Extract config values
         print("Extracting configuration values")
         symbols = config["trading"]["symbols"]
-        min_candle_size_points = config["trading"]["min_candle_size_points"]
-        M = config["trading"]["M"]
-        trade_mode = config["trading"]["trade_mode"]
-        counter_trade_enabled = config["trading"]["counter_trade_enabled"]
 
         for symbol in symbols:
             print(f"Processing symbol: {symbol}")
@@ -266,13 +324,12 @@ if __name__ == "__main__":
             close_price = f"{candle_data['close']:.{digits}f}"
             print(f"[{symbol}] Previous candle: Open time={candle_data['open_time']}, Close time={candle_data['close_time']}, Open={open_price}, Close={close_price}")
 
-            # Check if candle is neutral
-            point = symbol_info.point
-            min_candle_size = min_candle_size_points * point
-            candle_size = abs(candle_data['close'] - candle_data['open'])
-            print(f"[{symbol}] Candle size: {candle_size}, Minimum required size: {min_candle_size}")
-            if candle_size < min_candle_size:
-                print(f"[{symbol}] Neutral candle, skipping trade")
+            # Evaluate every strategy configured for the symbol on the same bar.
+            # This script has always placed the counter whatever the trade_mode.
+            strategies_for_symbol = strategies.build_strategies(symbol, config["trading"], symbol_info.point, counter_requires_both=False)
+            intents = strategies.evaluate(strategies_for_symbol, [candle_data])
+            if not intents:
+                print(f"[{symbol}] No trade intents for this bar")
                 continue
 
             # Get current tick data
@@ -283,29 +340,7 @@ if __name__ == "__main__":
                 continue
             print(f"[{symbol}] Tick data: bid={tick.bid}, ask={tick.ask}")
 
-            magic = magic_counter
-            magic_counter += 1
-            if candle_data['close'] > candle_data['open'] and trade_mode in ["buy_only", "both"]:
-                trade_type = mt5.ORDER_TYPE_BUY
-                result = open_trade(symbol, trade_type, volume, D_tp, D_sl, magic)
-                if result is None:  # Check if trade failed
-                    print(f"[{symbol}] Main trade failed, proceeding to counter trade if enabled")
-                if counter_trade_enabled:
-                    price = tick.ask
-                    counter_price = price - D_counter
-                    counter_tp = counter_price - D_tp_counter
-                    sl_counter = price + sl_counter
-                    place_pending_order(symbol, mt5.ORDER_TYPE_SELL_STOP, volume * M, counter_price, counter_tp,sl_counter, magic)
-            elif candle_data['close'] < candle_data['open'] and trade_mode in ["sell_only", "both"]:
-                trade_type = mt5.ORDER_TYPE_SELL
-                price = tick.bid
-                result = open_trade(symbol, trade_type, volume, D_tp, D_sl, magic)
-                if result.retcode != mt5.TRADE_RETCODE_DONE:
-                    continue
-                if counter_trade_enabled:
-                    counter_price = price + D_counter
-                    counter_tp = counter_price + D_tp_counter
-                    sl_counter = price - sl_counter
-                    place_pending_order(symbol, mt5.ORDER_TYPE_BUY_STOP, volume * M, counter_price, counter_tp,sl_counter, magic)
-            else:
-                print(f"[{symbol}] Candle has no direction (close == open), skipping trade or doesn't match trade mode")
\ No newline at end of file
+            for intent in intents:
+                magic = magic_counter
+                magic_counter += 1
+                execute_intent(symbol, intent, tick, magic, prices.scale_for(symbol_info))
@@ -5,6 +5,8 @@ import os
 from datetime import datetime, timedelta, timezone
 from filelock import FileLock
 
+import strategies
+
 # Function to read configuration with file locking
 def read_config():
     print("Attempting to read config.json")
@@ -126,6 +128,28 @@ def place_pending_order(symbol, order_type, volume, price, tp,sl_counter, magic)
         print(f"[{symbol}] Pending order placed successfully: price={price}, magic={magic}")
     return result
 
+# Function to send one strategy intent: the main market order, then its
+# counter stop order on the opposite side of the signal tick
+def execute_intent(symbol, intent, tick, magic):
+    if intent["side"] == "buy":
+        trade_type, counter_type, price, sign = mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL_STOP, tick.ask, -1
+    else:
+        trade_type, counter_type, price, sign = mt5.ORDER_TYPE_SELL, mt5.ORDER_TYPE_BUY_STOP, tick.bid, 1
+    print(f"[{symbol}] {intent['strategy']}: {intent['side']} signal, magic={magic}")
+    result = open_trade(symbol, trade_type, intent["volume"], intent["tp"], intent["sl"], magic)
+    counter = intent["counter"]
+    if counter is None:
+        return result
+    if result is None:
+        if counter["requires_main"]:
+            return result
+        print(f"[{symbol}] Main trade failed, proceeding to counter trade")
+    counter_price = price + sign * counter["distance"]
+    counter_tp = counter_price + sign * counter["tp"]
+    sl_counter = price - sign * counter["sl"]
+    place_pending_order(symbol, counter_type, counter["volume"], counter_price, counter_tp, sl_counter, magic)
+    return result
+
 # Function to check and reconnect MT5 if necessary
 def check_mt5_connection():
     print("Checking MT5 connection")
@@ -215,23 +239,16 @@ if __name__ == "__main__":
         # Extract config values
         print("Extracting configuration values")
         symbols = config["trading"]["symbols"]
-        min_candle_size_points = config["trading"]["min_candle_size_points"]
-        M = config["trading"]["M"]
-        counter_trade_enabled = config["trading"]["counter_trade_enabled"]
+        # This script has always traded both directions and placed the
+        # counter whatever the trade_mode
+        trading = dict(config["trading"])
+        trading["trade_mode"] = "both"
 
         for symbol in symbols:
             print(f"Processing symbol: {symbol}")
-            if symbol not in config["trading"]["settings"]:
+            if symbol not in trading["settings"]:
                 print(f"[{symbol}] Settings not found in config, skipping")
                 continue
-            settings = config["trading"]["settings"][symbol]
-            volume = settings["volume"]
-            D_tp = settings["tp"]
-            D_sl = settings["sl"]
-            D_counter = settings["counter"]
-            D_tp_counter = settings["tp_counter"]
-            sl_counter = settings["sl_counter"]
-            print(f"[{symbol}] Using volume: {volume}, D_tp: {D_tp}, D_sl: {D_sl}, D_counter: {D_counter}, D_tp_counter: {D_tp_counter}")
 
             # Get candle data
             candle_data = get_previous_candle(symbol, next_run_time)
@@ -253,13 +270,11 @@ if __name__ == "__main__":
             close_price = f"{candle_data['close']:.{digits}f}"
             print(f"[{symbol}] Previous candle: Open time={candle_data['open_time']}, Close time={candle_data['close_time']}, Open={open_price}, Close={close_price}")
 
-            # Check if candle is neutral
-            point = symbol_info.point
-            min_candle_size = min_candle_size_points * point
-            candle_size = abs(candle_data['close'] - candle_data['open'])
-            print(f"[{symbol}] Candle size: {candle_size}, Minimum required size: {min_candle_size}")
-            if candle_size < min_candle_size:
-                print(f"[{symbol}] Neutral candle, skipping trade")
+            # Evaluate every strategy configured for the symbol on the same bar
+            strategies_for_symbol = strategies.build_strategies(symbol, trading, symbol_info.point, counter_requires_both=False)
+            intents = strategies.evaluate(strategies_for_symbol, [candle_data])
+            if not intents:
+                print(f"[{symbol}] No trade intents for this bar")
                 continue
 
             # Get current tick data
@@ -270,29 +285,7 @@ if __name__ == "__main__":
                 continue
             print(f"[{symbol}] Tick data: bid={tick.bid}, ask={tick.ask}")
 
-            magic = magic_counter
-            magic_counter += 1
-            if candle_data['close'] > candle_data['open']:
-                trade_type = mt5.ORDER_TYPE_BUY
-                result = open_trade(symbol, trade_type, volume, D_tp, D_sl, magic)
-                if result is None:  # Check if trade failed
-                    print(f"[{symbol}] Main trade failed, proceeding to counter trade if enabled")
-                if counter_trade_enabled:
-                    price = tick.ask
-                    counter_price = price - D_counter
-                    counter_tp = counter_price - D_tp_counter
-                    sl_counter = price + sl_counter
-                    place_pending_order(symbol, mt5.ORDER_TYPE_SELL_STOP, volume * M, counter_price, counter_tp,sl_counter, magic)
-            elif candle_data['close'] < candle_data['open']:
-                trade_type = mt5.ORDER_TYPE_SELL
-                price = tick.bid
-                result = open_trade(symbol, trade_type, volume, D_tp, D_sl, magic)
-                if result.retcode != mt5.TRADE_RETCODE_DONE:
-                    continue
-                if counter_trade_enabled:
-                    counter_price = price + D_counter
-                    counter_tp = counter_price + D_tp_counter
-                    sl_counter = price - sl_counter
-                    place_pending_order(symbol, mt5.ORDER_TYPE_BUY_STOP, volume * M, counter_price, counter_tp,sl_counter, magic)
-            else:
-                print(f"[{symbol}] Candle has no direction (close == open), skipping trade")
\ No newline at end of file
+            for intent in intents:
+                magic = magic_counter
+                magic_counter += 1
+                execute_intent(symbol, intent, tick, magic)
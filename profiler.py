@@ -0,0 +1,121 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import metrics
+
+# Opt-in profiling of bar cycles. Enabled with a top-level "profiling" key:
+#
+#     "profiling": {"mode": "sample", "threshold_ms": 2000, "interval_ms": 5, "dir": "profiles"}
+#
+# mode "sample" runs a stack sampler thread during every cycle and, when the
+# cycle takes longer than threshold_ms, writes the samples as collapsed
+# stacks (one "frame;frame;frame count" line per stack) that flamegraph.pl or
+# speedscope read directly. mode "auto" does the same and also runs the next
+# cycle under cProfile, saving a .pstats file if that one is slow too.
+# mode "cprofile" runs every cycle under cProfile. Files are named after the
+# bar time, the cycle duration and the symbols.
+
+MODES = ("sample", "auto", "cprofile")
+
+# Background thread that samples one thread's Python stack at a fixed interval
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name="cycle-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self._names = {}
+
+    def _frame_name(self, code):
+        name = self._names.get(code)
+        if name is None:
+            name = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            self._names[code] = name
+        return name
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.samples
+
+class CycleProfiler:
+    def __init__(self):
+        self.settings = None
+        self.cprofile_next = False
+
+    # Function to apply the "profiling" config section (None disables profiling)
+    def configure(self, settings):
+        if settings and settings.get("mode", "sample") not in MODES:
+            print(f"Invalid profiling mode: {settings['mode']}. Must be one of {list(MODES)}, profiling disabled")
+            settings = None
+        self.settings = settings
+
+    # Function to profile one cycle; use as `with profiler.cycle(bar_time, symbols):`
+    @contextmanager
+    def cycle(self, bar_time, symbols):
+        settings = self.settings
+        if not settings:
+            yield
+            return
+        mode = settings.get("mode", "sample")
+        threshold_ms = settings.get("threshold_ms", 2000)
+        use_cprofile = mode == "cprofile" or (mode == "auto" and self.cprofile_next)
+        sampler = None
+        profile = None
+        if use_cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            sampler = StackSampler(threading.get_ident(), settings.get("interval_ms", 5) / 1000)
+            sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if profile is not None:
+                profile.disable()
+            samples = sampler.stop() if sampler is not None else None
+            metrics.set_gauge("cycle_ms", elapsed_ms)
+            slow = elapsed_ms > threshold_ms
+            if slow:
+                metrics.inc("slow_cycles")
+                path = self._path(settings, bar_time, elapsed_ms, symbols)
+                if profile is not None:
+                    profile.dump_stats(path + ".pstats")
+                    print(f"Slow cycle ({elapsed_ms:.0f}ms), cProfile stats written to {path}.pstats")
+                else:
+                    self._write_collapsed(path + ".folded", samples)
+                    print(f"Slow cycle ({elapsed_ms:.0f}ms), {sum(samples.values())} stack samples written to {path}.folded")
+            self.cprofile_next = mode == "auto" and slow and not use_cprofile
+
+    def _path(self, settings, bar_time, elapsed_ms, symbols):
+        directory = settings.get("dir", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        tag = "-".join(symbols)[:100]
+        return os.path.join(directory, f"cycle-{bar_time:%Y%m%dT%H%M%S}-{elapsed_ms:.0f}ms-{tag}")
+
+    def _write_collapsed(self, path, samples):
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+_profiler = CycleProfiler()
+configure = _profiler.configure
+cycle = _profiler.cycle
@@ -0,0 +1,278 @@
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import clock
+
+# Record-and-replay of MT5 API traffic.
+#
+#     MT5_RECORD=day.mt5rec python test.py                    # record a live session
+#     MT5_REPLAY=day.mt5rec MT5_REPLAY_SPEED=10 python test.py  # replay it 10x faster
+#     MT5_REPLAY=day.mt5rec MT5_REPLAY_SPEED=0 python test.py   # replay as fast as possible
+#     python recorder.py day.mt5rec                            # per-call latency summary
+#
+# The log is a header followed by one record per call: a fixed struct
+# (call id, wall time, latency) and a pickled (args, kwargs, result, last_error)
+# payload. Results are stored without MetaTrader5 types, so a log recorded on
+# the VPS replays on any machine. Only replay logs you recorded yourself.
+# The arguments of initialize and login (path, account, password) are never
+# written. A replay runs in a scratch directory (MT5_REPLAY_DIR, or a new
+# temporary one) holding a copy of m.json, so the warm-start image, metrics
+# and logs it writes don't overwrite the live ones.
+
+MAGIC = b"MT5R"
+VERSION = 1
+HEADER = struct.Struct("<4sBI")
+RECORD = struct.Struct("<BdfI")
+
+RECORDED_CALLS = [
+    "initialize", "login", "shutdown", "terminal_info", "account_info",
+    "symbol_select", "symbol_info", "symbol_info_tick", "symbols_get", "symbols_total",
+    "copy_rates_from", "copy_rates_from_pos", "copy_rates_range",
+    "copy_ticks_from", "copy_ticks_range",
+    "positions_get", "positions_total", "orders_get", "orders_total",
+    "order_check", "order_send", "history_deals_get"
+]
+CALL_IDS = {name: i for i, name in enumerate(RECORDED_CALLS)}
+# Calls whose arguments hold credentials: recorded and replayed without them
+REDACTED_CALLS = {"initialize", "login"}
+CONFIG_FILES = ["m.json"]
+
+# Portable stand-in for the namedtuple types MetaTrader5 returns
+Packed = namedtuple("Packed", ["typename", "fields", "values"])
+
+# Function to convert MT5 results into plain picklable structures
+def pack(value):
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return Packed(type(value).__name__, tuple(value._fields), tuple(pack(v) for v in value))
+    if isinstance(value, (tuple, list)):
+        return type(value)(pack(v) for v in value)
+    if isinstance(value, dict):
+        return {k: pack(v) for k, v in value.items()}
+    return value
+
+_types = {}
+
+# Function to rebuild namedtuples from their packed form
+def unpack(value):
+    if isinstance(value, Packed):
+        key = (value.typename, value.fields)
+        if key not in _types:
+            _types[key] = namedtuple(value.typename, value.fields)
+        return _types[key](*(unpack(v) for v in value.values))
+    if isinstance(value, (tuple, list)):
+        return type(value)(unpack(v) for v in value)
+    if isinstance(value, dict):
+        return {k: unpack(v) for k, v in value.items()}
+    return value
+
+# Function to read all records from a log: returns (constants, records)
+def read_log(path):
+    with open(path, 'rb') as f:
+        magic, version, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an MT5 recording (version {VERSION})")
+        constants = pickle.loads(f.read(length))
+        records = []
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            call_id, wall_time, latency_ms, length = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                # Torn final record from a crash, everything before it is usable
+                break
+            records.append((RECORDED_CALLS[call_id], wall_time, latency_ms, payload))
+    return constants, records
+
+# Wraps the real MetaTrader5 module and logs every recorded call
+class RecordingMT5:
+    def __init__(self, mt5, path):
+        self._mt5 = mt5
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab' if os.path.exists(path) and os.path.getsize(path) else 'wb')
+        if self._file.tell() == 0:
+            constants = {name: getattr(mt5, name) for name in dir(mt5)
+                         if name.isupper() and isinstance(getattr(mt5, name), (int, float, str))}
+            blob = pickle.dumps(constants, protocol=pickle.HIGHEST_PROTOCOL)
+            self._file.write(HEADER.pack(MAGIC, VERSION, len(blob)) + blob)
+            self._file.flush()
+        print(f"Recording MT5 API traffic to {path}")
+
+    def __getattr__(self, name):
+        attr = getattr(self._mt5, name)
+        if name not in CALL_IDS:
+            return attr
+        call_id = CALL_IDS[name]
+        redacted = name in REDACTED_CALLS
+
+        def recorded(*args, **kwargs):
+            wall_time = time.time()
+            start = time.perf_counter()
+            result = attr(*args, **kwargs)
+            latency_ms = (time.perf_counter() - start) * 1000
+            error = self._mt5.last_error()
+            if redacted:
+                args, kwargs = (), {}
+            payload = pickle.dumps((pack(args), pack(kwargs), pack(result), error), protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                self._file.write(RECORD.pack(call_id, wall_time, latency_ms, len(payload)) + payload)
+                self._file.flush()
+            return result
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, recorded)
+        return recorded
+
+# Serves a recorded session back to unchanged code, one queue per API call
+class ReplayMT5:
+    def __init__(self, path, speed=1.0):
+        constants, records = read_log(path)
+        self.__dict__.update(constants)
+        self._queues = defaultdict(list)
+        for record in records:
+            self._queues[record[0]].append(record)
+        for queue in self._queues.values():
+            queue.reverse()
+        self._lock = threading.Lock()
+        self._last_error = (1, "Success")
+        self.mismatches = 0
+        start = records[0][1] if records else time.time()
+        self.clock = clock.VirtualClock(start, speed)
+        clock.install(self.clock)
+        print(f"Replaying {len(records)} MT5 calls from {path} at speed {speed or 'max'}")
+
+    def last_error(self):
+        return self._last_error
+
+    def __getattr__(self, name):
+        if name not in CALL_IDS:
+            raise AttributeError(f"MT5 replay has no attribute {name}")
+        redacted = name in REDACTED_CALLS
+
+        def replayed(*args, **kwargs):
+            with self._lock:
+                queue = self._queues.get(name)
+                if not queue:
+                    raise EOFError(f"MT5 replay exhausted: no more recorded {name} calls")
+                _, wall_time, latency_ms, payload = queue.pop()
+            rec_args, rec_kwargs, result, error = pickle.loads(payload)
+            if not redacted and (pack(args) != rec_args or pack(kwargs) != rec_kwargs):
+                self.mismatches += 1
+                if self.mismatches <= 10:
+                    print(f"Replay mismatch in {name}: called with {args} {kwargs}, recorded {rec_args} {rec_kwargs}")
+            # Reproduce when the call was made and how long the terminal took
+            self.clock.advance_to(wall_time)
+            self.clock.sleep(latency_ms / 1000)
+            self._last_error = error
+            return unpack(result)
+        setattr(self, name, replayed)
+        return replayed
+
+# Wraps the terminal module so only one thread talks to it at a time. The
+# MetaTrader5 module is not thread-safe, and the main loop, the supervisor,
+# the warm-start validation and the gateway worker all use it. last_error()
+# answers for the calling thread's own last call; the terminal is only asked
+# for it when a call returns None or False. Hold `lock` to make a sequence of
+# calls (a reconnect) atomic.
+SUCCESS = (1, "Success")
+
+class SerializedMT5:
+    def __init__(self, mt5):
+        self._mt5 = mt5
+        self.lock = threading.RLock()
+        self._errors = threading.local()
+
+    def __dir__(self):
+        return dir(self._mt5)
+
+    def last_error(self):
+        error = getattr(self._errors, "value", None)
+        if error is None:
+            with self.lock:
+                error = self._mt5.last_error()
+        return error
+
+    def __getattr__(self, name):
+        attr = getattr(self._mt5, name)
+        if not callable(attr):
+            setattr(self, name, attr)
+            return attr
+
+        lock = self.lock
+        errors = self._errors
+        last_error = self._mt5.last_error
+
+        def serialized(*args, **kwargs):
+            with lock:
+                result = attr(*args, **kwargs)
+                errors.value = last_error() if result is None or result is False else SUCCESS
+            return result
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, serialized)
+        return serialized
+
+# Function to put the installed MetaTrader5 (real, recording, replay or
+# gateway client) behind one lock. Must run before anything imports it.
+def install_serialized():
+    mt5 = sys.modules.get("MetaTrader5")
+    if mt5 is None:
+        import MetaTrader5 as mt5
+    if not isinstance(mt5, SerializedMT5):
+        sys.modules["MetaTrader5"] = SerializedMT5(mt5)
+
+# Function to move into a scratch directory for a replay, taking the config
+# along, so files the loop writes to the working directory stay out of it
+def enter_scratch_dir(path=None):
+    source_dir = os.getcwd()
+    if path:
+        os.makedirs(path, exist_ok=True)
+    else:
+        path = tempfile.mkdtemp(prefix="mt5replay")
+    for name in CONFIG_FILES:
+        if os.path.exists(os.path.join(source_dir, name)):
+            shutil.copy(os.path.join(source_dir, name), path)
+    os.chdir(path)
+    print(f"Replay writes its files to {path}")
+
+# Function to swap MetaTrader5 for a recorder, a replay or a gateway client
+# based on environment variables, behind the terminal lock. Must run before
+# anything imports MetaTrader5.
+def install_from_env():
+    replay_path = os.environ.get("MT5_REPLAY")
+    record_path = os.environ.get("MT5_RECORD")
+    gateway_address = os.environ.get("MT5_GATEWAY")
+    if gateway_address:
+        import gateway
+        host, _, port = gateway_address.rpartition(":")
+        sys.modules["MetaTrader5"] = gateway.GatewayClient(host or "127.0.0.1", int(port))
+    elif replay_path:
+        speed = float(os.environ.get("MT5_REPLAY_SPEED", "1"))
+        sys.modules["MetaTrader5"] = ReplayMT5(replay_path, speed)
+        enter_scratch_dir(os.environ.get("MT5_REPLAY_DIR"))
+    elif record_path:
+        import MetaTrader5
+        sys.modules["MetaTrader5"] = RecordingMT5(MetaTrader5, record_path)
+    install_serialized()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python recorder.py <recording>")
+        sys.exit(1)
+    _, records = read_log(sys.argv[1])
+    stats = defaultdict(list)
+    for name, _, latency_ms, _ in records:
+        stats[name].append(latency_ms)
+    if records:
+        print(f"{len(records)} calls over {records[-1][1] - records[0][1]:.1f}s")
+    print(f"{'call':<22}{'count':>8}{'mean ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, latencies in sorted(stats.items(), key=lambda item: -sum(item[1])):
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name:<22}{len(latencies):>8}{sum(latencies) / len(latencies):>10.2f}{p99:>10.2f}{latencies[-1]:>10.2f}")
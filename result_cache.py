@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Content-addressed disk cache for backtest results. An entry's key is a hash
+# of everything the result depends on: the data (array bytes or file
+# contents), the code version and the settings, normalized so key order and
+# 5 vs 5.0 don't matter. Entries are .npz files under <root>/<namespace>/;
+# a hit refreshes the file's mtime, and when the cache grows past max_bytes
+# the least recently used files are deleted. Several processes can share a
+# cache directory: writes are atomic and eviction tolerates files vanishing.
+#
+#     cache = ResultCache()
+#     key = cache.key(data_hash, version, settings)
+#     out = cache.memoize("outcomes", key, lambda: {"outcomes": simulate(...)})["outcomes"]
+
+CACHE_DIR = ".backtest_cache"
+DEFAULT_MAX_BYTES = 1 << 30
+FILE_HASHES = "files.json"
+
+# Function to make settings hash the same however they were written
+def normalize(value):
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    raise TypeError(f"Cannot use {type(value).__name__} in a cache key")
+
+# Function to hash numpy arrays by dtype, shape and contents
+def hash_arrays(*arrays):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype.descr).encode())
+        digest.update(str(array.shape).encode())
+        digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+def hash_file(path, block=1 << 24):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    # Function to build a key from any JSON-like parts
+    def key(self, *parts):
+        text = json.dumps(normalize(list(parts)), sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def _path(self, namespace, key):
+        return os.path.join(self.root, namespace, key + ".npz")
+
+    # Function to hash a data file, reusing the last hash while its size and
+    # mtime are unchanged
+    def file_hash(self, path):
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        index_path = os.path.join(self.root, FILE_HASHES)
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        entry = index.get(os.path.abspath(path))
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["hash"]
+        digest = hash_file(path)
+        index[os.path.abspath(path)] = {"stamp": stamp, "hash": digest}
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = index_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+        return digest
+
+    # Function to load a cached entry as a dict of arrays, or None
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def put(self, namespace, key, arrays):
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    # Function to return the cached entry, computing and storing it on a miss.
+    # compute() returns a dict of arrays.
+    def memoize(self, namespace, key, compute):
+        arrays = self.get(namespace, key)
+        if arrays is None:
+            arrays = compute()
+            self.put(namespace, key, arrays)
+        return arrays
+
+    # Function to delete least recently used entries until under max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded key/value store with a fixed time-to-live, used for per-chat
+# conversation state in the Telegram controller. Entries are kept in
+# last-touched order, so expired ones are always at the front and expiring
+# costs O(1) per evicted entry. When full, the least recently touched entry
+# is evicted. With a path, the store is saved on every change and reloaded on
+# start so a restart doesn't drop in-flight edits.
+class SessionStore:
+    def __init__(self, ttl=900, max_size=1000, path=None, on_expire=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.on_expire = on_expire
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        if path:
+            self._load()
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._evict()
+            self._save()
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            self.expire()
+            return len(self._entries)
+
+    # Function to get a live entry and push back its expiry, or default
+    def get(self, key, default=None):
+        with self._lock:
+            self.expire()
+            if key not in self._entries:
+                return default
+            _, value = self._entries.pop(key)
+            self._entries[key] = (time.time() + self.ttl, value)
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._save()
+            return entry[1]
+
+    # Function to drop every expired entry from the front of the order
+    def expire(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            while self._entries:
+                key, (expires, _) = next(iter(self._entries.items()))
+                if expires > now:
+                    break
+                self._entries.popitem(last=False)
+                expired.append(key)
+            if expired:
+                self._save()
+        for key in expired:
+            self._notify(key)
+        return expired
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            key, _ = self._entries.popitem(last=False)
+            self._notify(key)
+
+    def _notify(self, key):
+        if self.on_expire is not None:
+            try:
+                self.on_expire(key)
+            except Exception as e:
+                print(f"Session expiry callback failed for {key}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        entries = [[key, expires, value] for key, (expires, value) in self._entries.items()]
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Failed to save sessions to {self.path}: {e}")
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable session file {self.path}: {e}")
+            return
+        now = time.time()
+        for key, expires, value in sorted(entries, key=lambda entry: entry[1]):
+            if expires > now:
+                self._entries[key] = (expires, value)
+        self._evict()
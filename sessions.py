@@ -0,0 +1,136 @@
+import bisect
+import json
+from datetime import datetime, timedelta, timezone
+
+# Precomputed trading calendar. It combines the configured trading hours
+# (start_time/end_time in the configured timezone, windows may cross
+# midnight), the trading days and optional per-symbol broker sessions, so the
+# scheduler can sleep straight to the next bar boundary at which anything is
+# tradable instead of waking up to re-check the clock.
+#
+# Config keys under "trading":
+#   "timezone": "UTC" (default), "local", "+05:00" or an IANA name like "Asia/Tashkent"
+#   "trading_days": ["Mon", "Tue", "Wed", "Thu", "Fri"] (default: every day,
+#   so configs written before this key trade as they did)
+#   "broker_timezone": timezone of broker session times (default "UTC")
+#   "settings": {"XAUUSD": {"sessions": {"Mon": ["01:05-23:55"], ...}}}
+# The MT5 Python API doesn't expose symbol sessions, so those come from config;
+# symbols without "sessions" are treated as open whenever the window is.
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DEFAULT_TRADING_DAYS = list(DAY_NAMES)
+HORIZON_DAYS = 8
+
+# Function to turn a timezone setting into a tzinfo
+def parse_timezone(value):
+    if value in (None, "", "UTC", "utc"):
+        return timezone.utc
+    if value == "local":
+        return datetime.now().astimezone().tzinfo
+    if value[0] in "+-":
+        sign = 1 if value[0] == "+" else -1
+        hours, _, minutes = value[1:].partition(":")
+        return timezone(sign * timedelta(hours=int(hours), minutes=int(minutes or 0)))
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(value)
+
+def _parse_hhmm(value):
+    hour, minute = map(int, value.split(":"))
+    return hour * 60 + minute
+
+# Function to merge overlapping [start, end] intervals
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+# Function to intersect two sorted lists of disjoint intervals
+def _intersect(a, b):
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start <= end:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+# Function to expand daily HH:MM windows into UTC timestamp intervals
+def _daily_windows(windows_by_day, tz, first_day, days):
+    intervals = []
+    for offset in range(-1, days + 1):
+        day = first_day + timedelta(days=offset)
+        for window in windows_by_day.get(DAY_NAMES[day.weekday()], []):
+            start_str, end_str = window.split("-")
+            start_min, end_min = _parse_hhmm(start_str), _parse_hhmm(end_str)
+            start = datetime(day.year, day.month, day.day, tzinfo=tz) + timedelta(minutes=start_min)
+            # A window whose end is before its start runs past midnight
+            end_day = day + timedelta(days=1) if end_min < start_min else day
+            end = datetime(end_day.year, end_day.month, end_day.day, tzinfo=tz) + timedelta(minutes=end_min)
+            intervals.append((start.timestamp(), end.timestamp()))
+    return _merge(intervals)
+
+class SessionCalendar:
+    def __init__(self, trading, start=None, days=HORIZON_DAYS):
+        self.key = calendar_key(trading)
+        start = start if start is not None else datetime.now(timezone.utc)
+        tz = parse_timezone(trading.get("timezone"))
+        broker_tz = parse_timezone(trading.get("broker_timezone"))
+        local_day = start.astimezone(tz).date()
+        window = f"{trading['start_time']}-{trading['end_time']}"
+        trading_days = trading.get("trading_days", DEFAULT_TRADING_DAYS)
+        self.hours = _daily_windows({day: [window] for day in trading_days}, tz, local_day, days)
+        self.valid_until = start.timestamp() + (days - 1) * 86400
+        self.symbols = {}
+        for symbol in trading.get("symbols", []):
+            sessions = trading.get("settings", {}).get(symbol, {}).get("sessions")
+            if sessions:
+                broker_day = start.astimezone(broker_tz).date()
+                self.symbols[symbol] = _intersect(self.hours, _daily_windows(sessions, broker_tz, broker_day, days))
+            else:
+                self.symbols[symbol] = self.hours
+        self.any_open = _merge([i for intervals in self.symbols.values() for i in intervals]) if self.symbols else self.hours
+        self._starts = [start for start, _ in self.any_open]
+
+    # Function to check whether a symbol (or anything, if None) is tradable at t
+    def is_open(self, t, symbol=None):
+        intervals = self.any_open if symbol is None else self.symbols.get(symbol, self.hours)
+        ts = t.timestamp()
+        i = bisect.bisect_right(intervals, (ts, float("inf"))) - 1
+        return i >= 0 and intervals[i][0] <= ts <= intervals[i][1]
+
+    # Function to get the first bar boundary strictly after `after` at which
+    # at least one symbol is tradable, or None beyond the calendar horizon
+    def next_boundary(self, after, duration_minutes):
+        step = duration_minutes * 60
+        ts = after.timestamp()
+        candidate = (int(ts) // step + 1) * step
+        i = max(0, bisect.bisect_right(self._starts, candidate) - 1)
+        for start, end in self.any_open[i:]:
+            if end < candidate:
+                continue
+            boundary = max(candidate, -(-int(start) // step) * step)
+            if boundary <= end:
+                return datetime.fromtimestamp(boundary, tz=timezone.utc)
+        return None
+
+# Function to fingerprint the config fields the calendar depends on
+def calendar_key(trading):
+    sessions = {s: trading.get("settings", {}).get(s, {}).get("sessions") for s in trading.get("symbols", [])}
+    return json.dumps([trading.get("start_time"), trading.get("end_time"), trading.get("timezone"),
+                       trading.get("trading_days", DEFAULT_TRADING_DAYS), trading.get("broker_timezone"),
+                       sessions], sort_keys=True)
+
+# Function to reuse a calendar while config is unchanged and within its horizon
+def get_calendar(calendar, trading, now):
+    if calendar is None or calendar.key != calendar_key(trading) or now.timestamp() >= calendar.valid_until:
+        calendar = SessionCalendar(trading, now)
+    return calendar
@@ -0,0 +1,119 @@
+import indicators
+import prices
+
+# Trading strategies. A strategy is built from one symbol's config and turns
+# the closed bars of a cycle into trade intents:
+#
+#     strategy.on_bar(bars) -> [intent, ...]
+#
+# bars is a sequence of closed bars, oldest first, each with open, close,
+# open_time and close_time, and the latest may carry "indicators" values
+# (see indicators.py). An intent is a dict
+#
+#     {"strategy", "side": "buy" | "sell", "volume", "tp", "sl", "counter"}
+#
+# with tp/sl as price distances from the fill, and "counter" either None or
+# {"volume", "distance", "tp", "sl", "requires_main"}: an opposite stop order
+# `distance` away from the signal tick, placed only after a successful main
+# trade when requires_main is set. By default a sell's counter requires the
+# main trade and a buy's doesn't; "counter_requires_main" makes it the same
+# for both.
+#
+# Several strategies or parameter variants can run per symbol by listing them
+# in the symbol's settings; they all see the same bars, fetched once:
+#
+#     "settings": {"XAUUSD": {..., "strategies": [{}, {"name": "wide", "min_candle_size_points": 300}]}}
+#
+# Each variant's keys override the symbol settings, which override "trading".
+
+# Previous candle direction: buy after a bullish candle, sell after a bearish
+# one, skip candles smaller than min_candle_size_points
+class CandleDirection:
+    history = 1
+
+    def __init__(self, params, point, counter_requires_both=True):
+        self.symbol = params["symbol"]
+        self.name = params["name"]
+        self.scale = prices.PriceScale(point)
+        self.min_candle_points = params["min_candle_size_points"]
+        self.volatility_filter = params.get("volatility_filter")
+        self.trade_mode = params["trade_mode"]
+        self.volume = params["volume"]
+        self.tp = params["tp"]
+        self.sl = params["sl"]
+        # The counter is placed when enabled and, unless counter_requires_both
+        # is False, only when both directions are allowed
+        self.counter_enabled = params["counter_trade_enabled"] and (
+            self.trade_mode == "both" or not counter_requires_both)
+        self.counter_volume = self.volume * params["M"]
+        self.counter = params["counter"]
+        self.tp_counter = params["tp_counter"]
+        self.sl_counter = params["sl_counter"]
+        self.counter_requires_main = params.get("counter_requires_main")
+
+    def on_bar(self, bars):
+        bar = bars[-1]
+        # Compare in whole points so a candle of exactly the minimum size counts
+        body = self.scale.points(bar["close"]) - self.scale.points(bar["open"])
+        # A volatility filter can only raise the fixed point threshold
+        min_candle_points = self.min_candle_points
+        threshold = indicators.filter_threshold(self.volatility_filter, bar.get("indicators", {}))
+        if threshold is not None:
+            min_candle_points = max(min_candle_points, self.scale.points(threshold))
+        if abs(body) < min_candle_points:
+            print(f"[{self.symbol}] {self.name}: Neutral candle: size {abs(body)} < {min_candle_points} points, no trade")
+            return []
+        if body > 0 and self.trade_mode in ("both", "buy_only"):
+            side = "buy"
+        elif body < 0 and self.trade_mode in ("both", "sell_only"):
+            side = "sell"
+        else:
+            print(f"[{self.symbol}] {self.name}: No direction or restricted by trade_mode")
+            return []
+        counter = None
+        if self.counter_enabled:
+            counter = {
+                "volume": self.counter_volume,
+                "distance": self.counter,
+                "tp": self.tp_counter,
+                "sl": self.sl_counter,
+                # A failed sell has never been countered, a failed buy always has
+                "requires_main": side == "sell" if self.counter_requires_main is None else self.counter_requires_main
+            }
+        return [{
+            "strategy": self.name,
+            "side": side,
+            "volume": self.volume,
+            "tp": self.tp,
+            "sl": self.sl,
+            "counter": counter
+        }]
+
+STRATEGIES = {
+    "candle": CandleDirection
+}
+
+# Function to build every strategy configured for a symbol
+def build_strategies(symbol, trading, point, counter_requires_both=True):
+    settings = trading["settings"][symbol]
+    base = dict(trading)
+    base.update({k: v for k, v in settings.items() if k != "strategies"})
+    strategies = []
+    for i, variant in enumerate(settings.get("strategies") or [{}]):
+        params = dict(base)
+        params.update(variant)
+        kind = params.get("type", "candle")
+        params["symbol"] = symbol
+        params.setdefault("name", kind if i == 0 else f"{kind}-{i}")
+        if kind not in STRATEGIES:
+            print(f"[{symbol}] Unknown strategy type: {kind}. Supported types: {list(STRATEGIES.keys())}")
+            continue
+        strategies.append(STRATEGIES[kind](params, point, counter_requires_both))
+    return strategies
+
+# Function to evaluate all strategies against one shared set of bars
+def evaluate(strategies, bars):
+    intents = []
+    for strategy in strategies:
+        intents.extend(strategy.on_bar(bars))
+    return intents
@@ -0,0 +1,160 @@
+import MetaTrader5 as mt5
+import random
+import threading
+import time
+from contextlib import nullcontext
+
+import clock
+import market_cache
+import metrics
+
+# Symbols whose ticks each heartbeat feeds to the server clock estimate
+SYNC_SYMBOLS = 3
+
+# Background thread that heartbeats the MT5 terminal and reconnects with
+# exponential backoff. After too many consecutive failures the circuit breaker
+# opens and reconnects pause for a cooldown before a single half-open attempt.
+# Its terminal calls share the lock of recorder.SerializedMT5 with the other
+# threads, and a reconnect holds that lock from shutdown to the warmed caches.
+class ConnectionSupervisor(threading.Thread):
+    def __init__(self, account, password, server, path=None, interval=5,
+                 backoff_base=1, backoff_max=60, breaker_threshold=5,
+                 breaker_cooldown=300, metrics_path="metrics.json"):
+        super().__init__(name="mt5-supervisor", daemon=True)
+        self.account = account
+        self.password = password
+        self.server = server
+        self.path = path
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.metrics_path = metrics_path
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+        self.failures = 0
+        self.down_since = None
+        self.downtime_total = 0.0
+        self._watch_lock = threading.Lock()
+        self._symbols = []
+        self._timeframe = None
+        self._idle_until = 0
+        # Assume the caller already initialized and logged in before starting us
+        self.connected.set()
+        metrics.set_gauge("mt5_connected", 1)
+        metrics.set_gauge("mt5_circuit_open", 0)
+
+    # Function to tell the supervisor which symbols to warm after reconnecting
+    def watch(self, symbols, timeframe=None):
+        with self._watch_lock:
+            self._symbols = list(symbols)
+            self._timeframe = timeframe
+
+    # Function to pause heartbeats while nothing is tradable. They resume
+    # `lead` seconds before the given timestamp so a dead connection is
+    # caught and rebuilt before the next boundary.
+    def idle_until(self, timestamp, lead=60):
+        self._idle_until = timestamp - lead
+
+    # Function to block until the terminal is connected (or timeout)
+    def wait_connected(self, timeout=None):
+        return self.connected.wait(timeout)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        print("MT5 supervisor started")
+        while not self.stopped.is_set():
+            if self._heartbeat():
+                if self.down_since is not None:
+                    # The terminal recovered on its own between attempts
+                    self._warm()
+                    self._mark_up()
+                self.stopped.wait(max(self.interval, self._idle_until - clock.time()))
+                continue
+            self._mark_down()
+            if self.failures >= self.breaker_threshold:
+                print(f"MT5 circuit breaker open after {self.failures} failed reconnects, cooling down {self.breaker_cooldown} seconds")
+                metrics.set_gauge("mt5_circuit_open", 1)
+                if self.stopped.wait(self.breaker_cooldown):
+                    break
+                # Half-open: allow exactly one attempt before opening again
+                self.failures = self.breaker_threshold - 1
+            if self._reconnect():
+                self._mark_up()
+                continue
+            self.failures += 1
+            metrics.inc("mt5_reconnect_failures")
+            delay = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_max)
+            delay += random.uniform(0, delay * 0.1)
+            print(f"MT5 reconnect attempt {self.failures} failed, retrying in {delay:.1f} seconds")
+            self.stopped.wait(delay)
+        print("MT5 supervisor stopped")
+
+    # Function to check the terminal is alive and connected to the trade server
+    def _heartbeat(self):
+        start = time.perf_counter()
+        info = mt5.terminal_info()
+        metrics.set_gauge("mt5_heartbeat_ms", (time.perf_counter() - start) * 1000)
+        if self.down_since is not None:
+            metrics.set_gauge("mt5_downtime_current_seconds", time.monotonic() - self.down_since)
+        healthy = info is not None and info.connected
+        if healthy and clock.sync_enabled():
+            self._sample_ticks()
+        metrics.write_metrics(self.metrics_path)
+        return healthy
+
+    # Function to feed the server clock estimate with a few watched symbols' ticks
+    def _sample_ticks(self):
+        with self._watch_lock:
+            symbols = self._symbols[:SYNC_SYMBOLS]
+        for symbol in symbols:
+            clock.observe_tick(symbol, mt5.symbol_info_tick(symbol))
+
+    def _mark_down(self):
+        if self.down_since is not None:
+            return
+        print("MT5 connection lost, supervisor reconnecting...")
+        self.down_since = time.monotonic()
+        self.connected.clear()
+        metrics.inc("mt5_disconnects")
+        metrics.set_gauge("mt5_connected", 0)
+
+    def _mark_up(self):
+        downtime = time.monotonic() - self.down_since
+        self.downtime_total += downtime
+        self.down_since = None
+        self.failures = 0
+        metrics.inc("mt5_reconnects")
+        metrics.set_gauge("mt5_last_downtime_seconds", downtime)
+        metrics.set_gauge("mt5_downtime_total_seconds", self.downtime_total)
+        metrics.set_gauge("mt5_downtime_current_seconds", 0)
+        metrics.set_gauge("mt5_circuit_open", 0)
+        metrics.set_gauge("mt5_connected", 1)
+        print(f"Reconnected to MT5 after {downtime:.1f} seconds")
+        self.connected.set()
+
+    # Function to re-initialize, log in and warm caches before reporting healthy
+    def _reconnect(self):
+        with getattr(mt5, "lock", None) or nullcontext():
+            mt5.shutdown()
+            initialized = mt5.initialize(path=self.path) if self.path else mt5.initialize()
+            if not initialized:
+                print(f"Failed to reconnect to MT5: {mt5.last_error()}")
+                return False
+            if not mt5.login(self.account, self.password, self.server):
+                print(f"Failed to login to MT5: {mt5.last_error()}")
+                mt5.shutdown()
+                return False
+            self._warm()
+            return True
+
+    # Function to refill symbol metadata and bar caches for watched symbols
+    def _warm(self):
+        with self._watch_lock:
+            symbols = list(self._symbols)
+            timeframe = self._timeframe
+        market_cache.clear()
+        market_cache.warm_symbols(symbols, timeframe)
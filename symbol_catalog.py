@@ -0,0 +1,180 @@
+import bisect
+import difflib
+import json
+import os
+import re
+import time
+from collections import Counter
+
+# Catalog of the broker's instruments, shared between the trading process and
+# the Telegram bot. The trader has the terminal: it dumps symbols_get() to
+# symbols.json at startup and once a day. The bot has no terminal and reads
+# that file, so validating, completing and describing a symbol the user types
+# costs no terminal round trip. Lookups go through three indexes built once
+# per load:
+#
+# - exact names, case-insensitively (brokers mix cases, e.g. "XAUUSDm")
+# - a sorted list of names reduced to letters and digits, for prefix search
+#   ("XAUUSD" finds "XAUUSDm", "XAUUSD.raw" and "#XAUUSD")
+# - trigrams of those names, for fuzzy search of typos ("XUAUSD")
+#
+# Refreshing the file from the trading loop:
+#
+#     symbol_catalog.refresh(mt5)
+
+CATALOG_PATH = "symbols.json"
+MAX_AGE = 86400
+FIELDS = ("name", "description", "path", "digits", "point", "trade_contract_size",
+          "volume_min", "volume_max", "volume_step", "trade_stops_level",
+          "currency_base", "currency_profit", "visible")
+
+# Function to reduce a symbol name to its upper-case letters and digits
+def search_key(name):
+    return re.sub(r'[^A-Z0-9]', '', name.upper())
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SymbolCatalog:
+    def __init__(self, symbols, built=None):
+        self.symbols = symbols
+        self.built = built
+        self.by_name = {}
+        for entry in symbols:
+            self.by_name.setdefault(entry["name"].upper(), entry)
+        # (search key, entry index) pairs, sorted for bisecting a prefix range
+        self.keys = sorted((search_key(entry["name"]), i) for i, entry in enumerate(symbols))
+        self.grams = {}
+        self.gram_counts = [0] * len(symbols)
+        for key, i in self.keys:
+            grams = trigrams(key)
+            self.gram_counts[i] = len(grams)
+            for gram in grams:
+                self.grams.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    # Function to find a symbol by its exact name, ignoring case
+    def get(self, name):
+        return self.by_name.get(name.strip().upper())
+
+    # Function to list symbols whose name starts with the given text,
+    # shortest first so "XAUUSD" ranks "XAUUSDm" before "XAUUSDm.pro"
+    def complete(self, text, limit=10):
+        prefix = search_key(text)
+        if not prefix:
+            return []
+        lo = bisect.bisect_left(self.keys, (prefix,))
+        matches = []
+        for key, i in self.keys[lo:]:
+            if not key.startswith(prefix):
+                break
+            matches.append((len(key), key, i))
+        matches.sort()
+        return [self.symbols[i] for _, _, i in matches[:limit]]
+
+    # Function to find symbols close to a misspelt name by shared trigrams;
+    # the best candidates are re-ranked by edit similarity and then by
+    # letters missing, which orders swapped letters ("XUAUSD") better than
+    # trigrams do
+    def fuzzy(self, text, limit=10, min_score=0.3):
+        key = search_key(text)
+        if not key:
+            return []
+        query = trigrams(key)
+        shared = {}
+        for gram in query:
+            for i in self.grams.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+        scored = []
+        for i, count in shared.items():
+            # Dice coefficient over trigram sets
+            score = 2 * count / (len(query) + self.gram_counts[i])
+            if score >= min_score:
+                scored.append((-score, self.symbols[i]["name"], i))
+        scored.sort()
+        letters = Counter(key)
+        candidates = []
+        for score, name, i in scored[:limit * 4]:
+            candidate = search_key(name)
+            similarity = difflib.SequenceMatcher(None, key, candidate).ratio()
+            missing = sum((letters - Counter(candidate)).values())
+            candidates.append((-similarity, missing, score, name, i))
+        candidates.sort()
+        return [self.symbols[i] for *_, i in candidates[:limit]]
+
+    # Function to suggest symbols for what the user typed: completions
+    # first, then fuzzy matches
+    def search(self, text, limit=10):
+        results = self.complete(text, limit)
+        if len(results) < limit:
+            seen = set(entry["name"] for entry in results)
+            results += [entry for entry in self.fuzzy(text, limit) if entry["name"] not in seen][:limit - len(results)]
+        return results
+
+# Function to describe a symbol's contract in one line
+def describe(entry):
+    parts = [entry["name"]]
+    if entry.get("description") and entry["description"] != entry["name"]:
+        parts.append(entry["description"])
+    parts.append(f"digits {entry['digits']}, point {entry['point']:g}")
+    if entry.get("trade_contract_size") is not None:
+        parts.append(f"contract {entry['trade_contract_size']:g}")
+    if entry.get("volume_min") is not None:
+        parts.append(f"lots {entry['volume_min']:g}-{entry['volume_max']:g} step {entry['volume_step']:g}")
+    if entry.get("trade_stops_level"):
+        parts.append(f"stops level {entry['trade_stops_level']} points")
+    return " | ".join(parts)
+
+# Function to dump the terminal's symbols to the catalog file. terminal is
+# the MetaTrader5 module or a gateway client.
+def build(terminal, path=CATALOG_PATH):
+    infos = terminal.symbols_get()
+    if infos is None:
+        print(f"Failed to get symbols for the catalog: {terminal.last_error()}")
+        return None
+    symbols = [{field: getattr(info, field, None) for field in FIELDS} for info in infos]
+    catalog = {"built": time.time(), "symbols": symbols}
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(catalog, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing symbol catalog: {e}")
+        return None
+    print(f"Symbol catalog updated: {len(symbols)} symbols")
+    return SymbolCatalog(symbols, catalog["built"])
+
+# Function to rebuild the catalog file when it is missing or older than max_age
+def refresh(terminal, path=CATALOG_PATH, max_age=MAX_AGE):
+    try:
+        if time.time() - os.path.getmtime(path) < max_age:
+            return False
+    except OSError:
+        pass
+    return build(terminal, path) is not None
+
+_loaded = {}
+
+# Function to load the catalog file, re-reading it only after it changed.
+# Returns None when no catalog has been written yet.
+def load(path=CATALOG_PATH):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error reading symbol catalog: {e}")
+        return cached[1] if cached is not None else None
+    catalog = SymbolCatalog(data["symbols"], data.get("built"))
+    _loaded[path] = (mtime, catalog)
+    return catalog
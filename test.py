@@ -1,10 +1,29 @@
+import recorder
+recorder.install_from_env()
+
 import MetaTrader5 as mt5
-import time
 import json
 import os
-from datetime import datetime, timedelta, timezone, time as dt_time
+from datetime import datetime, timedelta, timezone
 from filelock import FileLock
 
+import clock
+import copytrade
+import execution
+import exposure
+import indicators
+import market_cache
+import metrics
+import prices
+import profiler
+import sessions
+import strategies
+import symbol_catalog
+import throttle
+import tracing
+import warmstart
+from supervisor import ConnectionSupervisor
+
 timeframe_map = {
     "M1": mt5.TIMEFRAME_M1,
     "M5": mt5.TIMEFRAME_M5,
@@ -13,6 +32,19 @@ timeframe_map = {
     "H1": mt5.TIMEFRAME_H1
 }
 
+WARM_START_PATH = "warmstart.json"
+WARM_START_SAVE_INTERVAL = 60
+
+# Bar availability polling: first retry after 1ms, doubling up to 20ms,
+# giving up BAR_WAIT_MS after the call
+BAR_WAIT_MS = 3000
+BAR_POLL_MIN = 0.001
+BAR_POLL_MAX = 0.02
+
+# How long a counter order placed without its main trade (stale_action
+# "counter_only") is kept from the orphan sweep, unless it fills first
+COUNTER_ONLY_TTL_MINUTES = 60
+
 timeframe_duration = {
     "M1": 1,
     "M5": 5,
@@ -36,7 +68,7 @@ def read_config():
         return None
 
 def get_next_run_time(duration_minutes):
-    now = datetime.now(timezone.utc)
+    now = clock.now()
     minutes = now.minute
     remainder = minutes % duration_minutes
     if remainder == 0 and now.second == 0 and now.microsecond == 0:
@@ -53,50 +85,125 @@ def get_next_run_time(duration_minutes):
 # Function to check if symbol is available
 def check_symbol(symbol):
     print(f"[{symbol}] Checking symbol availability")
-    symbol_info = mt5.symbol_info(symbol)
+    symbol_info = market_cache.get_symbol_info(symbol)
     if symbol_info is None or not symbol_info.visible:
         print(f"[{symbol}] Symbol is not available or not visible in MT5")
         return False
     return True
 
-# Function to get the previous completed candle for the given timeframe
-def get_previous_candle(symbol, timeframe, retries=3, delay=5):
+# Function to get the bar that closed at the given boundary (default: the
+# latest boundary). MT5 returns bars oldest first and only creates the next
+# bar once its first tick arrives, so the closed bar is final when a bar
+# opening at the boundary shows up. Polls at millisecond cadence with a short
+# backoff until then, bounded by deadline_ms; never returns any other bar.
+def get_previous_candle(symbol, timeframe, boundary=None, deadline_ms=BAR_WAIT_MS, history=1):
     print(f"[{symbol}] Fetching previous candle for timeframe {timeframe}")
-    duration_minutes = [v for k, v in timeframe_duration.items() if timeframe_map[k] == timeframe][0]
-    for attempt in range(1, retries + 1):
-        rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, 2)
-        if rates is not None and len(rates) >= 2:
-            current_candle = rates[0]
-            previous_candle = rates[1]
-            open_time = datetime.fromtimestamp(previous_candle['time'], tz=timezone.utc)
-            close_time = open_time + timedelta(minutes=duration_minutes)
-            current_time = datetime.fromtimestamp(current_candle['time'], tz=timezone.utc)
-            if close_time != current_time:
-                print(f"[{symbol}] Warning: Expected close_time {close_time}, got {current_time}. Using calculated close_time.")
-            if close_time <= open_time or (datetime.now(timezone.utc) - close_time).total_seconds() > duration_minutes * 60 * 2:
-                print(f"[{symbol}] Invalid candle timestamps: open_time={open_time}, close_time={close_time}")
-                return None
-            print(f"[{symbol}] Candle details: Open time={open_time}, Close time={close_time}, Open={previous_candle['open']}, Close={previous_candle['close']}")
-            return {
-                "open": previous_candle['open'],
-                "close": previous_candle['close'],
-                "open_time": open_time,
-                "close_time": close_time
-            }
-        error = mt5.last_error()
-        print(f"[{symbol}] Attempt {attempt}/{retries} failed to get candle data. MT5 error: {error}")
-        if attempt < retries:
-            print(f"[{symbol}] Retrying in {delay} seconds...")
-            time.sleep(delay)
-    print(f"[{symbol}] Failed to fetch candle data after {retries} attempts")
+    duration = timedelta(minutes=[v for k, v in timeframe_duration.items() if timeframe_map[k] == timeframe][0])
+    seconds = int(duration.total_seconds())
+    if boundary is None:
+        boundary = datetime.fromtimestamp(int(clock.time()) // seconds * seconds, tz=timezone.utc)
+    # Bar times are in server time, which is UTC plus the broker's zone
+    zone = clock.server_zone()
+    boundary_ts = int(boundary.timestamp()) + zone
+    expected_open = boundary_ts - seconds
+    # Catching up a boundary that is already behind needs the bars since then too
+    behind = max(0, int((clock.time() - boundary.timestamp()) // seconds))
+    deadline = clock.monotonic() + deadline_ms / 1000
+    delay = BAR_POLL_MIN
+    polls = 0
+    while True:
+        polls += 1
+        rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, history + 1 + behind)
+        if rates is not None and len(rates) > 0:
+            latest = int(rates[-1]['time'])
+            if latest > boundary_ts:
+                # Already past the next boundary: only the exact bar will do
+                closed = [i for i in range(len(rates)) if int(rates[i]['time']) == expected_open]
+                if not closed:
+                    print(f"[{symbol}] Bar for {boundary} is no longer among the latest bars, skipping")
+                    metrics.inc("bar_wait_missed")
+                    return None
+                return _make_candle(symbol, rates, closed[0], history, duration, polls, boundary, zone)
+            if latest == boundary_ts:
+                if len(rates) < 2 or int(rates[-2]['time']) != expected_open:
+                    print(f"[{symbol}] No bar opened at {boundary - duration} (no ticks in that period), skipping")
+                    metrics.inc("bar_wait_missed")
+                    return None
+                return _make_candle(symbol, rates, len(rates) - 2, history, duration, polls, boundary, zone)
+        if clock.monotonic() >= deadline:
+            break
+        clock.sleep(min(delay, max(0, deadline - clock.monotonic())))
+        delay = min(delay * 2, BAR_POLL_MAX)
+    if rates is not None and len(rates) > 0 and int(rates[-1]['time']) == expected_open and clock.now() >= boundary:
+        # No tick since the boundary: the bar is closed, just not confirmed by a newer one
+        print(f"[{symbol}] No new bar {deadline_ms}ms after {boundary}, using the unconfirmed closed bar")
+        metrics.inc("bar_wait_unconfirmed")
+        return _make_candle(symbol, rates, len(rates) - 1, history, duration, polls, boundary, zone)
+    print(f"[{symbol}] Bar for {boundary} not available after {polls} polls in {deadline_ms}ms. MT5 error: {mt5.last_error()}")
+    metrics.inc("bar_wait_timeouts")
     return None
 
+# Function to build the candle dict for rates[index] and the closed bars up to it
+def _make_candle(symbol, rates, index, history, duration, polls, boundary, zone=0):
+    bars = []
+    for bar in rates[max(0, index - history + 1):index + 1]:
+        open_time = datetime.fromtimestamp(int(bar['time']) - zone, tz=timezone.utc)
+        bars.append({
+            "open": bar['open'],
+            "high": bar['high'],
+            "low": bar['low'],
+            "close": bar['close'],
+            "open_time": open_time,
+            "close_time": open_time + duration
+        })
+    candle = dict(bars[-1])
+    # Closed bars, oldest first, for the strategies
+    candle["bars"] = bars
+    wait_ms = (clock.now() - boundary).total_seconds() * 1000
+    metrics.set_gauge(f"bar_wait_ms.{symbol}", wait_ms)
+    print(f"[{symbol}] Candle details: Open time={candle['open_time']}, Close time={candle['close_time']}, Open={candle['open']}, Close={candle['close']} ({polls} polls, {wait_ms:.0f}ms after close)")
+    return candle
+
+# Function to decide what to do with a signal given its age at send time.
+# Returns "send", "counter_only" or "skip" and counts every decision.
+def check_signal_age(symbol, close_time, settings, trading, counter_possible=True):
+    budget_ms = settings.get("latency_budget_ms", trading.get("latency_budget_ms"))
+    age_ms = (clock.now() - close_time).total_seconds() * 1000
+    metrics.set_gauge(f"signal_age_ms.{symbol}", age_ms)
+    if budget_ms is None or age_ms <= budget_ms:
+        decision = "send"
+    else:
+        decision = settings.get("stale_action", trading.get("stale_action", "skip"))
+        if decision not in ("skip", "counter_only"):
+            print(f"[{symbol}] Invalid stale_action: {decision}. Must be 'skip' or 'counter_only', skipping")
+            decision = "skip"
+        if decision == "counter_only" and not counter_possible:
+            decision = "skip"
+        print(f"[{symbol}] Signal is stale: age={age_ms:.0f}ms exceeds budget={budget_ms}ms, action={decision}")
+    metrics.inc(f"signal_{decision}")
+    metrics.inc(f"signal_{decision}.{symbol}")
+    return decision
+
 # Function to open main trade
-def open_trade(symbol, trade_type, volume, D_tp, D_sl, magic):
+def open_trade(symbol, trade_type, volume, D_tp, D_sl, magic, deadline=None, scale=None):
+    if deadline is None:
+        deadline = execution.deadline_in()
+    if scale is None:
+        scale = prices.scale_for(market_cache.get_symbol_info(symbol))
     tp_distance = D_tp 
     sl_distance = D_sl
-    tick = mt5.symbol_info_tick(symbol)
+    with tracing.span("tick", symbol, magic) as span:
+        tick = mt5.symbol_info_tick(symbol)
+        span["price"] = (tick.ask if trade_type == mt5.ORDER_TYPE_BUY else tick.bid) if tick is not None else None
+    if tick is None:
+        print(f"[{symbol}] Failed to get tick for main trade")
+        return None
     price = tick.ask if trade_type == mt5.ORDER_TYPE_BUY else tick.bid
+    sl_estimate = scale.add(price, -sl_distance) if trade_type == mt5.ORDER_TYPE_BUY else scale.add(price, sl_distance)
+    reason = exposure.book.check(symbol, trade_type, volume, price, sl_estimate)
+    if reason is not None:
+        print(f"[{symbol}] Main trade blocked by exposure limit: {reason}")
+        return None
     request = {
         "action": mt5.TRADE_ACTION_DEAL,
         "symbol": symbol,
@@ -109,32 +216,40 @@ def open_trade(symbol, trade_type, volume, D_tp, D_sl, magic):
         "type_time": mt5.ORDER_TIME_GTC,
         "type_filling": mt5.ORDER_FILLING_FOK,
     }
-    result = mt5.order_send(request)
-    if result.retcode != mt5.TRADE_RETCODE_DONE:
-        print(f"[{symbol}] Failed to open trade: retcode={result.retcode}, comment={result.comment}")
+    result, attempts = execution.send_order(request, deadline, reprice=execution.reprice_from_tick)
+    if result is None:
+        print(f"[{symbol}] Failed to open trade after {len(attempts)} attempt(s): retcode={attempts[-1]['retcode']}, comment={attempts[-1]['comment']}")
         return None
     
     opening_price = result.price
     position_id = result.order
-    tp = opening_price + tp_distance if trade_type == mt5.ORDER_TYPE_BUY else opening_price - tp_distance
-    sl = opening_price - sl_distance if trade_type == mt5.ORDER_TYPE_BUY else opening_price + sl_distance
+    # Offsets in whole points, converted back to a price only for the request
+    tp = scale.add(opening_price, tp_distance) if trade_type == mt5.ORDER_TYPE_BUY else scale.add(opening_price, -tp_distance)
+    sl = scale.add(opening_price, -sl_distance) if trade_type == mt5.ORDER_TYPE_BUY else scale.add(opening_price, sl_distance)
+    exposure.book.add(position_id, symbol, trade_type, volume, opening_price, sl)
     modify_request = {
         "action": mt5.TRADE_ACTION_SLTP,
         "symbol": symbol,
         "position": position_id,
+        "magic": magic,
         "tp": tp,
         "sl": sl,
     }
-    modify_result = mt5.order_send(modify_request)
-    if modify_result.retcode != mt5.TRADE_RETCODE_DONE:
-        print(f"[{symbol}] Failed to set TP/SL: retcode={modify_result.retcode}")
+    # The position is open at this point, so protecting it gets a fresh budget
+    modify_result, modify_attempts = execution.send_order(modify_request, execution.deadline_in())
+    if modify_result is None:
+        print(f"[{symbol}] Failed to set TP/SL: retcode={modify_attempts[-1]['retcode']}")
     else:
         print(f"[{symbol}] Trade opened: price={opening_price}, tp={tp}, sl={sl}, magic={magic}")
     return result
 
 # Function to place pending counter order
-def place_pending_order(symbol, order_type, volume, price, tp, sl_counter, magic):
+def place_pending_order(symbol, order_type, volume, price, tp, sl_counter, magic, deadline=None, reprice=None):
     print(f"[{symbol}] Placing pending order: type={order_type}, volume={volume}, price={price}, tp={tp}, magic={magic}")
+    reason = exposure.book.check(symbol, order_type, volume, price, sl_counter)
+    if reason is not None:
+        print(f"[{symbol}] Pending order blocked by exposure limit: {reason}")
+        return None
     request = {
         "action": mt5.TRADE_ACTION_PENDING,
         "symbol": symbol,
@@ -149,33 +264,304 @@ def place_pending_order(symbol, order_type, volume, price, tp, sl_counter, magic
         "type_time": mt5.ORDER_TIME_GTC,
         "type_filling": mt5.ORDER_FILLING_RETURN,
     }
-    result = mt5.order_send(request)
-    if result.retcode != mt5.TRADE_RETCODE_DONE:
-        print(f"[{symbol}] Failed to place pending order: retcode={result.retcode}, comment={result.comment}")
+    result, attempts = execution.send_order(request, deadline, reprice=reprice)
+    if result is None:
+        print(f"[{symbol}] Failed to place pending order after {len(attempts)} attempt(s): retcode={attempts[-1]['retcode']}, comment={attempts[-1]['comment']}")
     else:
-        print(f"[{symbol}] Pending order placed successfully: price={price}, magic={magic}")
+        print(f"[{symbol}] Pending order placed successfully: price={request['price']}, magic={magic}")
+        exposure.book.add(result.order, symbol, order_type, volume, request["price"], request["sl"])
     return result
 
-# Function to check and reconnect MT5 if necessary
-def check_mt5_connection():
-    print("Checking MT5 connection")
-    if not mt5.terminal_info():
-        print("MT5 connection lost, attempting to reconnect...")
-        if not mt5.initialize():
-            print("Failed to reconnect to MT5")
-            return False
-        if not mt5.login(account, password, server):
-            print("Failed to login to MT5")
-            mt5.shutdown()
-            return False
-        print("Reconnected to MT5")
+# Function to forget counter-only magics whose time is up or whose counter
+# filled; from then on they are swept like any other magic
+def expire_counter_only(counter_only, position_magics):
+    now = clock.time()
+    for magic, until in list(counter_only.items()):
+        if until <= now or int(magic) in position_magics:
+            del counter_only[magic]
+
+# Function to cancel pending counter orders whose main position is gone and
+# reconcile the exposure book. Counters placed on purpose without a main
+# trade are listed in counter_only (magic -> expiry time) and left alone.
+# Cancels go through the housekeeping lane of the order throttle; those
+# without a slot before the monotonic deadline wait for the next sweep.
+# Returns the positions and remaining orders.
+def cancel_orphan_orders(deadline=None, counter_only=None):
+    positions = mt5.positions_get() or []
+    position_magics = set(pos.magic for pos in positions)
+    if counter_only:
+        expire_counter_only(counter_only, position_magics)
+    orders = mt5.orders_get() or []
+    canceled = set()
+    # Cancel spans are collected here and handed to tracing in one batch
+    spans = []
+    for order in orders:
+        if order.magic not in position_magics:
+            if counter_only and str(order.magic) in counter_only:
+                continue
+            if not throttle.acquire(order.symbol, throttle.HOUSEKEEPING, deadline):
+                print("No order slot left before the deadline, deferring the remaining cancels")
+                break
+            request = {
+                "action": mt5.TRADE_ACTION_REMOVE,
+                "order": order.ticket
+            }
+            started = clock.monotonic()
+            result = mt5.order_send(request)
+            spans.append((order.magic, "cancel", order.symbol, started, clock.monotonic(),
+                          {"retcode": result.retcode if result is not None else None, "price": order.price_open}))
+            throttle.feedback(result)
+            if result is None:
+                # Terminal unreachable: the rest would fail too, the next sweep retries them
+                print(f"Failed to cancel pending order {order.ticket} (magic={order.magic}) with no matching position: {mt5.last_error()}")
+                break
+            # One line per orphan: the sweep can cancel thousands at once
+            if result.retcode == mt5.TRADE_RETCODE_DONE:
+                print(f"Canceled pending order {order.ticket} (magic={order.magic}), no matching position")
+                canceled.add(order.ticket)
+            else:
+                print(f"Failed to cancel pending order {order.ticket} (magic={order.magic}) with no matching position: {result.comment}")
+    tracing.record(spans)
+    if canceled:
+        orders = [order for order in orders if order.ticket not in canceled]
+    exposure.book.reconcile(positions, orders)
+    exposure.book.publish()
+    return positions, orders
+
+# Function to evaluate one symbol's previous candle and trade it.
+# state holds the magic counter, last processed bars and the warm start.
+def process_symbol(symbol, config, timeframe, state, run_time=None):
+    trading = config["trading"]
+    execution_deadline_ms = trading.get("execution_deadline_ms", execution.DEFAULT_DEADLINE_MS)
+    print(f"Processing symbol: {symbol}")
+    if symbol not in trading["settings"]:
+        print(f"[{symbol}] Settings not found in config, skipping")
+        return
+    settings = trading["settings"][symbol]
+    volume = settings["volume"]
+    D_tp = settings["tp"]
+    D_sl = settings["sl"]
+    D_counter = settings["counter"]
+    D_tp_counter = settings["tp_counter"]
+    sl_counter = settings["sl_counter"]
+    print(f"[{symbol}] Using volume: {volume}, D_tp: {D_tp}, D_sl: {D_sl}, D_counter: {D_counter}, D_tp_counter: {D_tp_counter}")
+
+    # Check symbol availability
+    if not check_symbol(symbol):
+        print(f"[{symbol}] Skipping due to unavailable symbol")
+        return
+
+    # Get candle data; spans until the magic is known are kept for bind()
+    tracing.begin(symbol)
+    with tracing.span("candle", symbol) as span:
+        candle_data = get_previous_candle(symbol, timeframe, run_time, trading.get("bar_wait_ms", BAR_WAIT_MS))
+        span["price"] = candle_data["close"] if candle_data is not None else None
+    if candle_data is None:
+        print(f"[{symbol}] Skipping due to failure in fetching candle data")
+        return
+
+    # Don't act twice on the same bar, e.g. right after a restart
+    bar_time = int(candle_data['open_time'].timestamp())
+    last_bars = state["last_bars"]
+    if last_bars.get(symbol, 0) >= bar_time:
+        print(f"[{symbol}] Bar {candle_data['open_time']} already processed, skipping")
+        return
+    last_bars[symbol] = bar_time
+
+    # Fetch symbol info for price formatting
+    print(f"[{symbol}] Fetching symbol info")
+    symbol_info = market_cache.get_symbol_info(symbol)
+    if symbol_info is None:
+        print(f"[{symbol}] Failed to get symbol info")
+        return
+    print(f"[{symbol}] Symbol info retrieved: digits={symbol_info.digits}, point={symbol_info.point}")
+
+    # Format prices with symbol-specific decimal places
+    digits = symbol_info.digits
+    open_price = f"{candle_data['open']:.{digits}f}"
+    close_price = f"{candle_data['close']:.{digits}f}"
+    print(f"[{symbol}] Previous candle: Open time={candle_data['open_time']}, Close time={candle_data['close_time']}, Open={open_price}, Close={close_price}")
+
+    # Volatility filters read rolling indicators updated with this bar
+    if indicators.filter_enabled(trading, settings):
+        update_indicators(symbol, timeframe, trading, settings, candle_data, state)
+
+    # Evaluate every strategy configured for the symbol on the same bar
+    strategies_for_symbol = strategies.build_strategies(symbol, trading, symbol_info.point)
+    intents = strategies.evaluate(strategies_for_symbol, candle_data["bars"])
+    if not intents:
+        print(f"[{symbol}] No trade intents for this bar")
+        return
+
+    # Get current tick data
+    print(f"[{symbol}] Fetching tick data")
+    with tracing.span("tick", symbol) as span:
+        tick = mt5.symbol_info_tick(symbol)
+        span["price"] = tick.bid if tick is not None else None
+    if tick is None:
+        print(f"[{symbol}] Failed to get tick price, market might be closed")
+        return
+    clock.observe_tick(symbol, tick)
+    print(f"[{symbol}] Tick data: bid={tick.bid}, ask={tick.ask}")
+
+    # Drop or degrade signals whose bar closed too long ago
+    counter_possible = any(intent["counter"] is not None for intent in intents)
+    decision = check_signal_age(symbol, candle_data['close_time'], settings, trading, counter_possible)
+    if decision == "skip":
+        return
+    send_main = decision == "send"
+
+    # All sends for this bar share one deadline so a hopeless
+    # retry can't hold up the symbols after it
+    deadline = execution.deadline_in(execution_deadline_ms)
+    scale = prices.scale_for(symbol_info)
+    counter_only_until = clock.time() + settings.get("counter_only_ttl_minutes", trading.get("counter_only_ttl_minutes", COUNTER_ONLY_TTL_MINUTES)) * 60
+    for intent in intents:
+        # The warm-start validation may have found a higher magic on the terminal
+        magic = max(state["magic_counter"], state["warm_start"].magic_counter)
+        state["magic_counter"] = magic + 1
+        if not send_main and intent["counter"] is not None:
+            # No main position will hold this counter, keep it from the sweep
+            state.setdefault("counter_only", {})[str(magic)] = counter_only_until
+        tracing.bind(symbol, magic, strategy=intent["strategy"], side=intent["side"], decision=decision)
+        # Followers start on their own threads while the leader trades
+        copytrade.dispatch(symbol, intent, magic, deadline, send_main)
+        execute_intent(symbol, intent, tick, magic, deadline, send_main, scale)
+
+# Function to fold the closed bar into the symbol's indicators and attach
+# their values to it. A new engine is seeded once from the history up to this
+# bar; after that each cycle costs one update and no extra fetch. Bars missed
+# while the bot was down are fetched and folded in first, or the engine is
+# reseeded when it is further behind than its warm-up.
+def update_indicators(symbol, timeframe, trading, settings, candle_data, state):
+    engines = state.setdefault("indicators", {})
+    params = indicators.engine_params(trading, settings)
+    engine, is_new = indicators.get_engine(engines, symbol, timeframe, params)
+    # The engine keys bars by server time, like the history it was seeded from
+    candle_open = int(candle_data['open_time'].timestamp()) + clock.server_zone()
+    bar_seconds = int((candle_data['close_time'] - candle_data['open_time']).total_seconds())
+    warmup = max(params["atr_period"], params["range_period"] * 3, params["body_window"])
+    missed = (candle_open - engine.last_time) // bar_seconds - 1 if not is_new else 0
+    if missed > warmup:
+        # Down for longer than the warm-up: start over from history
+        print(f"[{symbol}] Indicators are {missed} bars behind, reseeding")
+        engine = engines[f"{symbol}:{timeframe}"] = indicators.IndicatorEngine(**params)
+        is_new = True
+    if is_new or missed > 0:
+        count = warmup if is_new else missed
+        print(f"[{symbol}] {'Seeding' if is_new else 'Catching up'} indicators from {count} bars of history")
+        # Anchored at this bar rather than the newest one, which may be
+        # several bars ahead when a missed boundary is caught up. Bars the
+        # engine already has are skipped by update().
+        history = mt5.copy_rates_from(symbol, timeframe, candle_open, count + 1)
+        for bar in history if history is not None else []:
+            if int(bar["time"]) < candle_open:
+                engine.update(bar)
+    engine.update({
+        "time": candle_open,
+        "open": candle_data['open'],
+        "high": candle_data['high'],
+        "low": candle_data['low'],
+        "close": candle_data['close']
+    })
+    values = engine.values()
+    print(f"[{symbol}] Indicators: atr={values['atr']}, range_ema={values['range_ema']}, body_percentile={values['body_percentile']}")
+    candle_data["bars"][-1]["indicators"] = values
+
+# Function to send one strategy intent: the main market order, then its
+# counter stop order on the opposite side of the signal tick
+def execute_intent(symbol, intent, tick, magic, deadline=None, send_main=True, scale=None):
+    if intent["side"] == "buy":
+        trade_type, counter_type, price, base, sign = mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL_STOP, tick.ask, "ask", -1
     else:
-        print("MT5 connection is active")
-    return True
+        trade_type, counter_type, price, base, sign = mt5.ORDER_TYPE_SELL, mt5.ORDER_TYPE_BUY_STOP, tick.bid, "bid", 1
+    print(f"[{symbol}] {intent['strategy']}: {intent['side']} signal, magic={magic}")
+    if scale is None:
+        scale = prices.scale_for(market_cache.get_symbol_info(symbol))
+    result = open_trade(symbol, trade_type, intent["volume"], intent["tp"], intent["sl"], magic, deadline, scale) if send_main else None
+    counter = intent["counter"]
+    if counter is None:
+        return result
+    if result is None and send_main:
+        if counter["requires_main"]:
+            return result
+        print(f"[{symbol}] Main trade failed, proceeding to counter trade")
+    counter_price = scale.add(price, sign * counter["distance"])
+    counter_tp = scale.add(counter_price, sign * counter["tp"])
+    sl_counter_val = scale.add(price, -sign * counter["sl"])
+    reprice = execution.offset_repricer(base, sign * counter["distance"], sign * counter["tp"], -sign * counter["sl"], scale)
+    place_pending_order(symbol, counter_type, counter["volume"], counter_price, counter_tp, sl_counter_val, magic, deadline, reprice)
+    return result
+
+# Function to get how long after its close a symbol's bar may still be
+# processed, in ms. Defaults to the latency budget when stale signals are
+# skipped anyway, otherwise to one bar.
+def catch_up_ms(trading, settings, duration_minutes):
+    limit = settings.get("catch_up_ms", trading.get("catch_up_ms"))
+    if limit is not None:
+        return limit
+    budget = settings.get("latency_budget_ms", trading.get("latency_budget_ms"))
+    if budget is not None and settings.get("stale_action", trading.get("stale_action", "skip")) == "skip":
+        return budget
+    return duration_minutes * 60000
+
+# Function to order symbols by their "priority" setting, highest first;
+# equal priorities keep the config order
+def prioritized_symbols(trading):
+    settings = trading["settings"]
+    return sorted(trading["symbols"], key=lambda symbol: -settings.get(symbol, {}).get("priority", 0))
+
+# Function to list the tradable boundaries that passed after last_run_time
+# without a cycle, oldest first. Only the last max_late_ms are scanned: older
+# bars are past every symbol's catch-up limit anyway.
+def missed_boundaries(calendar, last_run_time, now, duration_minutes, max_late_ms=None):
+    missed = []
+    if last_run_time is None:
+        return missed
+    start = last_run_time
+    if max_late_ms is not None:
+        start = max(start, now - timedelta(milliseconds=max_late_ms))
+    boundary = calendar.next_boundary(start, duration_minutes)
+    while boundary is not None and boundary <= now:
+        missed.append(boundary)
+        boundary = calendar.next_boundary(boundary, duration_minutes)
+    return missed
+
+# Function to run one bar cycle over all configured symbols, highest priority
+# first, skipping symbols whose session is closed at the boundary. A symbol
+# reached after its bar's catch-up limit (an overrun cycle, or a boundary
+# caught up late) is dropped without a terminal call and counted.
+def run_cycle(config, timeframe, state, run_time=None):
+    trading = config["trading"]
+    exposure.book.set_limits(trading)
+    calendar = state.get("calendar")
+    duration_minutes = [v for k, v in timeframe_duration.items() if timeframe_map[k] == timeframe][0]
+    dropped = []
+    for symbol in prioritized_symbols(trading):
+        if calendar is not None and run_time is not None and not calendar.is_open(run_time, symbol):
+            print(f"[{symbol}] Session closed at {run_time}, skipping")
+            continue
+        if run_time is not None:
+            late_ms = (clock.now() - run_time).total_seconds() * 1000
+            limit_ms = catch_up_ms(trading, trading["settings"].get(symbol, {}), duration_minutes)
+            if late_ms > limit_ms:
+                dropped.append(symbol)
+                metrics.inc("bars_dropped")
+                metrics.inc(f"bars_dropped.{symbol}")
+                continue
+        process_symbol(symbol, config, timeframe, state, run_time)
+    exposure.book.publish()
+    if dropped:
+        print(f"Dropped the bar closing at {run_time} past its catch-up limit for {len(dropped)} symbols: {', '.join(dropped)}")
+    if run_time is not None:
+        state["last_run_time"] = run_time
 
 # Main trading loop
 if __name__ == "__main__":
-        # Initialize MT5 with the terminal path
+    # Load the warm-start image before touching the terminal
+    image = warmstart.load_image(WARM_START_PATH)
+
+    # Initialize MT5 with the terminal path
     terminal_path = r"C:\Users\Administrator\Desktop\candle\MetaTrader 5 EXNESS\terminal64.exe"
     print(f"Initializing MT5 with terminal path: {terminal_path}")
     if not mt5.initialize(path=terminal_path):
@@ -194,34 +580,58 @@ if __name__ == "__main__":
 
     print("MT5 Trading Bot Started")
 
-    # Initialize magic counter
-    print("Initializing magic counter")
-    positions = mt5.positions_get() or []
-    orders = mt5.orders_get() or []
-    print(f"Found {len(positions)} open positions and {len(orders)} pending orders")
-    all_magic = [pos.magic for pos in positions] + [order.magic for order in orders]
-    magic_counter = max(all_magic) + 1 if all_magic else 100000
-    print(f"Magic counter set to: {magic_counter}")
+    # Restore the warm-start image and validate it against the terminal in the
+    # background; a cold start has to wait for the full positions/orders scan
+    supervisor = ConnectionSupervisor(account, password, server, path=terminal_path)
+    boot_symbols = []
+    boot_timeframe = None
+    boot_config = read_config()
+    if boot_config is not None and boot_config["trading"].get("timeframe") in timeframe_map:
+        boot_symbols = boot_config["trading"]["symbols"]
+        boot_timeframe = timeframe_map[boot_config["trading"]["timeframe"]]
+        supervisor.watch(boot_symbols, boot_timeframe)
+    # Follow the broker's clock for bar boundaries once enough ticks were seen
+    clock_sync = (boot_config or {}).get("trading", {}).get("clock_sync", {})
+    if clock_sync is not False:
+        clock.enable_sync(**(clock_sync if isinstance(clock_sync, dict) else {}))
+    warm_start = warmstart.WarmStart(image, boot_symbols, boot_timeframe)
+    warm_start.start()
+    supervisor.start()
+    if image is None:
+        print("Initializing magic counter")
+        warm_start.wait_validated(None)
+    state = {
+        "magic_counter": warm_start.magic_counter,
+        "last_bars": warm_start.last_bars,
+        "warm_start": warm_start,
+        "counter_only": warm_start.counter_only,
+        "calendar": None,
+        "indicators": indicators.load_state()
+    }
+    last_image_save = clock.monotonic()
+    print(f"Magic counter set to: {state['magic_counter']}")
 
     while True:
         try:
             # Check MT5 connection
             print("Starting new iteration of main loop")
-            if not check_mt5_connection():
-                print("MT5 connection check failed, retrying in 60 seconds")
-                time.sleep(60)
+            if not supervisor.wait_connected(60):
+                print("MT5 is still reconnecting, waiting for the supervisor")
                 continue
 
             # Load and display configuration
             config = read_config()
             if config is None:
                 print("Configuration file is missing or invalid. Please check m.json.")
-                time.sleep(60)
+                # Boundaries skipped on purpose are not caught up later
+                state["last_run_time"] = None
+                clock.sleep(60)
                 continue
 
             if not config["telegram"].get("bot_enabled", True):
                 print("Bot is disabled in config, skipping trade opening")
-                time.sleep(60)
+                state["last_run_time"] = None
+                clock.sleep(60)
                 continue
 
             # Extract config values
@@ -229,144 +639,89 @@ if __name__ == "__main__":
             timeframe_str = config["trading"]["timeframe"]
             if timeframe_str not in timeframe_map:
                 print(f"Invalid timeframe: {timeframe_str}. Supported timeframes: {list(timeframe_map.keys())}")
-                time.sleep(60)
+                state["last_run_time"] = None
+                clock.sleep(60)
                 continue
             timeframe = timeframe_map[timeframe_str]
             duration_minutes = timeframe_duration[timeframe_str]
             symbols = config["trading"]["symbols"]
-            min_candle_size_points = config["trading"]["min_candle_size_points"]
-            M = config["trading"]["M"]
-            counter_trade_enabled = config["trading"]["counter_trade_enabled"]
+            supervisor.watch(symbols, timeframe)
             
-            # Extract trading hours and mode
-            start_time_str = config["trading"]["start_time"]
-            end_time_str = config["trading"]["end_time"]
             trade_mode = config["trading"]["trade_mode"]
             
-            # Parse trading hours
-            start_hour, start_min = map(int, start_time_str.split(':'))
-            end_hour, end_min = map(int, end_time_str.split(':'))
-            start_time = dt_time(start_hour, start_min)
-            end_time = dt_time(end_hour, end_min)
-            
             # Validate trade mode
             if trade_mode not in ["both", "buy_only", "sell_only"]:
                 print(f"Invalid trade_mode: {trade_mode}. Must be 'both', 'buy_only', or 'sell_only'.")
-                time.sleep(60)
+                state["last_run_time"] = None
+                clock.sleep(60)
                 continue
 
-            # Wait for the next interval based on the selected timeframe
-            next_run_time = get_next_run_time(duration_minutes)
-            print(f"Current time: {datetime.now(timezone.utc)}, Waiting for next run time: {next_run_time}")
-            while datetime.now(timezone.utc) < next_run_time:
-                positions = mt5.positions_get() or []
-                position_magics = set(pos.magic for pos in positions)
-                orders = mt5.orders_get() or []
-                for order in orders:
-                    if order.magic not in position_magics:
-                        print(f"Pending order {order.ticket} (magic={order.magic}) has no matching position, canceling")
-                        request = {
-                            "action": mt5.TRADE_ACTION_REMOVE,
-                            "order": order.ticket
-                        }
-                        result = mt5.order_send(request)
-                        if result.retcode == mt5.TRADE_RETCODE_DONE:
-                            print(f"Canceled pending order {order.ticket} for magic {order.magic}")
-                        else:
-                            print(f"Failed to cancel pending order {order.ticket}: {result.comment}")
-                time.sleep(10)
-
-            # Check if within trading hours
-            if not (start_time <= next_run_time.time() <= end_time):
-                print(f"Outside trading hours ({start_time} - {end_time}), skipping trade execution")
+            state["calendar"] = sessions.get_calendar(state.get("calendar"), config["trading"], clock.now())
+
+            # Boundaries that passed while the last cycle overran or the
+            # terminal was away: catch up what is still in time, drop the rest
+            max_late_ms = max((catch_up_ms(config["trading"], config["trading"]["settings"].get(symbol, {}), duration_minutes)
+                               for symbol in symbols), default=0)
+            missed = missed_boundaries(state["calendar"], state.get("last_run_time"), clock.now(), duration_minutes, max_late_ms)
+            if missed:
+                print(f"Missed {len(missed)} bar boundaries since {state['last_run_time']}, catching up")
+                metrics.inc("boundaries_missed", len(missed))
+                for boundary in missed:
+                    run_cycle(config, timeframe, state, boundary)
+                continue
+
+            # Sleep straight to the next bar boundary at which something is
+            # tradable; closed hours, weekends and closed sessions are skipped
+            next_run_time = state["calendar"].next_boundary(clock.now(), duration_minutes)
+            if next_run_time is None:
+                print("No tradable session in the coming week, check start_time, end_time and trading_days")
+                clock.sleep(3600)
                 continue
+            print(f"Current time: {clock.now()}, Waiting for next run time: {next_run_time}")
+            if (next_run_time - clock.now()).total_seconds() > duration_minutes * 60:
+                # Closed for us: the supervisor can stop heartbeating until shortly before
+                supervisor.idle_until(next_run_time.timestamp())
+            # The Telegram bot validates symbols against this catalog
+            symbol_catalog.refresh(mt5)
+            throttle.configure(config["trading"].get("order_throttle"))
+            tracing.configure(config.get("tracing"))
+            copytrade.configure(config.get("copy_trading"))
+            while clock.now() < next_run_time:
+                # Cancels must not hold up the orders due at the boundary
+                sweep_deadline = clock.monotonic() + (next_run_time - clock.now()).total_seconds()
+                positions, orders = cancel_orphan_orders(sweep_deadline, state["counter_only"])
+                copytrade.sweep(set(state["counter_only"]))
+                tracing.flush()
+                if clock.monotonic() - last_image_save >= WARM_START_SAVE_INTERVAL or not orders:
+                    warm_start.magic_map = warmstart.build_magic_map(positions, orders)
+                    warmstart.save_image(WARM_START_PATH, state["magic_counter"], state["last_bars"], warm_start.magic_map, state["counter_only"])
+                    last_image_save = clock.monotonic()
+                if not orders:
+                    # No pending counters left to orphan, nothing to do until the boundary
+                    clock.sleep((next_run_time - clock.now()).total_seconds())
+                    break
+                clock.sleep(min(10, (next_run_time - clock.now()).total_seconds()))
+
+            if not supervisor.wait_connected(30):
+                print("MT5 is not connected at the bar boundary, skipping trade execution")
+                continue
+
+            profiler.configure(config.get("profiling"))
+            with profiler.cycle(next_run_time, symbols):
+                run_cycle(config, timeframe, state, next_run_time)
 
-            for symbol in symbols:
-                print(f"Processing symbol: {symbol}")
-                if symbol not in config["trading"]["settings"]:
-                    print(f"[{symbol}] Settings not found in config, skipping")
-                    continue
-                settings = config["trading"]["settings"][symbol]
-                volume = settings["volume"]
-                D_tp = settings["tp"]
-                D_sl = settings["sl"]
-                D_counter = settings["counter"]
-                D_tp_counter = settings["tp_counter"]
-                sl_counter = settings["sl_counter"]
-                print(f"[{symbol}] Using volume: {volume}, D_tp: {D_tp}, D_sl: {D_sl}, D_counter: {D_counter}, D_tp_counter: {D_tp_counter}")
-
-                # Check symbol availability
-                if not check_symbol(symbol):
-                    print(f"[{symbol}] Skipping due to unavailable symbol")
-                    continue
-
-                # Get candle data
-                candle_data = get_previous_candle(symbol, timeframe)
-                if candle_data is None:
-                    print(f"[{symbol}] Skipping due to failure in fetching candle data")
-                    continue
-
-                # Fetch symbol info for price formatting
-                print(f"[{symbol}] Fetching symbol info")
-                symbol_info = mt5.symbol_info(symbol)
-                if symbol_info is None:
-                    print(f"[{symbol}] Failed to get symbol info")
-                    continue
-                print(f"[{symbol}] Symbol info retrieved: digits={symbol_info.digits}, point={symbol_info.point}")
-
-                # Format prices with symbol-specific decimal places
-                digits = symbol_info.digits
-                open_price = f"{candle_data['open']:.{digits}f}"
-                close_price = f"{candle_data['close']:.{digits}f}"
-                print(f"[{symbol}] Previous candle: Open time={candle_data['open_time']}, Close time={candle_data['close_time']}, Open={open_price}, Close={close_price}")
-
-                # Check if candle is neutral
-                point = symbol_info.point
-                min_candle_size = min_candle_size_points * point
-                candle_size = abs(candle_data['close'] - candle_data['open'])
-                print(f"[{symbol}] Candle size: {candle_size}, Minimum required size: {min_candle_size}")
-                if candle_size < min_candle_size:
-                    print(f"[{symbol}] Neutral candle, skipping trade")
-                    continue
-
-                # Get current tick data
-                print(f"[{symbol}] Fetching tick data")
-                tick = mt5.symbol_info_tick(symbol)
-                if tick is None:
-                    print(f"[{symbol}] Failed to get tick price, market might be closed")
-                    continue
-                print(f"[{symbol}] Tick data: bid={tick.bid}, ask={tick.ask}")
-
-                magic = magic_counter
-                magic_counter += 1
-                if candle_data['close'] > candle_data['open'] and (trade_mode == "both" or trade_mode == "buy_only"):
-                    trade_type = mt5.ORDER_TYPE_BUY
-                    result = open_trade(symbol, trade_type, volume, D_tp, D_sl, magic)
-                    if result is None:
-                        print(f"[{symbol}] Main trade failed, proceeding to counter trade if enabled")
-                    if counter_trade_enabled and trade_mode == "both":
-                        price = tick.ask
-                        counter_price = price - D_counter
-                        counter_tp = counter_price - D_tp_counter
-                        sl_counter_val = price + sl_counter
-                        place_pending_order(symbol, mt5.ORDER_TYPE_SELL_STOP, volume * M, counter_price, counter_tp, sl_counter_val, magic)
-                elif candle_data['close'] < candle_data['open'] and (trade_mode == "both" or trade_mode == "sell_only"):
-                    trade_type = mt5.ORDER_TYPE_SELL
-                    price = tick.bid
-                    result = open_trade(symbol, trade_type, volume, D_tp, D_sl, magic)
-                    if result is None or result.retcode != mt5.TRADE_RETCODE_DONE:
-                        continue
-                    if counter_trade_enabled and trade_mode == "both":
-                        counter_price = price + D_counter
-                        counter_tp = counter_price + D_tp_counter
-                        sl_counter_val = price - sl_counter
-                        place_pending_order(symbol, mt5.ORDER_TYPE_BUY_STOP, volume * M, counter_price, counter_tp, sl_counter_val, magic)
-                else:
-                    print(f"[{symbol}] Trade skipped: No direction or restricted by trade_mode")
+            warmstart.save_image(WARM_START_PATH, state["magic_counter"], state["last_bars"], warm_start.magic_map, state["counter_only"])
+            indicators.save_state(state["indicators"])
+            last_image_save = clock.monotonic()
+            tracing.flush()
         except KeyboardInterrupt:
             print("Bot stopped by user (KeyboardInterrupt)")
+            warmstart.save_image(WARM_START_PATH, state["magic_counter"], state["last_bars"], warm_start.magic_map, state["counter_only"])
+            indicators.save_state(state["indicators"])
+            supervisor.stop()
+            copytrade.close()
             mt5.shutdown()
             break
         except Exception as e:
             print(f"Unexpected error: {e}")
-            time.sleep(20)
\ No newline at end of file
+            clock.sleep(20)
\ No newline at end of file
@@ -0,0 +1,143 @@
+import threading
+
+import MetaTrader5 as mt5
+
+import clock
+import metrics
+
+# Token-bucket regulator in front of order_send. Every request takes a token
+# from the account bucket and one from its symbol's bucket, waiting for a
+# refill if either is empty. Two lanes share them: entries (new orders and
+# their TP/SL) always go first, while housekeeping (orphan cancels) waits as
+# long as an entry is waiting and may not spend the account's last `reserve`
+# tokens, so a sweep never eats the burst the next bar boundary needs. A
+# too-many-requests reply halves the account rate; each accepted request wins
+# back 5% of it, up to the configured rate. Configured under "trading":
+#
+#   "order_throttle": {"account_rate": 10, "account_burst": 20,
+#                      "symbol_rate": 5, "symbol_burst": 5, "reserve": 10}
+#
+# Rates are requests per second. Without the key requests are not throttled.
+
+ENTRY = 0
+HOUSEKEEPING = 1
+LANES = (ENTRY, HOUSEKEEPING)
+DEFAULTS = {"account_rate": 10, "account_burst": 20, "symbol_rate": 5, "symbol_burst": 5}
+MIN_RATE_FRACTION = 0.1
+RECOVERY = 1.05
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = clock.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Function to get how long until `count` tokens are available (0 if now)
+    def wait_time(self, now, count=1):
+        self._refill(now)
+        # Tolerate float residue so a refill that lands exactly on time counts
+        if self.tokens >= count - 1e-6:
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+class OrderThrottle:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.settings = None
+        self.account = None
+        self.symbols = {}
+        self.rate = None
+        self.waiting = [0] * len(LANES)
+
+    # Function to apply the "order_throttle" config (None disables throttling).
+    # Buckets keep their tokens when the settings didn't change.
+    def configure(self, settings):
+        if settings is not None:
+            settings = dict(DEFAULTS, **settings)
+            settings.setdefault("reserve", settings["account_burst"] // 2)
+            # Housekeeping needs reserve + 1 tokens, which must fit in the bucket
+            settings["reserve"] = min(settings["reserve"], settings["account_burst"] - 1)
+        with self._lock:
+            if settings == self.settings:
+                return
+            self.settings = settings
+            self.symbols = {}
+            self.account = None
+            if settings is not None:
+                self.rate = settings["account_rate"]
+                self.account = TokenBucket(self.rate, settings["account_burst"])
+
+    # Function to wait for a token for one request. Returns False, without
+    # taking a token, if none would be free before the monotonic deadline.
+    def acquire(self, symbol, lane=ENTRY, deadline=None):
+        if self.settings is None:
+            return True
+        with self._lock:
+            self.waiting[lane] += 1
+        waited = False
+        try:
+            while True:
+                with self._lock:
+                    settings = self.settings
+                    if settings is None:
+                        return True
+                    now = clock.monotonic()
+                    bucket = self.symbols.get(symbol)
+                    if bucket is None:
+                        bucket = self.symbols[symbol] = TokenBucket(settings["symbol_rate"], settings["symbol_burst"])
+                    if any(self.waiting[:lane]):
+                        # A more urgent request is waiting: let it have the next token
+                        wait = 1 / self.account.rate
+                    else:
+                        needed = 1 + (settings["reserve"] if lane == HOUSEKEEPING else 0)
+                        wait = max(self.account.wait_time(now, needed), bucket.wait_time(now))
+                    if wait == 0:
+                        self.account.take(now)
+                        bucket.take(now)
+                        if waited:
+                            metrics.inc(f"throttle_waits.lane{lane}")
+                        return True
+                if deadline is not None and now + wait > deadline:
+                    metrics.inc(f"throttle_deadline.lane{lane}")
+                    return False
+                waited = True
+                clock.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting[lane] -= 1
+
+    # Function to adapt the account rate to the broker's answer to a request
+    def feedback(self, result):
+        if self.settings is None or result is None:
+            return
+        with self._lock:
+            if self.account is None:
+                return
+            self.account._refill(clock.monotonic())
+            configured = self.settings["account_rate"]
+            if result.retcode == mt5.TRADE_RETCODE_TOO_MANY_REQUESTS:
+                self.rate = max(configured * MIN_RATE_FRACTION, self.rate / 2)
+                self.account.tokens = min(self.account.tokens, 0)
+                print(f"Broker says too many requests, throttling orders to {self.rate:.1f}/s")
+                metrics.inc("throttle_slowdowns")
+            elif self.rate < configured:
+                self.rate = min(configured, self.rate * RECOVERY)
+            else:
+                return
+            self.account.rate = self.rate
+            metrics.set_gauge("throttle_account_rate", self.rate)
+
+_throttle = OrderThrottle()
+configure = _throttle.configure
+acquire = _throttle.acquire
+feedback = _throttle.feedback
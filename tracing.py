@@ -0,0 +1,251 @@
+import argparse
+import atexit
+import json
+import threading
+
+import clock
+
+# Per-trade tracing. Every step of a trade is a span with its start time,
+# duration and, where it has one, the retcode and price, and every span is
+# keyed by the trade's magic number: the candle fetch and tick of the signal,
+# each order_send attempt of the main deal, its TP/SL modify and the counter
+# order, and the orphan cancel that may come hours later. Spans recorded
+# before a symbol's magic is known (candle and tick) are held until bind()
+# hands them to each magic traded on that bar; loops with many spans (the
+# orphan sweep) time them themselves and hand them over with record().
+# Spans are kept in memory as raw monotonic timestamps while orders go out;
+# flush(), after the cycle and during the wait for the next bar, turns them
+# into records with wall-clock start times and appends them to
+# traces.jsonl. Set a top-level "tracing" key to change the file or turn
+# tracing off:
+#
+#     "tracing": {"path": "traces.jsonl"}      or      "tracing": false
+#
+# Query a trade's timeline and latency breakdown, or list recent trades:
+#
+#     python tracing.py 1234
+#     python tracing.py --symbol XAUUSD --last 20
+
+TRACE_PATH = "traces.jsonl"
+# Spans held before the buffer is written out even without a flush()
+MAX_BUFFERED = 50000
+
+_encode = json.JSONEncoder().encode
+
+# One open span. Fields set on it (retcode, price, ...) are saved with it;
+# on exit it is buffered as (trace, name, symbol, start, end, fields) with
+# monotonic start and end.
+class Span:
+    __slots__ = ("tracer", "name", "symbol", "magic", "fields", "started")
+
+    def __init__(self, tracer, name, symbol, magic, fields):
+        self.tracer = tracer
+        self.name = name
+        self.symbol = symbol
+        self.magic = magic
+        self.fields = fields
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+    def update(self, fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.started = clock.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fields["error"] = str(exc)
+        self.tracer._record((self.magic, self.name, self.symbol, self.started, clock.monotonic(), self.fields))
+        return False
+
+# Stands in for a span while tracing is off
+class NullSpan:
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.path = TRACE_PATH
+        self.enabled = True
+        self.buffer = []
+        self.pending = {}
+
+    # Function to apply the "tracing" config: False disables, a dict may set the path
+    def configure(self, settings):
+        enabled = settings is not False
+        path = settings.get("path", TRACE_PATH) if isinstance(settings, dict) else TRACE_PATH
+        if path != self.path:
+            self.flush()
+        with self._lock:
+            self.path = path
+            self.enabled = enabled
+
+    # Function to buffer a finished span, or hold it for bind() without a magic
+    def _record(self, span):
+        with self._lock:
+            if span[0] is None:
+                self.pending.setdefault(span[2], []).append(span)
+                return
+            self.buffer.append(span)
+            full = len(self.buffer) >= MAX_BUFFERED
+        if full:
+            self.flush()
+
+    def _write(self, spans):
+        with self._lock:
+            self.buffer.extend(spans)
+            full = len(self.buffer) >= MAX_BUFFERED
+        if full:
+            self.flush()
+
+    # Function to append the buffered spans to the trace file
+    def flush(self):
+        with self._lock:
+            spans, self.buffer = self.buffer, []
+        if not spans:
+            return
+        # Monotonic to wall clock, once for the whole batch
+        offset = clock.time() - clock.monotonic()
+        lines = []
+        for trace, name, symbol, started, ended, fields in spans:
+            # Fixed keys formatted directly, the span's own fields appended
+            line = (f'{{"trace": {trace}, "span": {_encode(name)}, "symbol": {_encode(symbol)}, '
+                    f'"start": {started + offset:.6f}, "duration_ms": {(ended - started) * 1000:.3f}')
+            lines.append(line + (", " + _encode(fields)[1:] if fields else "}") + "\n")
+        try:
+            with open(self.path, 'a') as f:
+                f.write("".join(lines))
+        except OSError as e:
+            print(f"Error writing trace log: {e}")
+
+    # Function to start a new bar for a symbol, dropping spans never bound to a trade
+    def begin(self, symbol):
+        with self._lock:
+            self.pending[symbol] = []
+
+    # Function to open one span, used as a context manager. Without a magic
+    # the span waits in the symbol's pending list for bind().
+    def span(self, name, symbol=None, magic=None, **fields):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, symbol, magic, fields)
+
+    # Function to buffer spans the caller timed itself, as (trace, name,
+    # symbol, start, end, fields) tuples with monotonic start and end
+    def record(self, spans):
+        if self.enabled and spans:
+            self._write(spans)
+
+    # Function to attach the symbol's pending spans to a trade and record
+    # its signal (strategy, side, ...)
+    def bind(self, symbol, magic, **fields):
+        if not self.enabled:
+            return
+        with self._lock:
+            pending = self.pending.get(symbol, [])
+        spans = [(magic,) + span[1:] for span in pending]
+        now = clock.monotonic()
+        spans.append((magic, "signal", symbol, now, now, fields))
+        self._write(spans)
+
+_tracer = Tracer()
+configure = _tracer.configure
+begin = _tracer.begin
+span = _tracer.span
+bind = _tracer.bind
+record = _tracer.record
+flush = _tracer.flush
+atexit.register(flush)
+
+# Function to read spans from a trace file, optionally only one trade's
+def read_spans(path=TRACE_PATH, magic=None):
+    needle = f'"trace": {magic},' if magic is not None else None
+    spans = []
+    with open(path, 'r') as f:
+        for line in f:
+            if needle is not None and needle not in line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("trace") is not None:
+                spans.append(record)
+    spans.sort(key=lambda s: s["start"])
+    return spans
+
+# Function to format a time offset: ms for short ones, then s, then h/m
+def format_offset(ms):
+    if ms < 10000:
+        return f"{ms:.1f}ms"
+    if ms < 3600000:
+        return f"{ms / 1000:.1f}s"
+    return f"{int(ms // 3600000)}h{int(ms % 3600000 // 60000):02d}m"
+
+# Function to print one trade's timeline and where its time went
+def print_timeline(magic, spans):
+    if not spans:
+        print(f"No spans for magic {magic}")
+        return
+    first = spans[0]["start"]
+    last = max(s["start"] + s["duration_ms"] / 1000 for s in spans)
+    signal = next((s for s in spans if s["span"] == "signal"), {})
+    print(f"Trace {magic} {spans[0]['symbol']} {signal.get('strategy', '')} {signal.get('side', '')}: {len(spans)} spans over {format_offset((last - first) * 1000)}")
+    skip = ("trace", "span", "symbol", "start", "duration_ms")
+    for s in spans:
+        details = " ".join(f"{key}={value}" for key, value in s.items() if key not in skip)
+        print(f"  +{format_offset((s['start'] - first) * 1000):>9} {s['duration_ms']:>9.1f}ms  {s['span']:<8} {details}")
+    breakdown = {}
+    for s in spans:
+        total = breakdown.setdefault(s["span"], [0, 0.0])
+        total[0] += 1
+        total[1] += s["duration_ms"]
+    parts = [f"{name} {ms:.1f}ms" + (f" ({count}x)" if count > 1 else "") for name, (count, ms) in breakdown.items() if name != "signal"]
+    print(f"  Breakdown: {', '.join(parts)}")
+
+# Function to print one line per recent trade: spans, signal to last order
+def print_recent(spans, symbol=None, last=20):
+    traces = {}
+    for s in spans:
+        if symbol is None or s["symbol"] == symbol:
+            traces.setdefault(s["trace"], []).append(s)
+    for magic in sorted(traces, key=lambda m: traces[m][0]["start"])[-last:]:
+        trace = traces[magic]
+        first = trace[0]["start"]
+        sends = [s for s in trace if "retcode" in s and s["span"] != "cancel"]
+        to_orders = max((s["start"] + s["duration_ms"] / 1000 - first) * 1000 for s in sends) if sends else None
+        retcodes = ",".join(str(s["retcode"]) for s in sends)
+        print(f"{magic:>10} {trace[0]['symbol']:<10} {len(trace):>3} spans  "
+              f"orders done +{format_offset(to_orders) if to_orders is not None else '-':>8}  retcodes {retcodes or '-'}"
+              f"{'  canceled' if any(s['span'] == 'cancel' for s in trace) else ''}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show per-trade spans recorded by the trading loop")
+    parser.add_argument("magic", nargs="*", type=int, help="trades to show in full")
+    parser.add_argument("--file", default=TRACE_PATH)
+    parser.add_argument("--symbol", help="only list trades of this symbol")
+    parser.add_argument("--last", type=int, default=20, help="how many recent trades to list")
+    args = parser.parse_args()
+
+    if args.magic:
+        for magic in args.magic:
+            print_timeline(magic, read_spans(args.file, magic))
+    else:
+        print_recent(read_spans(args.file), args.symbol, args.last)
@@ -0,0 +1,107 @@
+import MetaTrader5 as mt5
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import market_cache
+
+# Symbol info fields worth persisting; the rest is refreshed on validation
+SYMBOL_FIELDS = ["name", "visible", "digits", "point", "trade_tick_size", "trade_tick_value",
+                 "trade_contract_size", "volume_min", "volume_max", "volume_step",
+                 "trade_stops_level", "trade_freeze_level"]
+
+# Function to group open positions and pending orders by magic number
+def build_magic_map(positions, orders):
+    magic_map = {}
+    for pos in positions:
+        entry = magic_map.setdefault(str(pos.magic), {"symbol": pos.symbol, "positions": [], "orders": []})
+        entry["positions"].append(pos.ticket)
+    for order in orders:
+        entry = magic_map.setdefault(str(order.magic), {"symbol": order.symbol, "positions": [], "orders": []})
+        entry["orders"].append(order.ticket)
+    return magic_map
+
+# Function to persist the warm-start image atomically
+def save_image(path, magic_counter, last_bars, magic_map, counter_only=None):
+    symbols = {}
+    for symbol, info in market_cache.cached_symbols().items():
+        symbols[symbol] = {field: getattr(info, field, None) for field in SYMBOL_FIELDS}
+    image = {
+        "saved_at": time.time(),
+        "magic_counter": magic_counter,
+        "last_bars": dict(last_bars),
+        "magic_map": magic_map,
+        "counter_only": dict(counter_only or {}),
+        "symbols": symbols
+    }
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(image, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error saving warm-start image: {e}")
+
+# Function to load a warm-start image and prime the symbol cache from it
+def load_image(path):
+    try:
+        with open(path, 'r') as f:
+            image = json.load(f)
+    except FileNotFoundError:
+        print(f"No warm-start image at {path}, starting cold")
+        return None
+    except json.JSONDecodeError as e:
+        print(f"Error reading warm-start image: {e}")
+        return None
+    for symbol, fields in image.get("symbols", {}).items():
+        market_cache.store_symbol_info(symbol, SimpleNamespace(**fields))
+    age = time.time() - image.get("saved_at", 0)
+    print(f"Loaded warm-start image: magic_counter={image['magic_counter']}, {len(image.get('symbols', {}))} symbols, age={age:.0f}s")
+    return image
+
+# Validates a loaded image against the terminal in a background thread so the
+# main loop can use the image values right away and pick up corrections later
+class WarmStart:
+    def __init__(self, image, symbols=(), timeframe=None):
+        self.magic_counter = image["magic_counter"] if image else 100000
+        self.last_bars = dict(image.get("last_bars", {})) if image else {}
+        self.magic_map = dict(image.get("magic_map", {})) if image else {}
+        # Magics of counters placed without a main trade -> expiry time
+        self.counter_only = dict(image.get("counter_only", {})) if image else {}
+        self.symbols = list(symbols)
+        self.timeframe = timeframe
+        self.validated = threading.Event()
+        self._image = image
+
+    def start(self):
+        threading.Thread(target=self._validate, name="warm-start", daemon=True).start()
+
+    # Function to wait briefly for validation before the first trade
+    def wait_validated(self, timeout):
+        return self.validated.wait(timeout)
+
+    def _validate(self):
+        start = time.perf_counter()
+        positions = mt5.positions_get() or []
+        orders = mt5.orders_get() or []
+        all_magic = [pos.magic for pos in positions] + [order.magic for order in orders]
+        if all_magic and max(all_magic) + 1 > self.magic_counter:
+            print(f"Warm-start: terminal has magic {max(all_magic)}, raising counter from {self.magic_counter}")
+            self.magic_counter = max(all_magic) + 1
+        self.magic_map = build_magic_map(positions, orders)
+        image_symbols = list(self._image.get("symbols", {}).keys()) if self._image else []
+        for symbol in image_symbols:
+            cached = market_cache.cached_symbol_info(symbol)
+            info = mt5.symbol_info(symbol)
+            if info is None:
+                print(f"[{symbol}] Warm-start: symbol no longer available")
+                market_cache.drop_symbol_info(symbol)
+                continue
+            if cached is not None and (cached.digits != info.digits or cached.point != info.point):
+                print(f"[{symbol}] Warm-start: symbol metadata changed (digits {cached.digits}->{info.digits}, point {cached.point}->{info.point})")
+        symbols = image_symbols + [s for s in self.symbols if s not in image_symbols]
+        market_cache.warm_symbols(symbols, self.timeframe)
+        print(f"Warm-start image validated in {time.perf_counter() - start:.2f}s")
+        self.validated.set()